@@ -1,16 +1,56 @@
+import time
+
+# Start of the app import, for the startup profile
+_import_started_at = time.perf_counter()
+
 from flask import Flask
-from .config import Config
-from .views.main import main_bp
-from .views.auth import auth_bp
-from .views.api import api_bp
+
+
+_environment_loaded = False
+
+
+def load_environment():
+    """Load the .env file into the environment, once per process."""
+    global _environment_loaded
+    if not _environment_loaded:
+        from dotenv import load_dotenv
+
+        load_dotenv()
+        _environment_loaded = True
+
 
 def create_app():
+    # Settings are read from the environment when app.config is first imported
+    load_environment()
+
+    # Views import the storage layer; both are loaded when the first app is created
+    from .config import Config
+    from .log import configure_logging, register_request_logging
+    from .utils.compression import register_compression
+    from .utils.metrics import register_request_metrics
+    from .utils.round_trips import register_round_trip_accounting
+    from .views.main import main_bp
+    from .views.auth import auth_bp
+    from .views.api import api_bp
+
+    configure_logging(Config)
+
     app = Flask(__name__)
     app.config.from_object(Config)
+    # After-request hooks run in reverse order, so responses are compressed last
+    register_compression(app, Config)
+    register_request_logging(app, Config)
+    register_request_metrics(app)
+    register_round_trip_accounting(app, Config)
         
     # Register blueprints
     app.register_blueprint(main_bp)
     app.register_blueprint(auth_bp)
     app.register_blueprint(api_bp, url_prefix='/api')
 
-    return app
\ No newline at end of file
+    if Config.STARTUP_PROFILE:
+        from .utils.startup import profile_first_response
+
+        profile_first_response(app, _import_started_at)
+
+    return app
@@ -0,0 +1,120 @@
+import json
+import logging
+import time
+
+from app import create_app, load_environment
+from app.config import Config
+from app.log import log_context
+from app.utils.csv_upload import UploadTooLarge, check_upload_size
+from app.utils.metrics import REQUEST_SECONDS
+from app.utils.round_trips import HEADER as ROUND_TRIPS_HEADER, count_round_trips
+
+
+def create_asgi_app(fallback=None):
+    """
+    Create the ASGI application.
+
+    POST requests to `/swan` are handled by the async SWAN handshake, so one
+    process can hold many device check-ins in flight. Every other request is
+    passed to `fallback`, by default the Flask app run through asgiref.
+
+    Serve it with uvicorn, or with gunicorn and the uvicorn worker class:
+
+        gunicorn --config gunicorn_config.py -k uvicorn.workers.UvicornWorker "app.asgi:create_asgi_app()"
+
+    Args:
+        fallback (callable, optional): The ASGI application for other requests.
+
+    Returns:
+        callable: The ASGI application.
+    """
+    load_environment()
+    if fallback is None:
+        from asgiref.wsgi import WsgiToAsgi
+
+        fallback = WsgiToAsgi(create_app())
+    from app.views.swan_async import handle_swan_post_async
+
+    async def application(scope, receive, send):
+        if scope["type"] == "lifespan":
+            await handle_lifespan(receive, send)
+        elif scope["type"] == "http" and scope["method"] == "POST" and scope["path"] == "/swan":
+            await handle_swan(handle_swan_post_async, scope, receive, send)
+        else:
+            await fallback(scope, receive, send)
+
+    return application
+
+
+async def handle_swan(handle_swan_post_async, scope, receive, send):
+    headers = {name.decode("latin-1").lower(): value.decode("latin-1") for name, value in scope["headers"]}
+    # Oversized bodies are rejected before, or as soon as, they are received
+    max_size = Config.CSV_MAX_BODY_BYTES
+    try:
+        check_upload_size(int(headers.get("content-length", 0)), max_size)
+        body = bytearray()
+        while True:
+            message = await receive()
+            body.extend(message.get("body", b""))
+            if max_size and len(body) > max_size:
+                raise UploadTooLarge(max_size)
+            if not message.get("more_body"):
+                break
+    except UploadTooLarge as exc:
+        await send_json(send, {"error": str(exc)}, 413)
+        return
+
+    started_at = time.perf_counter()
+    with log_context(imei=headers.get("wep-imei")), count_round_trips() as round_trips:
+        try:
+            payload, status = await handle_swan_post_async(headers, bytes(body))
+        except Exception:
+            logging.exception("Failed to handle SWAN request")
+            payload, status = {"error": "Internal server error"}, 500
+        if payload is None:
+            payload, status = {"error": "Unhandled command result"}, 500
+        latency = time.perf_counter() - started_at
+        REQUEST_SECONDS.observe(latency, method="POST", route="/swan", status=status)
+        logging.getLogger("app.requests").info(
+            f"POST /swan {status}",
+            extra={
+                "method": "POST",
+                "route": "/swan",
+                "status": status,
+                "latency_ms": round(latency * 1000, 3),
+                "storage": round_trips.as_dict(),
+            },
+        )
+
+    extra_headers = []
+    if Config.ROUND_TRIP_HEADER:
+        extra_headers.append((ROUND_TRIPS_HEADER.lower().encode("ascii"), round_trips.header().encode("ascii")))
+    await send_json(send, payload, status, extra_headers)
+
+
+async def send_json(send, payload, status, extra_headers=()):
+    content = json.dumps(payload).encode("utf-8")
+    response_headers = [
+        (b"content-type", b"application/json"),
+        (b"content-length", str(len(content)).encode("ascii")),
+        *extra_headers,
+    ]
+    await send({"type": "http.response.start", "status": status, "headers": response_headers})
+    await send({"type": "http.response.body", "body": content})
+
+
+async def handle_lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            from app.utils.db_utils import start_background_tasks
+
+            start_background_tasks()
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            # Write out audit messages still waiting in the write-behind queue
+            from app.utils.db_utils import stop_background_tasks
+
+            stop_background_tasks()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
@@ -12,6 +12,137 @@ class Config:
     # Example for debug mode (not for production)
     DEBUG = os.environ.get('FLASK_DEBUG', 'true') == 'true'
 
+    # Log import, app creation and first response times; fail the startup
+    # test when they take longer than the budget
+    STARTUP_PROFILE = os.environ.get('STARTUP_PROFILE', 'false') == 'true'
+    STARTUP_BUDGET_SECONDS = float(os.environ.get('STARTUP_BUDGET_SECONDS', '2.0'))
+
+    # Logging: records are written by a background thread, as JSON lines or
+    # text, to the console and to LOG_FILE, rotated by 'size' or 'time'
+    LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+    LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json')
+    LOG_FILE = os.environ.get('LOG_FILE', 'server.log')
+    LOG_ROTATION = os.environ.get('LOG_ROTATION', 'size')
+    LOG_MAX_BYTES = int(os.environ.get('LOG_MAX_BYTES', str(10 * 1024 * 1024)))
+    LOG_ROTATE_WHEN = os.environ.get('LOG_ROTATE_WHEN', 'midnight')
+    LOG_BACKUP_COUNT = int(os.environ.get('LOG_BACKUP_COUNT', '5'))
+    LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', '10000'))
+    # Leave the listener thread to `app.log.start_listener`, called by forked
+    # server workers; gunicorn_config.py enables this for the master
+    LOG_DEFER_LISTENER = os.environ.get('LOG_DEFER_LISTENER', 'false') == 'true'
+    # Fraction of requests logged with their headers, e.g. '/swan=0.01,/api/commands=1'
+    LOG_SAMPLE_RATES = os.environ.get('LOG_SAMPLE_RATES', '')
+    LOG_SAMPLE_DEFAULT_RATE = float(os.environ.get('LOG_SAMPLE_DEFAULT_RATE', '0'))
+
+    # Directory where server processes share their metrics, so /metrics
+    # reports every gunicorn worker; set by gunicorn_config.py. Each process
+    # writes a snapshot every METRICS_SYNC_INTERVAL seconds
+    METRICS_DIR = os.environ.get('METRICS_DIR', '')
+    METRICS_SYNC_INTERVAL = float(os.environ.get('METRICS_SYNC_INTERVAL', '5'))
+
+    # Return the storage round trips of each request in the X-Storage-Round-Trips header
+    ROUND_TRIP_HEADER = os.environ.get('ROUND_TRIP_HEADER', 'false') == 'true'
+
+    # Storage backend: 'firestore', 'sqlite' or 'memory'
+    STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'firestore')
+    SQLITE_PATH = os.environ.get('SQLITE_PATH', 'swan.db')
+
+    # Page sizes for listings: the default applies where paging is mandatory
+    # (meter readings); message and collection listings page only on `limit`
+    MESSAGES_PAGE_SIZE = int(os.environ.get('MESSAGES_PAGE_SIZE', '100'))
+    MESSAGES_MAX_PAGE_SIZE = int(os.environ.get('MESSAGES_MAX_PAGE_SIZE', '1000'))
+    # Set 'created_at' on messages written before it was stamped, once, when workers start
+    MESSAGES_BACKFILL_ON_START = os.environ.get('MESSAGES_BACKFILL_ON_START', 'true') == 'true'
+
+    # Reported device configs: keep a history of changes
+    DEVICE_CONFIG_HISTORY = os.environ.get('DEVICE_CONFIG_HISTORY', 'true') == 'true'
+
+    # Send only the config keys that differ from the device's reported config
+    SET_CFG_DELTA_ONLY = os.environ.get('SET_CFG_DELTA_ONLY', 'true') == 'true'
+
+    # Resolved config profiles cached in process, invalidated by a storage watch
+    CONFIG_PROFILE_CACHE_SIZE = int(os.environ.get('CONFIG_PROFILE_CACHE_SIZE', '1024'))
+    CONFIG_PROFILE_CACHE_TTL = float(os.environ.get('CONFIG_PROFILE_CACHE_TTL', '60'))
+    CONFIG_PROFILE_LISTEN = os.environ.get('CONFIG_PROFILE_LISTEN', 'true') == 'true'
+
+    # Bulk command API: items per request, writes per batch, concurrent batches
+    BULK_MAX_ITEMS = int(os.environ.get('BULK_MAX_ITEMS', '50000'))
+    BULK_BATCH_SIZE = int(os.environ.get('BULK_BATCH_SIZE', '500'))
+    BULK_WRITE_PARALLELISM = int(os.environ.get('BULK_WRITE_PARALLELISM', '8'))
+
+    # Sessions expire SESSION_TTL_SECONDS after creation ('expires_at', for a
+    # Firestore TTL policy). The compactor thread deletes finished sessions
+    # after SESSION_RETENTION_SECONDS, copying them to SESSION_ARCHIVE_COLLECTION
+    # if set, and marks sessions unchanged for SESSION_STUCK_SECONDS as errored
+    SESSION_TTL_SECONDS = float(os.environ.get('SESSION_TTL_SECONDS', str(30 * 86400)))
+    SESSION_RETENTION_SECONDS = float(os.environ.get('SESSION_RETENTION_SECONDS', '86400'))
+    SESSION_STUCK_SECONDS = float(os.environ.get('SESSION_STUCK_SECONDS', '3600'))
+    SESSION_ARCHIVE_COLLECTION = os.environ.get('SESSION_ARCHIVE_COLLECTION', '')
+    SESSION_GC_ENABLED = os.environ.get('SESSION_GC_ENABLED', 'true') == 'true'
+    SESSION_GC_INTERVAL = float(os.environ.get('SESSION_GC_INTERVAL', '300'))
+    SESSION_GC_BATCH_SIZE = int(os.environ.get('SESSION_GC_BATCH_SIZE', '500'))
+
+    # CSV uploads larger than CSV_MAX_BODY_BYTES are rejected with 413. An
+    # upload over CSV_CHUNK_BYTES is stored as 'message_chunks' documents,
+    # committed in batches of up to CSV_BATCH_BYTES
+    CSV_MAX_BODY_BYTES = int(os.environ.get('CSV_MAX_BODY_BYTES', str(32 * 1024 * 1024)))
+    CSV_CHUNK_BYTES = int(os.environ.get('CSV_CHUNK_BYTES', str(256 * 1024)))
+    CSV_BATCH_BYTES = int(os.environ.get('CSV_BATCH_BYTES', str(4 * 1024 * 1024)))
+
+    # Meter readings parsed from CSV uploads, one document per meter and UTC hour
+    METER_READINGS_ENABLED = os.environ.get('METER_READINGS_ENABLED', 'true') == 'true'
+    METER_READINGS_COLLECTION = os.environ.get('METER_READINGS_COLLECTION', 'meter_readings')
+    # Uploads waiting to have their readings stored by the background thread
+    METER_READINGS_QUEUE_SIZE = int(os.environ.get('METER_READINGS_QUEUE_SIZE', '1000'))
+
+    # Negotiated brotli, zstd or gzip compression of responses of at least
+    # COMPRESSION_MIN_SIZE bytes; responses to devices (POST /swan) only with
+    # COMPRESS_DEVICE_RESPONSES
+    COMPRESSION_ENABLED = os.environ.get('COMPRESSION_ENABLED', 'true') == 'true'
+    COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', '1024'))
+    COMPRESSION_LEVEL = int(os.environ.get('COMPRESSION_LEVEL', '6'))
+    COMPRESS_DEVICE_RESPONSES = os.environ.get('COMPRESS_DEVICE_RESPONSES', 'false') == 'true'
+
+    # Listings of these collections carry ETags from version markers, which
+    # every write to them updates, spread over COLLECTION_VERSION_SHARDS documents.
+    # Each worker writes its markers every COLLECTION_VERSION_FLUSH_INTERVAL
+    # seconds, so keep the shards at least as many as the server processes
+    ETAG_VERSIONED_COLLECTIONS = [
+        name.strip()
+        for name in os.environ.get('ETAG_VERSIONED_COLLECTIONS', 'swan_devices,command_to_swan,config_profiles').split(',')
+        if name.strip()
+    ]
+    COLLECTION_VERSION_SHARDS = int(os.environ.get('COLLECTION_VERSION_SHARDS', '8'))
+    COLLECTION_VERSION_FLUSH_INTERVAL = float(os.environ.get('COLLECTION_VERSION_FLUSH_INTERVAL', '1'))
+
+    # Write-behind queue for the 'messages' audit log
+    MESSAGE_QUEUE_ENABLED = os.environ.get('MESSAGE_QUEUE_ENABLED', 'true') == 'true'
+    MESSAGE_QUEUE_MAX_SIZE = int(os.environ.get('MESSAGE_QUEUE_MAX_SIZE', '10000'))
+    MESSAGE_QUEUE_BATCH_SIZE = int(os.environ.get('MESSAGE_QUEUE_BATCH_SIZE', '500'))
+    MESSAGE_QUEUE_FLUSH_INTERVAL = float(os.environ.get('MESSAGE_QUEUE_FLUSH_INTERVAL', '1.0'))
+    MESSAGE_QUEUE_PUT_TIMEOUT = float(os.environ.get('MESSAGE_QUEUE_PUT_TIMEOUT', '0.05'))
+
+    # Responses to device command results, replayed to identical retries for
+    # REPLAY_CACHE_WINDOW seconds; REPLAY_CACHE_PATH shares them across workers
+    REPLAY_CACHE_ENABLED = os.environ.get('REPLAY_CACHE_ENABLED', 'true') == 'true'
+    REPLAY_CACHE_WINDOW = float(os.environ.get('REPLAY_CACHE_WINDOW', '300'))
+    REPLAY_CACHE_SIZE = int(os.environ.get('REPLAY_CACHE_SIZE', '10000'))
+    REPLAY_CACHE_PATH = os.environ.get('REPLAY_CACHE_PATH', '')
+
+    # Messages older than MESSAGE_ARCHIVE_AGE_DAYS are moved to daily gzip
+    # NDJSON partitions under MESSAGE_ARCHIVE_URL, a directory or 'gs://bucket/prefix'
+    MESSAGE_ARCHIVE_ENABLED = os.environ.get('MESSAGE_ARCHIVE_ENABLED', 'false') == 'true'
+    MESSAGE_ARCHIVE_URL = os.environ.get('MESSAGE_ARCHIVE_URL', 'archive')
+    MESSAGE_ARCHIVE_AGE_DAYS = float(os.environ.get('MESSAGE_ARCHIVE_AGE_DAYS', '30'))
+    MESSAGE_ARCHIVE_INDEX_COLLECTION = os.environ.get('MESSAGE_ARCHIVE_INDEX_COLLECTION', 'message_partitions')
+    MESSAGE_ARCHIVE_INTERVAL = float(os.environ.get('MESSAGE_ARCHIVE_INTERVAL', '3600'))
+    MESSAGE_ARCHIVE_CACHE_SIZE = int(os.environ.get('MESSAGE_ARCHIVE_CACHE_SIZE', '8'))
+
+    # Process-local index of pending 'command_to_swan' documents
+    COMMAND_CACHE_ENABLED = os.environ.get('COMMAND_CACHE_ENABLED', 'true') == 'true'
+    COMMAND_CACHE_LISTEN = os.environ.get('COMMAND_CACHE_LISTEN', 'true') == 'true'
+    COMMAND_CACHE_TTL = float(os.environ.get('COMMAND_CACHE_TTL', '30'))
+
 
 SWAN_DEFAULT_CONFIG = {
     "device_tag": "",
@@ -0,0 +1,303 @@
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+
+# Fields of the current request added to every record logged while it runs
+_log_context = contextvars.ContextVar("log_context", default=None)
+
+# Record attributes set by the logging module itself; anything else came in `extra`
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+# Headers left out of the verbose request log
+_REDACTED_HEADERS = {"authorization", "cookie", "proxy-authorization"}
+
+_listener = None
+_queue_handler = None
+# The process the listener thread runs in
+_listener_pid = None
+# Whether `start_listener` was called in this process
+_listener_wanted = False
+
+
+def bind_log_context(**fields):
+    """
+    Add fields such as `imei` or `session_id` to every record of the current request.
+
+    Outside a request the call has no effect.
+    """
+    context = _log_context.get()
+    if context is not None:
+        context.update((key, value) for key, value in fields.items() if value is not None)
+
+
+@contextmanager
+def log_context(**fields):
+    """Bind log fields for a block of work outside a Flask request, such as an ASGI request."""
+    token = _log_context.set({})
+    try:
+        bind_log_context(**fields)
+        yield
+    finally:
+        _log_context.reset(token)
+
+
+class ContextFilter(logging.Filter):
+    """Copy the fields bound to the current request onto each record."""
+
+    def filter(self, record):
+        context = _log_context.get()
+        if context:
+            for key, value in context.items():
+                if not hasattr(record, key):
+                    setattr(record, key, value)
+        return True
+
+
+class JSONFormatter(logging.Formatter):
+    """
+    Format records as one JSON object per line.
+
+    Every record has 'time', 'level', 'logger' and 'message'. Fields passed
+    in `extra` or bound with `bind_log_context`, such as 'imei',
+    'session_id' and 'latency_ms', are added as they are.
+    """
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue records for the listener thread without ever waiting.
+
+    When the queue is full the record is dropped and counted, so a slow disk
+    never holds up a request.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Render the message and traceback here; the listener only formats them
+        record = logging.makeLogRecord(vars(record))
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def _create_file_handler(config):
+    if config.LOG_ROTATION == "time":
+        return logging.handlers.TimedRotatingFileHandler(
+            config.LOG_FILE, when=config.LOG_ROTATE_WHEN, backupCount=config.LOG_BACKUP_COUNT,
+            encoding="utf-8", delay=True,
+        )
+    if config.LOG_ROTATION == "size":
+        return logging.handlers.RotatingFileHandler(
+            config.LOG_FILE, maxBytes=config.LOG_MAX_BYTES, backupCount=config.LOG_BACKUP_COUNT,
+            encoding="utf-8", delay=True,
+        )
+    raise ValueError(f"Unknown LOG_ROTATION: {config.LOG_ROTATION!r}")
+
+
+def configure_logging(config):
+    """
+    Send log records through a queue to a background thread that writes them.
+
+    Request threads only put records on a bounded queue; a `QueueListener`
+    thread formats them and writes them to the console and to LOG_FILE,
+    which is rotated by size or by time. Records are JSON lines unless
+    LOG_FORMAT is 'text'.
+
+    Called by `create_app`; logging is configured once per process however
+    many apps are created. With LOG_DEFER_LISTENER, as in a gunicorn master
+    that preloads the app, the listener thread is not started: records are
+    written by the handlers directly until `start_listener` runs in a
+    forked worker, so no thread holds the queue's lock when the master
+    forks. With several workers, each one rotates the log file it writes to.
+
+    Args:
+        config (type): The configuration class.
+    """
+    global _listener, _queue_handler
+    if _listener is not None:
+        return
+
+    if config.LOG_FORMAT == "json":
+        formatter = JSONFormatter()
+    else:
+        formatter = logging.Formatter("%(asctime)s - %(message)s", datefmt="%Y-%m-%d %H:%M:%S")
+
+    handlers = [logging.StreamHandler(sys.stderr)]
+    if config.LOG_FILE:
+        handlers.append(_create_file_handler(config))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    queue_handler = NonBlockingQueueHandler(queue.Queue(config.LOG_QUEUE_SIZE))
+    queue_handler.addFilter(ContextFilter())
+
+    root = logging.getLogger()
+    root.setLevel(config.LOG_LEVEL)
+
+    _queue_handler = queue_handler
+    _listener = logging.handlers.QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+    atexit.register(stop_logging)
+    if config.LOG_DEFER_LISTENER and not _listener_wanted:
+        for handler in handlers:
+            root.addHandler(handler)
+    else:
+        _start_listener()
+
+
+def start_listener():
+    """
+    Start the listener thread in this process, once logging is configured.
+
+    Called by the `post_fork` server hook. When the app is only loaded after
+    the fork, `configure_logging` starts the listener itself.
+    """
+    global _listener_wanted
+    _listener_wanted = True
+    if _listener is not None and _listener_pid != os.getpid():
+        _start_listener()
+
+
+def stop_logging():
+    """Write out the queued records and stop the listener thread."""
+    if _listener is not None and _listener._thread is not None and _listener_pid == os.getpid():
+        _listener.stop()
+
+
+def _start_listener():
+    global _listener_pid
+    root = logging.getLogger()
+    for handler in _listener.handlers:
+        root.removeHandler(handler)
+    if _queue_handler not in root.handlers:
+        root.addHandler(_queue_handler)
+    _listener._thread = None
+    _listener.start()
+    _listener_pid = os.getpid()
+
+
+class RequestSampler:
+    """
+    Decide which requests get a verbose log entry, per route.
+
+    Args:
+        rates (str): Comma-separated `route=rate` pairs, e.g. '/swan=0.01,/api/commands=1'.
+            Rates are fractions between 0 and 1.
+        default (float): The rate of routes not listed.
+    """
+
+    def __init__(self, rates="", default=0.0):
+        self.default = default
+        self.rates = {}
+        for item in filter(None, (part.strip() for part in rates.split(","))):
+            route, _, rate = item.rpartition("=")
+            self.rates[route] = float(rate)
+
+    def sampled(self, route):
+        rate = self.rates.get(route, self.default)
+        return rate >= 1 or (rate > 0 and random.random() < rate)
+
+
+def log_request_details(req, route):
+    logging.info(
+        "Request details",
+        extra={
+            "method": req.method,
+            "route": route,
+            "path": req.path,
+            "headers": {
+                name: value for name, value in req.headers.items()
+                if name.lower() not in _REDACTED_HEADERS
+            },
+        },
+    )
+
+
+def register_request_logging(app, config):
+    """
+    Log one structured record per request, and sampled verbose records.
+
+    Every request gets an 'imei' log field from its 'Wep-Imei' header and,
+    when it finishes, a record with its method, route, status and
+    'latency_ms'. Requests are picked for a verbose record of their headers
+    at the per-route rates of LOG_SAMPLE_RATES.
+
+    Args:
+        app (flask.Flask): The application.
+        config (type): The configuration class.
+    """
+    from flask import g, request
+
+    sampler = RequestSampler(config.LOG_SAMPLE_RATES, config.LOG_SAMPLE_DEFAULT_RATE)
+    logger = logging.getLogger("app.requests")
+
+    @app.before_request
+    def start_request_log():
+        g.log_context_token = _log_context.set({})
+        g.request_started_at = time.perf_counter()
+        bind_log_context(imei=request.headers.get("Wep-Imei"))
+        route = request.url_rule.rule if request.url_rule is not None else request.path
+        if sampler.sampled(route):
+            log_request_details(request, route)
+
+    @app.after_request
+    def log_request(response):
+        started_at = g.get("request_started_at")
+        if started_at is not None:
+            logger.info(
+                f"{request.method} {request.path} {response.status_code}",
+                extra={
+                    "method": request.method,
+                    "route": request.url_rule.rule if request.url_rule is not None else request.path,
+                    "status": response.status_code,
+                    "latency_ms": round((time.perf_counter() - started_at) * 1000, 3),
+                },
+            )
+        return response
+
+    @app.teardown_request
+    def end_request_log(exc):
+        token = g.pop("log_context_token", None)
+        if token is not None:
+            try:
+                _log_context.reset(token)
+            except ValueError:
+                # Streamed responses may finish in another context
+                _log_context.set(None)
@@ -0,0 +1,60 @@
+from .base import Change, Document, DocumentNotFound, Storage, StorageError, Transaction, generate_id
+
+
+def create_storage(config):
+    """
+    Create the storage backend selected by `config.STORAGE_BACKEND`.
+
+    Backend modules are imported on demand, so the Firestore client library
+    is only loaded when Firestore is used.
+
+    Args:
+        config (type): The configuration class.
+
+    Returns:
+        Storage: The storage backend.
+    """
+    backend = config.STORAGE_BACKEND
+    if backend == "firestore":
+        from .firestore import FirestoreStorage
+        return FirestoreStorage()
+    if backend == "memory":
+        from .memory import MemoryStorage
+        return MemoryStorage()
+    if backend == "sqlite":
+        from .sqlite import SQLiteStorage
+        return SQLiteStorage(config.SQLITE_PATH)
+    raise ValueError(f"Unknown STORAGE_BACKEND: {backend!r}")
+
+
+def create_async_storage(storage):
+    """
+    Create asynchronous access to a storage backend.
+
+    Firestore uses its native asyncio client; other backends run their
+    calls in a thread pool.
+
+    Args:
+        storage (Storage): The storage backend from `create_storage`.
+
+    Returns:
+        app.storage.aio.AsyncStorage: The asynchronous storage.
+    """
+    if storage.name == "firestore":
+        from .firestore import AsyncFirestoreStorage
+        return AsyncFirestoreStorage(storage)
+    from .aio import AsyncStorage
+    return AsyncStorage(storage)
+
+
+__all__ = [
+    "Change",
+    "Document",
+    "DocumentNotFound",
+    "Storage",
+    "StorageError",
+    "Transaction",
+    "create_async_storage",
+    "create_storage",
+    "generate_id",
+]
@@ -0,0 +1,38 @@
+import asyncio
+
+
+class AsyncStorage:
+    """
+    Asynchronous access to a storage backend.
+
+    Used by the async SWAN handshake. Backends without a native asyncio
+    client run each call in the event loop's default thread pool, so a
+    blocking read never stalls other requests on the loop.
+
+    Args:
+        storage (app.storage.Storage): The synchronous storage backend.
+    """
+
+    # Whether calls bypass `storage` and go to the backend's own asyncio client
+    native = False
+
+    def __init__(self, storage):
+        self.storage = storage
+
+    async def get(self, collection, document_id):
+        """
+        Read a document.
+
+        Returns:
+            app.storage.Document: The document; `exists` is False if it does not exist.
+        """
+        return await asyncio.to_thread(self.storage.get, collection, document_id)
+
+    async def commit(self, writes):
+        """
+        Apply `(op, collection, document_id, data)` writes atomically.
+
+        Raises:
+            DocumentNotFound: If an 'update' targets a missing document.
+        """
+        await asyncio.to_thread(self.storage.commit, writes)
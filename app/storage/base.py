@@ -0,0 +1,208 @@
+import secrets
+import string
+
+
+_ID_ALPHABET = string.ascii_letters + string.digits
+
+FILTER_OPERATORS = ("==", "!=", "<", "<=", ">", ">=", "in")
+
+
+def generate_id():
+    """
+    Generate a random 20 character document ID, like Firestore auto IDs.
+
+    Returns:
+        str: The generated document ID.
+    """
+    return "".join(secrets.choice(_ID_ALPHABET) for _ in range(20))
+
+
+class StorageError(Exception):
+    """Base class for errors raised by storage backends."""
+
+
+class DocumentNotFound(StorageError):
+    """Raised when updating a document that does not exist."""
+
+
+class Document:
+    """
+    Snapshot of a stored document.
+
+    Mirrors the parts of a Firestore DocumentSnapshot that the application
+    uses, so views behave the same whichever backend is configured.
+    """
+
+    __slots__ = ("id", "_data", "update_time")
+
+    def __init__(self, document_id, data=None, update_time=None):
+        self.id = document_id
+        self._data = data
+        self.update_time = update_time
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return dict(self._data) if self._data is not None else None
+
+
+class Change:
+    """
+    A document change delivered to `watch` callbacks.
+
+    Attributes:
+        type (str): One of 'ADDED', 'MODIFIED' or 'REMOVED'.
+        document (Document): The document after the change.
+    """
+
+    __slots__ = ("type", "document")
+
+    def __init__(self, change_type, document):
+        self.type = change_type
+        self.document = document
+
+
+class Transaction:
+    """
+    The reads and staged writes of one attempt of `Storage.transaction`.
+
+    Reads go to the backend at once; writes are staged in `writes` and
+    committed when the transaction function returns, as one batch.
+
+    Attributes:
+        writes (list): The staged `(op, collection, document_id, data)` writes.
+        reads (dict): Documents read, per collection.
+    """
+
+    def __init__(self, get):
+        self._get = get
+        self.writes = []
+        self.reads = {}
+
+    def get(self, collection, document_id):
+        self.reads[collection] = self.reads.get(collection, 0) + 1
+        return self._get(collection, document_id)
+
+    def get_all(self, collection, document_ids):
+        """Read several documents, returned in the order of `document_ids`."""
+        return [self.get(collection, document_id) for document_id in document_ids]
+
+    def set(self, collection, document_id, data):
+        self.writes.append(("set", collection, document_id, data))
+
+    def update(self, collection, document_id, data):
+        self.writes.append(("update", collection, document_id, data))
+
+    def delete(self, collection, document_id):
+        self.writes.append(("delete", collection, document_id, None))
+
+
+class Storage:
+    """
+    Document storage interface used by db_utils.
+
+    Documents are dictionaries addressed by a collection name and a document
+    ID, as in Firestore. Writes passed to `commit` are tuples of
+    `(op, collection, document_id, data)` where `op` is 'set', 'update' or
+    'delete', and are applied atomically.
+
+    Queries follow Firestore semantics: a document that lacks a filtered or
+    ordered field is not returned.
+    """
+
+    name = None
+
+    def get(self, collection, document_id):
+        raise NotImplementedError
+
+    def stream(self, collection):
+        raise NotImplementedError
+
+    def query(self, collection, filters=(), order_by=None, descending=False,
+              limit=None, start_after=None, select=None):
+        """
+        Query a collection.
+
+        Args:
+            collection (str): The collection to query.
+            filters (iterable): `(field, op, value)` tuples; `op` is one of
+                FILTER_OPERATORS.
+            order_by (str, optional): Field to order by. Results are always
+                ordered by document ID after this field.
+            descending (bool): Reverse the ordering.
+            limit (int, optional): Maximum number of documents to return.
+            start_after (tuple, optional): `(value, document_id)` of the last
+                document of the previous page, where `value` is its `order_by`
+                field.
+            select (list, optional): Only return these fields of each document.
+
+        Returns:
+            Iterator of Document, yielded as the backend returns them.
+        """
+        raise NotImplementedError
+
+    def commit(self, writes):
+        raise NotImplementedError
+
+    def transaction(self, function, max_attempts=5):
+        """
+        Run `function(transaction)` as a read-write transaction.
+
+        The function reads through the Transaction it is given and stages
+        its writes there. The writes are committed atomically, and only if
+        no document the function read was changed by someone else in the
+        meantime. Firestore runs the function again when that happens, up
+        to `max_attempts` times, so it must not have other side effects;
+        the other backends serialize transactions and run it once.
+
+        Args:
+            function (callable): Called with a Transaction.
+            max_attempts (int): Attempts before a contended transaction fails.
+
+        Returns:
+            The return value of `function`.
+        """
+        raise NotImplementedError
+
+    def set(self, collection, document_id, data):
+        self.commit([("set", collection, document_id, data)])
+
+    def update(self, collection, document_id, data):
+        self.commit([("update", collection, document_id, data)])
+
+    def delete(self, collection, document_id):
+        self.commit([("delete", collection, document_id, None)])
+
+    def add(self, collection, data):
+        document_id = self.new_id(collection)
+        self.set(collection, document_id, data)
+        return document_id
+
+    def new_id(self, collection):
+        return generate_id()
+
+    def watch(self, collection, callback):
+        """
+        Call `callback(changes)` with a list of Change objects whenever
+        documents in `collection` change.
+
+        Backends without change notifications raise NotImplementedError;
+        callers are expected to fall back to polling.
+
+        Returns:
+            An object with an `is_active` attribute and an `unsubscribe()` method.
+        """
+        raise NotImplementedError
+
+    def connect(self):
+        """
+        Open the connection to the backend ahead of the first request.
+
+        Backends otherwise connect lazily on first use, and again in each
+        process after a fork.
+        """
+
+    def close(self):
+        pass
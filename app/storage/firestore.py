@@ -0,0 +1,253 @@
+import os
+import threading
+
+from app.storage.aio import AsyncStorage
+from app.storage.base import Change, Document, DocumentNotFound, Storage, Transaction
+
+
+def _client_library():
+    # The client library takes long to import; it is loaded when Firestore is first used
+    from google.api_core import exceptions
+    from google.cloud import firestore
+    from google.cloud.firestore_v1.field_path import FieldPath
+
+    return firestore, FieldPath, exceptions
+
+
+def create_firestore_client(client_class=None):
+    """
+    Create a Firestore client for the emulator or for production Firestore.
+
+    Connects to the emulator when FIRESTORE_EMULATOR_HOST is set, otherwise
+    to the database named by FIRESTORE_DB_NAME, or the default database.
+
+    Args:
+        client_class (type, optional): `firestore.Client` (the default), or
+            `firestore.AsyncClient`.
+
+    Returns:
+        google.cloud.firestore.Client: The Firestore client.
+    """
+    firestore, _, _ = _client_library()
+    if client_class is None:
+        client_class = firestore.Client
+    if "FIRESTORE_EMULATOR_HOST" in os.environ:
+        import google.auth.credentials
+
+        # Using Firestore emulator
+        credentials = google.auth.credentials.AnonymousCredentials()
+        client = client_class(
+            project=os.environ["FIRESTORE_PROJECT_ID"], credentials=credentials
+        )
+        print("Connected to Firestore Emulator.")
+    else:
+        # Using Production Firestore
+        dbname = os.environ.get("FIRESTORE_DB_NAME")
+        print(f"DB Name: {dbname}")
+        if dbname:
+            client = client_class(database=dbname)
+        else:
+            client = client_class()
+        print("Connected to Production Firestore.")
+    return client
+
+
+def _to_document(snapshot):
+    return Document(snapshot.id, snapshot.to_dict() if snapshot.exists else None, snapshot.update_time)
+
+
+def _batch(client, writes):
+    batch = client.batch()
+    for op, collection, document_id, data in writes:
+        doc_ref = client.collection(collection).document(document_id)
+        if op == "set":
+            batch.set(doc_ref, data)
+        elif op == "update":
+            batch.update(doc_ref, data)
+        else:
+            batch.delete(doc_ref)
+    return batch
+
+
+class _FirestoreTransaction(Transaction):
+    # Reads go through the Firestore transaction, which retries on contention
+    def __init__(self, client, transaction):
+        super().__init__(self._read)
+        self._client = client
+        self._transaction = transaction
+
+    def _read(self, collection, document_id):
+        reference = self._client.collection(collection).document(document_id)
+        return _to_document(reference.get(transaction=self._transaction))
+
+    def get_all(self, collection, document_ids):
+        document_ids = list(document_ids)
+        self.reads[collection] = self.reads.get(collection, 0) + len(document_ids)
+        references = [self._client.collection(collection).document(document_id) for document_id in document_ids]
+        snapshots = {
+            snapshot.id: snapshot
+            for snapshot in self._client.get_all(references, transaction=self._transaction)
+        }
+        return [
+            _to_document(snapshots[document_id]) if document_id in snapshots else Document(document_id)
+            for document_id in document_ids
+        ]
+
+
+class FirestoreStorage(Storage):
+    """
+    Storage in Google Cloud Firestore.
+
+    The client is created on first use and created again in a forked
+    process, since gRPC channels do not survive a fork. The storage can be
+    created before gunicorn forks its workers (`preload_app`), and each
+    worker connects in its `post_fork` hook.
+
+    Args:
+        client (google.cloud.firestore.Client, optional): The client to use.
+            One is created from the environment when omitted.
+    """
+
+    name = "firestore"
+
+    def __init__(self, client=None):
+        self._client = client
+        self._pid = os.getpid() if client is not None else None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        if self._client is None or self._pid != os.getpid():
+            with self._lock:
+                if self._client is None or self._pid != os.getpid():
+                    self._client = create_firestore_client()
+                    self._pid = os.getpid()
+        return self._client
+
+    def connect(self):
+        self.client
+
+    def get(self, collection, document_id):
+        return _to_document(self.client.collection(collection).document(document_id).get())
+
+    def stream(self, collection):
+        for snapshot in self.client.collection(collection).stream():
+            yield _to_document(snapshot)
+
+    def query(self, collection, filters=(), order_by=None, descending=False,
+              limit=None, start_after=None, select=None):
+        # Filters combined with an order on another field need a composite index
+        firestore, FieldPath, _ = _client_library()
+        query = self.client.collection(collection)
+        if select is not None:
+            # Projection: only the selected fields are read and sent
+            query = query.select(list(select))
+        for field, op, value in filters:
+            query = query.where(filter=firestore.FieldFilter(field, op, value))
+
+        direction = firestore.Query.DESCENDING if descending else firestore.Query.ASCENDING
+        if order_by is not None:
+            query = query.order_by(order_by, direction=direction)
+        query = query.order_by(FieldPath.document_id(), direction=direction)
+
+        if start_after is not None:
+            value, document_id = start_after
+            cursor = {FieldPath.document_id(): document_id}
+            if order_by is not None:
+                cursor[order_by] = value
+            query = query.start_after(cursor)
+        if limit is not None:
+            query = query.limit(limit)
+
+        for snapshot in query.stream():
+            yield _to_document(snapshot)
+
+    def commit(self, writes):
+        _, _, google_exceptions = _client_library()
+        batch = _batch(self.client, writes)
+        try:
+            batch.commit()
+        except google_exceptions.NotFound as exc:
+            raise DocumentNotFound(str(exc)) from exc
+
+    def transaction(self, function, max_attempts=5):
+        firestore, _, google_exceptions = _client_library()
+        client = self.client
+
+        @firestore.transactional
+        def run(firestore_transaction):
+            transaction = _FirestoreTransaction(client, firestore_transaction)
+            result = function(transaction)
+            for op, collection, document_id, data in transaction.writes:
+                reference = client.collection(collection).document(document_id)
+                if op == "set":
+                    firestore_transaction.set(reference, data)
+                elif op == "update":
+                    firestore_transaction.update(reference, data)
+                else:
+                    firestore_transaction.delete(reference)
+            return result
+
+        try:
+            return run(client.transaction(max_attempts=max_attempts))
+        except google_exceptions.NotFound as exc:
+            raise DocumentNotFound(str(exc)) from exc
+
+    def new_id(self, collection):
+        # Generated locally by the client library, no round trip
+        return self.client.collection(collection).document().id
+
+    def watch(self, collection, callback):
+        def on_snapshot(docs, changes, read_time):
+            callback([
+                Change(
+                    change.type.name,
+                    _to_document(change.document) if change.type.name != "REMOVED" else Document(change.document.id),
+                )
+                for change in changes
+            ])
+
+        return self.client.collection(collection).on_snapshot(on_snapshot)
+
+    def close(self):
+        if self._client is not None and self._pid == os.getpid():
+            self._client.close()
+
+
+class AsyncFirestoreStorage(AsyncStorage):
+    """
+    Asynchronous access to Firestore through `firestore.AsyncClient`.
+
+    The client is created on first use, inside the running event loop, and
+    created again in a forked process.
+
+    Args:
+        storage (FirestoreStorage): The synchronous Firestore storage.
+        client (google.cloud.firestore.AsyncClient, optional): The client to use.
+    """
+
+    native = True
+
+    def __init__(self, storage, client=None):
+        super().__init__(storage)
+        self._client = client
+        self._pid = os.getpid() if client is not None else None
+
+    @property
+    def client(self):
+        if self._client is None or self._pid != os.getpid():
+            firestore, _, _ = _client_library()
+            self._client = create_firestore_client(firestore.AsyncClient)
+            self._pid = os.getpid()
+        return self._client
+
+    async def get(self, collection, document_id):
+        return _to_document(await self.client.collection(collection).document(document_id).get())
+
+    async def commit(self, writes):
+        _, _, google_exceptions = _client_library()
+        batch = _batch(self.client, writes)
+        try:
+            await batch.commit()
+        except google_exceptions.NotFound as exc:
+            raise DocumentNotFound(str(exc)) from exc
@@ -0,0 +1,176 @@
+import time
+
+from app.storage.aio import AsyncStorage
+from app.storage.base import Storage
+
+
+def _write_counts(writes):
+    # Document counts of a commit, per collection
+    counts = {}
+    for op, collection, _, _ in writes:
+        kinds = counts.setdefault(collection, {"writes": 0, "deletes": 0})
+        kinds["deletes" if op == "delete" else "writes"] += 1
+    return counts
+
+
+class _Observed:
+    def __init__(self, observers):
+        self.observers = list(observers)
+
+    def add_observer(self, observer):
+        self.observers.append(observer)
+
+    def _notify(self, operation, counts, seconds, error):
+        for observer in self.observers:
+            observer(operation, counts, seconds, error)
+
+    def _notify_commit(self, writes, seconds, error):
+        self._notify("commit", _write_counts(writes), seconds, error)
+
+
+class InstrumentedStorage(_Observed, Storage):
+    """
+    Storage wrapper that reports every round trip to observers.
+
+    Observers are called once per round trip as `observer(operation, counts,
+    seconds, error)` where `operation` is 'get', 'stream', 'query',
+    'commit' or 'transaction', `counts` maps each collection involved to the
+    number of documents read, written or deleted (`{"reads": n}` or
+    `{"writes": n, "deletes": m}`), and `error` is the exception raised, or
+    None. Streams and queries are reported when iteration ends, and a
+    transaction, with the documents of its last attempt, when it ends.
+
+    Args:
+        backend (Storage): The storage backend.
+        observers (iterable): Callables notified of each round trip.
+    """
+
+    def __init__(self, backend, observers=()):
+        super().__init__(observers)
+        self.backend = backend
+
+    @property
+    def name(self):
+        return self.backend.name
+
+    def __getattr__(self, attribute):
+        # Backend-specific methods, such as MemoryStorage.clear()
+        return getattr(self.backend, attribute)
+
+    def get(self, collection, document_id):
+        started_at = time.perf_counter()
+        error = None
+        try:
+            return self.backend.get(collection, document_id)
+        except Exception as exc:
+            error = exc
+            raise
+        finally:
+            self._notify("get", {collection: {"reads": 1}}, time.perf_counter() - started_at, error)
+
+    def stream(self, collection):
+        return self._observe_iteration("stream", collection, self.backend.stream(collection))
+
+    def query(self, collection, **query):
+        return self._observe_iteration("query", collection, self.backend.query(collection, **query))
+
+    def commit(self, writes):
+        writes = list(writes)
+        started_at = time.perf_counter()
+        error = None
+        try:
+            self.backend.commit(writes)
+        except Exception as exc:
+            error = exc
+            raise
+        finally:
+            self._notify_commit(writes, time.perf_counter() - started_at, error)
+
+    def transaction(self, function, max_attempts=5):
+        attempts = []
+
+        def run(transaction):
+            attempts.append(transaction)
+            return function(transaction)
+
+        started_at = time.perf_counter()
+        error = None
+        try:
+            return self.backend.transaction(run, max_attempts)
+        except Exception as exc:
+            error = exc
+            raise
+        finally:
+            counts = {}
+            if attempts:
+                counts = {collection: {"reads": reads} for collection, reads in attempts[-1].reads.items()}
+                for collection, kinds in _write_counts(attempts[-1].writes).items():
+                    counts.setdefault(collection, {}).update(kinds)
+            self._notify("transaction", counts, time.perf_counter() - started_at, error)
+
+    def new_id(self, collection):
+        return self.backend.new_id(collection)
+
+    def watch(self, collection, callback):
+        return self.backend.watch(collection, callback)
+
+    def connect(self):
+        self.backend.connect()
+
+    def close(self):
+        self.backend.close()
+
+    def _observe_iteration(self, operation, collection, documents):
+        started_at = time.perf_counter()
+        count = 0
+        error = None
+        try:
+            for document in documents:
+                count += 1
+                yield document
+        except Exception as exc:
+            error = exc
+            raise
+        finally:
+            # Queries read at least one document, even when nothing matches
+            self._notify(operation, {collection: {"reads": max(count, 1)}}, time.perf_counter() - started_at, error)
+
+
+class InstrumentedAsyncStorage(_Observed, AsyncStorage):
+    """
+    Async storage wrapper that reports every round trip to observers, like
+    `InstrumentedStorage`.
+
+    Args:
+        backend (AsyncStorage): The asynchronous storage.
+        observers (iterable): Callables notified of each round trip.
+    """
+
+    def __init__(self, backend, observers=()):
+        _Observed.__init__(self, observers)
+        AsyncStorage.__init__(self, backend.storage)
+        self.backend = backend
+        self.native = backend.native
+
+    async def get(self, collection, document_id):
+        started_at = time.perf_counter()
+        error = None
+        try:
+            return await self.backend.get(collection, document_id)
+        except Exception as exc:
+            error = exc
+            raise
+        finally:
+            self._notify("get", {collection: {"reads": 1}}, time.perf_counter() - started_at, error)
+
+    async def commit(self, writes):
+        writes = list(writes)
+        started_at = time.perf_counter()
+        error = None
+        try:
+            await self.backend.commit(writes)
+        except Exception as exc:
+            error = exc
+            raise
+        finally:
+            self._notify_commit(writes, time.perf_counter() - started_at, error)
@@ -0,0 +1,174 @@
+import copy
+import operator
+import threading
+import time
+
+from app.storage.base import Change, Document, DocumentNotFound, Storage, Transaction
+
+
+_COMPARATORS = {
+    "==": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "in": lambda value, options: value in options,
+}
+
+
+def _matches(data, filters):
+    for field, op, value in filters:
+        if field not in data:
+            return False
+        try:
+            if not _COMPARATORS[op](data[field], value):
+                return False
+        except TypeError:
+            return False
+    return True
+
+
+class _Watch:
+    def __init__(self, storage, collection, callback):
+        self._storage = storage
+        self.collection = collection
+        self.callback = callback
+        self.is_active = True
+
+    def unsubscribe(self):
+        self.is_active = False
+        self._storage._unwatch(self)
+
+
+class MemoryStorage(Storage):
+    """
+    Process-local storage backed by dictionaries.
+
+    Documents are deep-copied on the way in and out, so callers cannot
+    modify stored state by accident. Intended for tests, load tests and
+    single-process deployments; nothing is persisted.
+    """
+
+    name = "memory"
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._collections = {}
+        self._watches = []
+
+    def get(self, collection, document_id):
+        with self._lock:
+            entry = self._collections.get(collection, {}).get(document_id)
+        if entry is None:
+            return Document(document_id)
+        data, update_time = entry
+        return Document(document_id, copy.deepcopy(data), update_time)
+
+    def stream(self, collection):
+        with self._lock:
+            entries = list(self._collections.get(collection, {}).items())
+        for document_id, (data, update_time) in entries:
+            yield Document(document_id, copy.deepcopy(data), update_time)
+
+    def query(self, collection, filters=(), order_by=None, descending=False,
+              limit=None, start_after=None, select=None):
+        with self._lock:
+            entries = [
+                (document_id, entry)
+                for document_id, entry in self._collections.get(collection, {}).items()
+                if _matches(entry[0], filters) and (order_by is None or order_by in entry[0])
+            ]
+
+        if order_by is None:
+            def sort_key(item):
+                return (item[0],)
+        else:
+            def sort_key(item):
+                return (item[1][0][order_by], item[0])
+        entries.sort(key=sort_key, reverse=descending)
+
+        if start_after is not None:
+            value, document_id = start_after
+            cursor = (document_id,) if order_by is None else (value, document_id)
+            if descending:
+                entries = [item for item in entries if sort_key(item) < cursor]
+            else:
+                entries = [item for item in entries if sort_key(item) > cursor]
+
+        if limit is not None:
+            entries = entries[:limit]
+
+        for document_id, (data, update_time) in entries:
+            if select is not None:
+                data = {field: data[field] for field in select if field in data}
+            yield Document(document_id, copy.deepcopy(data), update_time)
+
+    def commit(self, writes):
+        changes = []
+        with self._lock:
+            staged = {}
+            for op, collection, document_id, data in writes:
+                documents = staged.setdefault(collection, dict(self._collections.get(collection, {})))
+                existing = documents.get(document_id)
+                if op == "set":
+                    documents[document_id] = (copy.deepcopy(data), time.time())
+                elif op == "update":
+                    if existing is None:
+                        raise DocumentNotFound(f"{collection}/{document_id}")
+                    documents[document_id] = ({**existing[0], **copy.deepcopy(data)}, time.time())
+                else:
+                    documents.pop(document_id, None)
+                changes.append(self._change(collection, document_id, existing, documents.get(document_id)))
+            self._collections.update(staged)
+            watches = list(self._watches)
+
+        self._notify(watches, [change for change in changes if change is not None])
+
+    def transaction(self, function, max_attempts=5):
+        # Holding the lock keeps every other commit out until this one is done
+        with self._lock:
+            transaction = Transaction(self.get)
+            result = function(transaction)
+            if transaction.writes:
+                self.commit(transaction.writes)
+        return result
+
+    def watch(self, collection, callback):
+        watch = _Watch(self, collection, callback)
+        with self._lock:
+            self._watches.append(watch)
+        return watch
+
+    def clear(self):
+        """Remove every document, notifying watchers of the removals."""
+        with self._lock:
+            changes = [
+                (collection, Change("REMOVED", Document(document_id)))
+                for collection, documents in self._collections.items()
+                for document_id in documents
+            ]
+            self._collections = {}
+            watches = list(self._watches)
+        self._notify(watches, changes)
+
+    def _unwatch(self, watch):
+        with self._lock:
+            if watch in self._watches:
+                self._watches.remove(watch)
+
+    @staticmethod
+    def _change(collection, document_id, before, after):
+        if after is None:
+            if before is None:
+                return None
+            return collection, Change("REMOVED", Document(document_id))
+        change_type = "ADDED" if before is None else "MODIFIED"
+        return collection, Change(change_type, Document(document_id, copy.deepcopy(after[0]), after[1]))
+
+    @staticmethod
+    def _notify(watches, changes):
+        for watch in watches:
+            matching = [change for collection, change in changes if collection == watch.collection]
+            if matching and watch.is_active:
+                watch.callback(matching)
@@ -0,0 +1,228 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+
+from app.storage.base import Document, DocumentNotFound, Storage, Transaction
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    collection TEXT NOT NULL,
+    id TEXT NOT NULL,
+    data TEXT NOT NULL,
+    update_time REAL NOT NULL,
+    PRIMARY KEY (collection, id)
+) WITHOUT ROWID
+"""
+
+# Statements are fixed strings so sqlite3 reuses the prepared statement from its cache
+_SELECT_ONE = "SELECT data, update_time FROM documents WHERE collection = ? AND id = ?"
+_SELECT_ALL = "SELECT id, data, update_time FROM documents WHERE collection = ? ORDER BY id"
+_UPSERT = (
+    "INSERT INTO documents (collection, id, data, update_time) VALUES (?, ?, ?, ?) "
+    "ON CONFLICT (collection, id) DO UPDATE SET data = excluded.data, update_time = excluded.update_time"
+)
+_DELETE = "DELETE FROM documents WHERE collection = ? AND id = ?"
+
+_FIELD_NAME = re.compile(r"^[A-Za-z0-9_]+$")
+
+
+def _datetime_to_text(value):
+    # Fixed-width UTC text sorts in time order
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f+00:00")
+
+
+def _encode(value):
+    if isinstance(value, datetime):
+        return {"$dt": _datetime_to_text(value)}
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _decode(obj):
+    if len(obj) == 1 and "$dt" in obj:
+        return datetime.fromisoformat(obj["$dt"])
+    return obj
+
+
+def _dumps(data):
+    return json.dumps(data, separators=(",", ":"), default=_encode)
+
+
+def _loads(text):
+    return json.loads(text, object_hook=_decode)
+
+
+def _field_sql(field):
+    if not _FIELD_NAME.match(field):
+        raise ValueError(f"Unsupported field name: {field!r}")
+    # Datetimes are stored as {"$dt": text}; compare them by that text
+    return f"""COALESCE(json_extract(data, '$.{field}."$dt"'), json_extract(data, '$.{field}'))"""
+
+
+def _param(value):
+    if isinstance(value, datetime):
+        return _datetime_to_text(value)
+    if isinstance(value, bool):
+        return int(value)
+    return value
+
+
+class SQLiteStorage(Storage):
+    """
+    Storage in a local SQLite database file.
+
+    The database runs in WAL mode so readers never block the writer, and
+    each thread (and each forked worker) uses its own connection. Several
+    worker processes can share one database file.
+
+    Args:
+        path (str): Path of the database file.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._connection().execute(_SCHEMA)
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(
+                self.path, isolation_level=None, check_same_thread=False,
+                timeout=30, cached_statements=256,
+            )
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def connect(self):
+        self._connection()
+
+    def get(self, collection, document_id):
+        row = self._connection().execute(_SELECT_ONE, (collection, document_id)).fetchone()
+        if row is None:
+            return Document(document_id)
+        return Document(document_id, _loads(row[0]), row[1])
+
+    def stream(self, collection):
+        cursor = self._connection().execute(_SELECT_ALL, (collection,))
+        for document_id, data, update_time in cursor:
+            yield Document(document_id, _loads(data), update_time)
+
+    def query(self, collection, filters=(), order_by=None, descending=False,
+              limit=None, start_after=None, select=None):
+        clauses = ["collection = ?"]
+        params = [collection]
+        for field, op, value in filters:
+            expression = _field_sql(field)
+            if op == "in":
+                values = list(value)
+                clauses.append(f"{expression} IN ({', '.join('?' * len(values))})")
+                params.extend(_param(item) for item in values)
+            elif op == "!=":
+                clauses.append(f"{expression} IS NOT NULL AND {expression} != ?")
+                params.append(_param(value))
+            elif op in ("==", "<", "<=", ">", ">="):
+                clauses.append(f"{expression} {'=' if op == '==' else op} ?")
+                params.append(_param(value))
+            else:
+                raise ValueError(f"Unsupported filter operator: {op!r}")
+
+        direction = "DESC" if descending else "ASC"
+        comparison = "<" if descending else ">"
+        if order_by is not None:
+            expression = _field_sql(order_by)
+            clauses.append(f"{expression} IS NOT NULL")
+            order_sql = f"{expression} {direction}, id {direction}"
+            if start_after is not None:
+                value, document_id = start_after
+                clauses.append(f"({expression} {comparison} ? OR ({expression} = ? AND id {comparison} ?))")
+                params.extend([_param(value), _param(value), document_id])
+        else:
+            order_sql = f"id {direction}"
+            if start_after is not None:
+                clauses.append(f"id {comparison} ?")
+                params.append(start_after[1])
+
+        if select is not None:
+            select = list(select)
+            for field in select:
+                _field_sql(field)  # rejects unsupported field names
+            # With several paths json_extract returns a JSON array of the values;
+            # a single path is passed twice to get the same shape
+            paths = [f"$.{field}" for field in select] or ["$.__none__"]
+            if len(paths) == 1:
+                paths.append(paths[0])
+            columns = f"json_extract(data, {', '.join('?' * len(paths))})"
+            params = paths + params
+        else:
+            columns = "data"
+
+        sql = f"SELECT id, {columns}, update_time FROM documents WHERE {' AND '.join(clauses)} ORDER BY {order_sql}"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(int(limit))
+
+        cursor = self._connection().execute(sql, params)
+        for document_id, data, update_time in cursor:
+            if select is not None:
+                values = _loads(data)
+                data = {field: value for field, value in zip(select, values) if value is not None}
+                yield Document(document_id, data, update_time)
+            else:
+                yield Document(document_id, _loads(data), update_time)
+
+    def commit(self, writes):
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            self._apply(connection, writes)
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+    def transaction(self, function, max_attempts=5):
+        # BEGIN IMMEDIATE takes the write lock before the first read, so transactions run one at a time
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            transaction = Transaction(self.get)
+            result = function(transaction)
+            self._apply(connection, transaction.writes)
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+        return result
+
+    @staticmethod
+    def _apply(connection, writes):
+        now = time.time()
+        for op, collection, document_id, data in writes:
+            if op == "set":
+                connection.execute(_UPSERT, (collection, document_id, _dumps(data), now))
+            elif op == "update":
+                row = connection.execute(_SELECT_ONE, (collection, document_id)).fetchone()
+                if row is None:
+                    raise DocumentNotFound(f"{collection}/{document_id}")
+                merged = {**_loads(row[0]), **data}
+                connection.execute(_UPSERT, (collection, document_id, _dumps(merged), now))
+            else:
+                connection.execute(_DELETE, (collection, document_id))
+
+    def close(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is not None:
+            connection.close()
+            self._local.connection = None
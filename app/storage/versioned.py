@@ -0,0 +1,208 @@
+import os
+import random
+import threading
+from datetime import datetime, timezone
+
+from app.storage.aio import AsyncStorage
+from app.storage.base import Storage, generate_id
+
+
+class CollectionVersions:
+    """
+    Version markers of collections, changed by every write to them.
+
+    After a commit that writes to a versioned collection, `touch` gives the
+    collection a new random version. Comparing the markers read before two
+    listings tells whether the collection changed in between, without
+    reading the collection.
+
+    Marker writes are kept out of the commits they record, so a device
+    handshake does not wait on them: a process collects its new versions
+    and `flush`, called every second or so by a background thread, writes
+    them in one batch. A process reads its own unflushed versions at once;
+    other processes see them after the flush, so until then a conditional
+    GET served by another worker can still be answered as not modified.
+
+    Markers are spread over `shards` documents, '<collection>-<n>' in
+    `marker_collection`, and a process always writes the same one, picked
+    at random. With at least as many shards as server processes, a marker
+    document takes about one write per flush interval, within Firestore's
+    sustained rate for a single document. Reading the markers of a
+    collection is one query with an equality filter, which needs no
+    composite index.
+
+    Args:
+        collections (iterable): The versioned collections.
+        marker_collection (str): The collection of marker documents.
+        shards (int): Marker documents per collection.
+    """
+
+    def __init__(self, collections, marker_collection="collection_versions", shards=8):
+        self.collections = frozenset(collections)
+        self.marker_collection = marker_collection
+        self.shards = max(1, shards)
+
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._shard = None
+        self._pid = None
+
+    def touch(self, writes):
+        """Give each versioned collection that committed `writes` touched a new, unflushed version."""
+        touched = {collection for _, collection, _, _ in writes if collection in self.collections}
+        if not touched:
+            return
+        now = datetime.now(timezone.utc)
+        with self._lock:
+            if self._pid != os.getpid():
+                # Versions inherited from the parent are the parent's to flush
+                self._pid = os.getpid()
+                self._shard = random.randrange(self.shards)
+                self._pending = {}
+            for collection in touched:
+                self._pending[collection] = self._marker_write(collection, self._shard, now)
+
+    def flush(self, storage):
+        """
+        Write the markers of the versions `touch` gave since the last flush.
+
+        Args:
+            storage (app.storage.Storage): The storage holding the markers.
+
+        Returns:
+            int: The number of markers written.
+        """
+        with self._lock:
+            if self._pid != os.getpid() or not self._pending:
+                return 0
+            pending = dict(self._pending)
+        storage.commit(list(pending.values()))
+        with self._lock:
+            # Until written, versions stay pending, so `read` keeps returning them
+            for collection, write in pending.items():
+                if self._pending.get(collection) is write:
+                    del self._pending[collection]
+        return len(pending)
+
+    def read(self, storage, collection):
+        """
+        Read the version of a collection.
+
+        A collection without markers, written only before versioning was
+        enabled, gets one.
+
+        Args:
+            storage (app.storage.Storage): The storage holding the markers.
+            collection (str): A versioned collection.
+
+        Returns:
+            tuple: The version, a string that changes with every write to
+            the collection, and the time of the last write as a datetime.
+        """
+        markers = {
+            document.id: document.to_dict()
+            for document in storage.query(self.marker_collection, filters=[("collection", "==", collection)])
+        }
+        with self._lock:
+            pending = self._pending.get(collection) if self._pid == os.getpid() else None
+        if pending is not None:
+            # As the markers will read once this process has flushed
+            markers[pending[2]] = pending[3]
+        if not markers:
+            write = self._marker_write(collection, random.randrange(self.shards), datetime.now(timezone.utc))
+            storage.commit([write])
+            markers = {write[2]: write[3]}
+        version = ",".join(markers[marker_id]["version"] for marker_id in sorted(markers))
+        return version, max(data["updated_at"] for data in markers.values())
+
+    def _marker_write(self, collection, shard, now):
+        return ("set", self.marker_collection, f"{collection}-{shard}", {
+            "collection": collection,
+            "version": generate_id(),
+            "updated_at": now,
+        })
+
+
+class VersionedStorage(Storage):
+    """
+    Storage wrapper that gives collections new versions on every commit.
+
+    Args:
+        backend (Storage): The storage backend.
+        versions (CollectionVersions): The versioned collections.
+    """
+
+    def __init__(self, backend, versions):
+        self.backend = backend
+        self.versions = versions
+
+    @property
+    def name(self):
+        return self.backend.name
+
+    def __getattr__(self, attribute):
+        # Backend-specific methods, such as MemoryStorage.clear()
+        return getattr(self.backend, attribute)
+
+    def get(self, collection, document_id):
+        return self.backend.get(collection, document_id)
+
+    def stream(self, collection):
+        return self.backend.stream(collection)
+
+    def query(self, collection, **query):
+        return self.backend.query(collection, **query)
+
+    def commit(self, writes):
+        writes = list(writes)
+        self.backend.commit(writes)
+        self.versions.touch(writes)
+
+    def transaction(self, function, max_attempts=5):
+        attempts = []
+
+        def run(transaction):
+            attempts.append(transaction)
+            return function(transaction)
+
+        result = self.backend.transaction(run, max_attempts)
+        # The writes of the last attempt are the ones committed
+        self.versions.touch(attempts[-1].writes)
+        return result
+
+    def new_id(self, collection):
+        return self.backend.new_id(collection)
+
+    def watch(self, collection, callback):
+        return self.backend.watch(collection, callback)
+
+    def connect(self):
+        self.backend.connect()
+
+    def close(self):
+        self.backend.close()
+
+
+class VersionedAsyncStorage(AsyncStorage):
+    """
+    Async storage wrapper that gives collections new versions, like
+    `VersionedStorage`, for native asyncio clients.
+
+    Args:
+        backend (AsyncStorage): The asynchronous storage.
+        versions (CollectionVersions): The versioned collections.
+    """
+
+    def __init__(self, backend, versions):
+        super().__init__(backend.storage)
+        self.backend = backend
+        self.versions = versions
+        self.native = backend.native
+
+    async def get(self, collection, document_id):
+        return await self.backend.get(collection, document_id)
+
+    async def commit(self, writes):
+        writes = list(writes)
+        await self.backend.commit(writes)
+        self.versions.touch(writes)
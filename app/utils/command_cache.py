@@ -0,0 +1,139 @@
+import logging
+import os
+import threading
+import time
+
+from app.storage import Document
+
+
+class CommandIndex:
+    """
+    Process-local index of the pending documents in 'command_to_swan'.
+
+    The collection is loaded once and then kept current by a storage watch
+    (an `on_snapshot` listener on Firestore), so looking up the command for
+    a device needs no remote read. While the listener is not active the
+    index is treated as valid for `ttl` seconds after the last load, and
+    reloaded once it has expired.
+
+    Args:
+        storage (app.storage.Storage): The storage backend.
+        collection (str): The collection to index.
+        ttl (float): Seconds a load stays valid without an active listener.
+        listen (bool): Whether to attach a snapshot listener.
+    """
+
+    def __init__(self, storage, collection, ttl=30.0, listen=True):
+        self.storage = storage
+        self.collection = collection
+        self.ttl = ttl
+        self.listen = listen
+
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._documents = {}
+        self._loaded_at = None
+        self._watch = None
+        self._pid = None
+
+    def get(self, document_id):
+        """
+        Look up a command document.
+
+        Args:
+            document_id (str): The document ID, e.g. 'update-<imei>'.
+
+        Returns:
+            app.storage.Document: The cached document; `exists` is False
+            when no command is pending.
+        """
+        self._ensure_fresh()
+        with self._lock:
+            data = self._documents.get(document_id)
+        return Document(document_id, dict(data) if data is not None else None)
+
+    def put(self, document_id, data):
+        """Record a local write so this process sees it before the listener does."""
+        with self._lock:
+            self._documents[document_id] = dict(data)
+
+    def update(self, document_id, data):
+        """Record a local partial update so this process sees it before the listener does."""
+        with self._lock:
+            if document_id in self._documents:
+                self._documents[document_id] = {**self._documents[document_id], **data}
+
+    def discard(self, document_id):
+        """Record a local delete so this process sees it before the listener does."""
+        with self._lock:
+            self._documents.pop(document_id, None)
+
+    def invalidate(self):
+        """Force a reload on the next lookup."""
+        with self._lock:
+            self._loaded_at = None
+
+    def close(self):
+        """Detach the snapshot listener."""
+        watch, self._watch = self._watch, None
+        if watch is not None:
+            try:
+                watch.unsubscribe()
+            except Exception:
+                logging.exception("Failed to close the command_to_swan listener")
+
+    @property
+    def listening(self):
+        return (
+            self._watch is not None
+            and self._pid == os.getpid()
+            and getattr(self._watch, "is_active", False)
+        )
+
+    @property
+    def fresh(self):
+        """Whether a lookup can be answered without loading the collection."""
+        return self.listening or (self._pid == os.getpid() and self._is_within_ttl())
+
+    def _ensure_fresh(self):
+        if self.listening:
+            return
+        if self._pid != os.getpid():
+            # Listener threads do not survive a fork
+            self._watch = None
+            self._loaded_at = None
+        if self._is_within_ttl():
+            return
+        with self._load_lock:
+            # Another thread may have reloaded while this one waited
+            if not self._is_within_ttl():
+                self._load()
+
+    def _is_within_ttl(self):
+        return self._loaded_at is not None and time.monotonic() - self._loaded_at < self.ttl
+
+    def _load(self):
+        self.close()
+        documents = {doc.id: doc.to_dict() for doc in self.storage.stream(self.collection)}
+        with self._lock:
+            self._documents = documents
+            self._loaded_at = time.monotonic()
+            self._pid = os.getpid()
+
+        if self.listen:
+            try:
+                self._watch = self.storage.watch(self.collection, self._on_changes)
+            except NotImplementedError:
+                self._watch = None
+            except Exception:
+                logging.exception("Failed to attach the command_to_swan listener, using TTL reloads")
+                self._watch = None
+
+    def _on_changes(self, changes):
+        with self._lock:
+            for change in changes:
+                if change.type == "REMOVED":
+                    self._documents.pop(change.document.id, None)
+                else:
+                    self._documents[change.document.id] = change.document.to_dict()
+            self._loaded_at = time.monotonic()
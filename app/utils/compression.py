@@ -0,0 +1,144 @@
+import gzip
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson", "application/javascript", "image/svg+xml")
+
+# Preferred first, among the encodings a client accepts equally. brotli and
+# zstandard are in requirements.txt; an install without them offers only gzip
+ENCODINGS = tuple(
+    encoding for encoding, available in (("br", brotli), ("zstd", zstandard), ("gzip", gzip))
+    if available is not None
+)
+
+
+def choose_encoding(accept_encodings, encodings=ENCODINGS):
+    """
+    Pick the content encoding for a response.
+
+    Args:
+        accept_encodings (werkzeug.datastructures.Accept): The parsed
+            'Accept-Encoding' header of the request.
+        encodings (tuple): The encodings available, preferred first.
+
+    Returns:
+        str: The accepted encoding with the highest quality, or None.
+    """
+    best, best_quality = None, 0
+    for encoding in encodings:
+        quality = accept_encodings[encoding]
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compress(data, encoding, level):
+    """Compress `data` in one piece."""
+    if encoding == "br":
+        return brotli.compress(data, quality=level)
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+def compress_stream(chunks, encoding, level):
+    """
+    Compress an iterable of byte strings as it is consumed.
+
+    Output is yielded whenever the compressor has some, so a streamed
+    listing is sent as it is produced rather than held in memory.
+    """
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=level)
+        process, finish = compressor.process, compressor.finish
+    elif encoding == "zstd":
+        compressor = zstandard.ZstdCompressor(level=level).compressobj()
+        process, finish = compressor.compress, compressor.flush
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        process, finish = compressor.compress, compressor.flush
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode("utf-8")
+        output = process(chunk)
+        if output:
+            yield output
+    yield finish()
+
+
+def register_compression(app, config):
+    """
+    Compress responses for clients that accept it.
+
+    JSON, NDJSON and text responses of at least COMPRESSION_MIN_SIZE bytes
+    are compressed with brotli, zstd or gzip, as negotiated through the
+    'Accept-Encoding' header; brotli and zstd are used when the 'brotli' and
+    'zstandard' packages are installed. Streamed responses are compressed
+    as they are sent, whatever their size. Responses to SWAN devices,
+    POST /swan, are left alone unless COMPRESS_DEVICE_RESPONSES is enabled.
+    Strong ETags of compressed responses are made weak, as they no longer
+    name the exact bytes sent.
+
+    Register it before the other `after_request` hooks, so it runs last and
+    they see the uncompressed response.
+
+    Args:
+        app (flask.Flask): The application.
+        config (type): The configuration class.
+    """
+    from flask import request
+
+    # A gzip level, 1 to 9, is also a valid brotli quality and zstd level
+    level = config.COMPRESSION_LEVEL
+
+    @app.after_request
+    def compress_response(response):
+        if not config.COMPRESSION_ENABLED:
+            return response
+        if request.method == "POST" and request.path == "/swan" and not config.COMPRESS_DEVICE_RESPONSES:
+            return response
+        if (
+            response.status_code < 200
+            or response.status_code in (204, 206, 304)
+            or response.direct_passthrough
+            or "Content-Encoding" in response.headers
+            or not is_compressible(response.mimetype)
+        ):
+            return response
+
+        response.vary.add("Accept-Encoding")
+        encoding = choose_encoding(request.accept_encodings)
+        if encoding is None:
+            return response
+
+        if response.is_streamed:
+            response.response = compress_stream(response.response, encoding, level)
+            response.headers.pop("Content-Length", None)
+        else:
+            data = response.get_data()
+            if len(data) < config.COMPRESSION_MIN_SIZE:
+                return response
+            compressed = compress(data, encoding, level)
+            if len(compressed) >= len(data):
+                return response
+            response.set_data(compressed)
+        response.headers["Content-Encoding"] = encoding
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            # A strong ETag names the uncompressed bytes; weak comparison still matches it
+            response.set_etag(etag, weak=True)
+        return response
+
+
+def is_compressible(mimetype):
+    return mimetype is not None and (mimetype.startswith("text/") or mimetype in COMPRESSIBLE_TYPES)
@@ -0,0 +1,56 @@
+import hashlib
+import json
+from datetime import datetime, timezone
+
+
+def make_etag(*parts):
+    """Derive an entity tag, unquoted, from the string forms of `parts`."""
+    return hashlib.sha256("\x1f".join(map(str, parts)).encode("utf-8")).hexdigest()[:32]
+
+
+def content_etag(data):
+    """Derive an entity tag from the content of a JSON-serializable document."""
+    return make_etag(json.dumps(data, sort_keys=True, separators=(",", ":"), default=str))
+
+
+def to_datetime(update_time):
+    """
+    Convert a document's `update_time` to a datetime.
+
+    Firestore returns datetimes, the SQLite and in-memory backends epoch seconds.
+    """
+    if update_time is None or isinstance(update_time, datetime):
+        return update_time
+    return datetime.fromtimestamp(update_time, timezone.utc)
+
+
+def is_not_modified(request, etag, last_modified=None):
+    """
+    Evaluate the conditional headers of a GET request.
+
+    'If-None-Match' is compared weakly, as RFC 9110 requires, so tags
+    weakened by response compression still match. 'If-Modified-Since' is
+    only used without 'If-None-Match'.
+
+    Args:
+        request (flask.Request): The request.
+        etag (str): The entity tag of the current representation, unquoted.
+        last_modified (datetime, optional): When the resource last changed.
+
+    Returns:
+        bool: Whether the client's copy is current, so 304 can be returned.
+    """
+    if request.if_none_match:
+        return request.if_none_match.star_tag or request.if_none_match.contains_weak(etag)
+    if last_modified is not None and request.if_modified_since is not None:
+        # HTTP dates have a resolution of one second
+        return last_modified.replace(microsecond=0) <= request.if_modified_since
+    return False
+
+
+def set_validators(response, etag, last_modified=None):
+    """Add the 'ETag' and 'Last-Modified' headers to a response."""
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    return response
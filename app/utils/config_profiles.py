@@ -0,0 +1,150 @@
+import logging
+import os
+import threading
+
+from app.utils.config_schema import ConfigError
+from app.utils.lru import LRUCache
+
+
+DEFAULT_PROFILE = "default"
+
+# Key of a command or device document that names its config profile
+PROFILE_FIELD = "profile"
+
+_MISSING = object()
+
+
+class ConfigProfiles:
+    """
+    Named config profiles, resolved in layers and memoized in process.
+
+    A profile document holds only the keys that differ from the defaults. A
+    config is resolved as defaults, then the profile, then the overrides of
+    the device or command that references it. The 'default' profile always
+    exists; storing a document under that ID overrides the defaults for
+    every device.
+
+    Resolved profiles are cached until a storage watch reports that the
+    profile changed, or at most `ttl` seconds while no watch is active.
+
+    Args:
+        storage (app.storage.Storage): The storage backend.
+        collection (str): The collection holding the profiles.
+        defaults (dict): The bottom layer of every resolved config.
+        maxsize (int): Maximum number of resolved profiles kept.
+        ttl (float): Seconds a resolved profile stays cached.
+        listen (bool): Whether to attach a snapshot listener.
+    """
+
+    def __init__(self, storage, collection, defaults, maxsize=1024, ttl=60.0, listen=True):
+        self.storage = storage
+        self.collection = collection
+        self.defaults = dict(defaults)
+        self.listen = listen
+
+        self._cache = LRUCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+        self._watch = None
+        self._pid = None
+
+    def resolve(self, profile_id=DEFAULT_PROFILE, overrides=None):
+        """
+        Resolve the full config of a profile.
+
+        Args:
+            profile_id (str): The profile ID.
+            overrides (dict, optional): Keys applied on top of the profile.
+
+        Returns:
+            dict: The resolved config, or None if the profile does not exist.
+        """
+        self._ensure_listening()
+        resolved = self._cache.get(profile_id, _MISSING)
+        if resolved is _MISSING:
+            resolved = self._load(profile_id)
+            self._cache.set(profile_id, resolved)
+        if resolved is None:
+            return None
+        if overrides:
+            return {**resolved, **overrides}
+        return dict(resolved)
+
+    def exists(self, profile_id):
+        return self.resolve(profile_id) is not None
+
+    def resolve_command(self, command):
+        """
+        Resolve a command document that may reference a profile.
+
+        A command without a 'profile' key is returned unchanged, so it sends
+        only its own keys. A command with one sends the resolved profile with
+        the command's other keys applied on top.
+
+        Args:
+            command (dict): The command document.
+
+        Returns:
+            dict: The config keys to send.
+
+        Raises:
+            ConfigError: If the referenced profile does not exist.
+        """
+        if PROFILE_FIELD not in command:
+            return command
+        overrides = {key: value for key, value in command.items() if key != PROFILE_FIELD}
+        resolved = self.resolve(command[PROFILE_FIELD], overrides)
+        if resolved is None:
+            raise ConfigError(f"Unknown config profile {command[PROFILE_FIELD]!r}")
+        return resolved
+
+    def invalidate(self, profile_id=None):
+        """Drop one resolved profile, or all of them, from the cache."""
+        if profile_id is None:
+            self._cache.clear()
+        else:
+            self._cache.pop(profile_id)
+
+    def close(self):
+        """Detach the snapshot listener."""
+        watch, self._watch = self._watch, None
+        if watch is not None:
+            try:
+                watch.unsubscribe()
+            except Exception:
+                logging.exception(f"Failed to close the {self.collection} listener")
+
+    def _load(self, profile_id):
+        data = self.storage.get(self.collection, profile_id).to_dict()
+        if data is None:
+            return dict(self.defaults) if profile_id == DEFAULT_PROFILE else None
+        if profile_id != DEFAULT_PROFILE:
+            base = self.resolve(DEFAULT_PROFILE)
+        else:
+            base = self.defaults
+        return {**base, **data}
+
+    def _ensure_listening(self):
+        if not self.listen or (self._watch is not None and self._pid == os.getpid()):
+            return
+        with self._lock:
+            if self._watch is not None and self._pid == os.getpid():
+                return
+            # Listener threads do not survive a fork
+            self._watch = None
+            self._pid = os.getpid()
+            self._cache.clear()
+            try:
+                self._watch = self.storage.watch(self.collection, self._on_changes)
+            except NotImplementedError:
+                self.listen = False
+            except Exception:
+                logging.exception(f"Failed to attach the {self.collection} listener, using TTL expiry")
+                self.listen = False
+
+    def _on_changes(self, changes):
+        for change in changes:
+            if change.document.id == DEFAULT_PROFILE:
+                # Every profile is resolved on top of the default one
+                self._cache.clear()
+                return
+            self._cache.pop(change.document.id)
@@ -0,0 +1,175 @@
+import json
+
+from app.config import SWAN_DEFAULT_CONFIG
+
+
+INT32_MIN = -0x80000000
+UINT32_MAX = 0xFFFFFFFF
+
+# Value ranges of SWAN config keys; other integer keys accept 32-bit values
+SWAN_CONFIG_RANGES = {
+    "nb1_rai": (0, 3),
+    "ntp_port": (0, 65535),
+    "ntp_auto_sync": (0, 1),
+    "daylightsaving_enable": (0, 1),
+    "upload_remote_port": (0, 65535),
+    "upload_local_port": (0, 65535),
+    "upload_format_spec_1": (0, UINT32_MAX),
+    "upload_format_spec_2": (0, UINT32_MAX),
+    "upload_format_spec_3": (0, UINT32_MAX),
+    "upload_months": (0, 0xFFF),
+    "upload_week_days": (0, 0x7F),
+    "upload_start_hour": (0, 23),
+    "upload_start_minute": (0, 59),
+    "collect_rssi_min": (-128, 127),
+    "collect_rssi_max": (-128, 127),
+    "collect_months": (0, 0xFFF),
+    "collect_week_days": (0, 0x7F),
+    "collect_start_hour": (0, 23),
+    "collect_start_minute": (0, 59),
+    "collect_rssi_min_2": (-128, 127),
+    "collect_rssi_max_2": (-128, 127),
+    "collect_months_2": (0, 0xFFF),
+    "collect_week_days_2": (0, 0x7F),
+    "collect_start_hour_2": (0, 23),
+    "collect_start_minute_2": (0, 59),
+}
+
+
+class ConfigError(ValueError):
+    """Raised when a config value does not match the schema."""
+
+
+def _encode_str(value):
+    return json.dumps(value)
+
+
+def _encode_int(value):
+    return str(int(value))
+
+
+class FieldSpec:
+    """
+    Schema entry for one config key.
+
+    Attributes:
+        name (str): The config key.
+        type (type): `int` or `str`.
+        minimum (int, optional): Smallest allowed integer value.
+        maximum (int, optional): Largest allowed integer value.
+        prefix (str): The encoded key, '"name":'.
+    """
+
+    __slots__ = ("name", "type", "minimum", "maximum", "prefix", "_encode")
+
+    def __init__(self, name, field_type, minimum=None, maximum=None):
+        self.name = name
+        self.type = field_type
+        self.minimum = minimum
+        self.maximum = maximum
+        self.prefix = f"{json.dumps(name)}:"
+        self._encode = _encode_int if field_type is int else _encode_str
+
+    def check(self, value):
+        if self.type is int:
+            if isinstance(value, bool) or not isinstance(value, int):
+                raise ConfigError(f"{self.name} must be an integer, got {value!r}")
+            if (self.minimum is not None and value < self.minimum) or (
+                self.maximum is not None and value > self.maximum
+            ):
+                raise ConfigError(f"{self.name} must be between {self.minimum} and {self.maximum}, got {value}")
+        elif not isinstance(value, str):
+            raise ConfigError(f"{self.name} must be a string, got {value!r}")
+
+    def encode(self, value):
+        self.check(value)
+        return self.prefix + self._encode(value)
+
+
+class ConfigSchema:
+    """
+    Key order, types and value ranges of the SWAN configuration.
+
+    The schema is compiled once from a defaults dictionary: every key gets a
+    pre-encoded prefix and a type-specific encoder, so encoding a config is a
+    single join over the keys it contains.
+
+    Args:
+        defaults (dict): Default config; its key order and value types define the schema.
+        ranges (dict, optional): `(minimum, maximum)` of integer keys.
+    """
+
+    def __init__(self, defaults, ranges=None):
+        ranges = ranges or {}
+        self.fields = {}
+        for name, value in defaults.items():
+            if isinstance(value, int):
+                minimum, maximum = ranges.get(name, (INT32_MIN, UINT32_MAX))
+                self.fields[name] = FieldSpec(name, int, minimum, maximum)
+            else:
+                self.fields[name] = FieldSpec(name, str)
+        self._order = {name: index for index, name in enumerate(self.fields)}
+
+    def field_types(self):
+        return {name: spec.type for name, spec in self.fields.items()}
+
+    def validate(self, config):
+        """
+        Check every known key of `config` against the schema.
+
+        Raises:
+            ConfigError: If a value has the wrong type or is out of range.
+        """
+        for name, value in config.items():
+            spec = self.fields.get(name)
+            if spec is not None and value is not None:
+                spec.check(value)
+
+    def encode(self, config):
+        """
+        Encode a config as the content string of a 'set_cfg' command.
+
+        Known keys are written in schema order and checked against the schema;
+        keys the schema does not know are passed through after them as JSON.
+        Keys whose value is None are left out.
+
+        Args:
+            config (dict): The config keys to send.
+
+        Returns:
+            str: The content string, e.g. '{"nb1_apn":"iot","ntp_port":123}'.
+
+        Raises:
+            ConfigError: If a value has the wrong type or is out of range.
+        """
+        fields = self.fields
+        order = self._order
+        known = sorted((name for name in config if name in fields), key=order.__getitem__)
+        parts = [fields[name].encode(config[name]) for name in known if config[name] is not None]
+        parts.extend(
+            f"{json.dumps(name)}:{json.dumps(value)}"
+            for name, value in config.items()
+            if name not in fields and value is not None
+        )
+        return "{" + ",".join(parts) + "}"
+
+    @staticmethod
+    def delta(desired, reported):
+        """
+        Return the keys of `desired` whose value differs from `reported`.
+
+        Args:
+            desired (dict): The config the device should have.
+            reported (dict): The config the device last reported.
+
+        Returns:
+            dict: The keys to send; empty if the device already matches.
+        """
+        return {
+            name: value
+            for name, value in desired.items()
+            if name not in reported or reported[name] != value
+        }
+
+
+SWAN_CONFIG_SCHEMA = ConfigSchema(SWAN_DEFAULT_CONFIG, SWAN_CONFIG_RANGES)
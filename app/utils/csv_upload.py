@@ -0,0 +1,66 @@
+import codecs
+
+
+class UploadTooLarge(ValueError):
+    """A request body is larger than the maximum upload size."""
+
+    def __init__(self, max_size):
+        super().__init__(f"Upload larger than {max_size} bytes")
+        self.max_size = max_size
+
+
+def check_upload_size(content_length, max_size):
+    """
+    Reject an upload by its 'Content-Length' header, before its body is read.
+
+    Raises:
+        UploadTooLarge: If the declared length is larger than `max_size`.
+    """
+    if max_size and content_length is not None and content_length > max_size:
+        raise UploadTooLarge(max_size)
+
+
+def read_csv_chunks(stream, chunk_size=256 * 1024, max_size=None, read_size=64 * 1024):
+    """
+    Read a UTF-8 CSV body from a stream as text chunks.
+
+    The body is read `read_size` bytes at a time and at most about two
+    chunks are held in memory. Chunks hold at most `chunk_size` bytes and
+    end at a row boundary, except for rows longer than a chunk. At least one
+    chunk is yielded, empty for an empty body.
+
+    Args:
+        stream: A binary file-like object, such as `flask.Request.stream`.
+        chunk_size (int): Maximum bytes per chunk.
+        max_size (int, optional): Maximum bytes of the body.
+        read_size (int): Bytes per read from the stream.
+
+    Yields:
+        str: The chunks of the CSV text.
+
+    Raises:
+        UploadTooLarge: As soon as more than `max_size` bytes are read.
+        UnicodeDecodeError: If the body is not UTF-8.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    buffer = bytearray()
+    total = 0
+    yielded = False
+    while True:
+        block = stream.read(read_size)
+        if block:
+            total += len(block)
+            if max_size and total > max_size:
+                raise UploadTooLarge(max_size)
+            buffer.extend(block)
+        while len(buffer) > chunk_size:
+            end = buffer.rfind(b"\n", 0, chunk_size) + 1 or chunk_size
+            # The decoder keeps a character split at the end for the next chunk
+            yield decoder.decode(bytes(buffer[:end]))
+            yielded = True
+            del buffer[:end]
+        if not block:
+            break
+    text = decoder.decode(bytes(buffer), final=True)
+    if text or not yielded:
+        yield text
@@ -1,128 +1,851 @@
-import google.cloud.firestore
-from google.cloud import firestore
 import os
 
 
-from dotenv import load_dotenv
-import time
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import atexit
+from contextlib import asynccontextmanager, contextmanager
+from datetime import datetime, timedelta, timezone
+import contextvars
+from functools import partial
+import hashlib
+import itertools
+import json
 
-# Load .env file
-load_dotenv()
+from app.config import Config, SWAN_DEFAULT_CONFIG
+from app.storage import create_async_storage, create_storage
+from app.storage.instrumented import InstrumentedAsyncStorage, InstrumentedStorage
+from app.storage.versioned import CollectionVersions, VersionedAsyncStorage, VersionedStorage
+from app.utils.write_behind import create_message_queue
+from app.utils.command_cache import CommandIndex
+from app.utils.config_profiles import ConfigProfiles, DEFAULT_PROFILE, PROFILE_FIELD
+from app.utils.lease import Lease
+from app.utils.metrics import HANDSHAKE_STATUS, REGISTRY, create_shared_metrics, observe_storage
+from app.utils.round_trips import observe_round_trip
+from app.utils.message_archive import create_message_archive
+from app.utils.message_backfill import start_backfill
+from app.utils.periodic import PeriodicTask
+from app.utils.meter_readings import ReadingParser, create_meter_reading_writer, create_meter_readings
+from app.utils.replay_cache import create_replay_cache
+from app.utils.session_gc import create_session_compactor
 
 UPLOAD_SERVER = os.getenv("UPLOAD_SERVER")
 
 
-# Determine if the app should connect to the Firestore emulator or production Firestore
-if "FIRESTORE_EMULATOR_HOST" in os.environ:
-    # Using Firestore emulator
-    credentials = google.auth.credentials.AnonymousCredentials()
-    db = firestore.Client(
-        project=os.environ["FIRESTORE_PROJECT_ID"], credentials=credentials
+# Firestore, SQLite or in-memory storage, selected by Config.STORAGE_BACKEND.
+# Backends connect on first use, so importing this module before a fork is safe
+_backend = create_storage(Config)
+
+# Writes to collections listed with ETags also update their version markers
+collection_versions = CollectionVersions(
+    Config.ETAG_VERSIONED_COLLECTIONS, shards=Config.COLLECTION_VERSION_SHARDS
+)
+
+# Every round trip, version marker writes included, is timed and counted per
+# collection, see app.utils.metrics, and counted per request, see app.utils.round_trips
+storage = VersionedStorage(
+    InstrumentedStorage(_backend, [observe_storage, observe_round_trip]), collection_versions
+)
+
+# Version markers are written behind the commits that change them, by a
+# background thread, and when the interpreter exits
+collection_version_writer = PeriodicTask(
+    "collection-versions", Config.COLLECTION_VERSION_FLUSH_INTERVAL, partial(collection_versions.flush, storage)
+)
+atexit.register(collection_versions.flush, storage)
+
+# Asynchronous access to the same backend, for the async SWAN handshake
+async_storage = create_async_storage(storage)
+if async_storage.native:
+    # Native asyncio clients do not go through `storage`, so they are versioned and timed separately
+    async_storage = VersionedAsyncStorage(
+        InstrumentedAsyncStorage(async_storage, [observe_storage, observe_round_trip]), collection_versions
     )
-    print("Connected to Firestore Emulator.")
-else:
-    # Using Production Firestore
-    dbname = os.environ.get("FIRESTORE_DB_NAME")
-    print(f"DB Name: {dbname}")
-    if dbname:
-        db = firestore.Client(database=dbname)
+
+
+# Audit messages are written behind the request by a background thread
+message_queue = create_message_queue(storage, Config) if Config.MESSAGE_QUEUE_ENABLED else None
+
+# Retransmitted command results are answered with the response already sent
+replay_cache = create_replay_cache(Config) if Config.REPLAY_CACHE_ENABLED else None
+
+# CSV uploads are parsed into per-meter readings, stored by a background thread
+meter_readings = create_meter_readings(storage, Config) if Config.METER_READINGS_ENABLED else None
+meter_reading_writer = (
+    create_meter_reading_writer(meter_readings, Config) if meter_readings is not None else None
+)
+
+# Finished and stuck sessions are cleaned up by a background thread
+session_compactor = create_session_compactor(storage, Config) if Config.SESSION_GC_ENABLED else None
+
+# Old messages are moved to compressed daily partitions by a background thread
+message_archive = create_message_archive(storage, Config) if Config.MESSAGE_ARCHIVE_ENABLED else None
+
+# Server workers report their metrics together, see app.utils.metrics.SharedMetrics
+shared_metrics = create_shared_metrics(REGISTRY, Config)
+
+
+# The pid start_background_tasks last ran in
+_background_tasks_pid = None
+
+
+def start_background_tasks():
+    """
+    Start the maintenance threads; called by the server hooks in each worker.
+
+    Calls after the first in a process do nothing, so the gunicorn post_fork
+    hook and the ASGI lifespan can both call it. The session compactor, the
+    message archive and the backfill run in every worker but only do their
+    work in the one holding their lease, see app.utils.lease.Lease.
+    """
+    global _background_tasks_pid
+    if _background_tasks_pid == os.getpid():
+        return
+    _background_tasks_pid = os.getpid()
+    for task in (collection_version_writer, session_compactor, message_archive, shared_metrics):
+        if task is not None:
+            task.start()
+    if Config.MESSAGES_BACKFILL_ON_START:
+        start_backfill(storage, lease=Lease(storage, "message-backfill", ttl=3600))
+
+
+def stop_background_tasks():
+    """Stop the maintenance threads and write out queued audit messages."""
+    global _background_tasks_pid
+    _background_tasks_pid = None
+    for task in (collection_version_writer, session_compactor, message_archive):
+        if task is not None:
+            task.stop()
+    if meter_reading_writer is not None:
+        meter_reading_writer.stop()
+    if message_queue is not None:
+        message_queue.stop()
+    if shared_metrics is not None:
+        shared_metrics.stop()
+    collection_versions.flush(storage)
+
+# Pending commands are looked up locally; the index loads on first use
+command_index = CommandIndex(
+    storage,
+    "command_to_swan",
+    ttl=Config.COMMAND_CACHE_TTL,
+    listen=Config.COMMAND_CACHE_LISTEN,
+) if Config.COMMAND_CACHE_ENABLED else None
+
+# Configs are resolved as defaults -> profile -> device or command overrides
+config_profiles = ConfigProfiles(
+    storage,
+    "config_profiles",
+    SWAN_DEFAULT_CONFIG,
+    maxsize=Config.CONFIG_PROFILE_CACHE_SIZE,
+    ttl=Config.CONFIG_PROFILE_CACHE_TTL,
+    listen=Config.CONFIG_PROFILE_LISTEN,
+)
+
+
+# Unit of Work
+class UnitOfWork:
+    """
+    Collects the storage mutations of one request and commits them together.
+
+    Repeated writes to the same document are merged, so a `set` followed by an
+    `update` becomes a single `set` of the merged data, and a `delete` replaces
+    any earlier write. All merged writes are committed in one atomic batch.
+
+    Reads are not affected: a `get` inside a unit of work returns the state
+    already committed to storage, not the pending writes.
+    """
+
+    def __init__(self, storage):
+        self.storage = storage
+        self._writes = {}
+        self._on_commit = []
+
+    def __len__(self):
+        return len(self._writes)
+
+    def set(self, collection, document_id, data):
+        self._writes[(collection, document_id)] = ("set", dict(data))
+
+    def update(self, collection, document_id, data):
+        key = (collection, document_id)
+        op, pending = self._writes.get(key, (None, None))
+        if op in ("set", "update"):
+            self._writes[key] = (op, {**pending, **data})
+        else:
+            self._writes[key] = ("update", dict(data))
+
+    def delete(self, collection, document_id):
+        self._writes[(collection, document_id)] = ("delete", None)
+
+    def after_commit(self, callback):
+        """Call `callback()` once the pending writes have been committed."""
+        self._on_commit.append(callback)
+
+    def commit(self):
+        """
+        Commit every pending write in one batch.
+
+        Returns:
+            int: The number of document writes committed.
+        """
+        count = len(self._writes)
+        if self._writes:
+            self.storage.commit(self._pending_writes())
+        self._finish()
+        return count
+
+    async def commit_async(self, async_storage):
+        """
+        Commit every pending write in one batch through an `AsyncStorage`.
+
+        Returns:
+            int: The number of document writes committed.
+        """
+        count = len(self._writes)
+        if self._writes:
+            await async_storage.commit(self._pending_writes())
+        self._finish()
+        return count
+
+    def _pending_writes(self):
+        return [
+            (op, collection, document_id, data)
+            for (collection, document_id), (op, data) in self._writes.items()
+        ]
+
+    def _finish(self):
+        self._writes = {}
+        callbacks, self._on_commit = self._on_commit, []
+        for callback in callbacks:
+            callback()
+
+    def rollback(self):
+        self._writes = {}
+        self._on_commit = []
+
+
+_current_unit_of_work = contextvars.ContextVar("unit_of_work", default=None)
+
+
+@contextmanager
+def unit_of_work():
+    """
+    Run a block of db_utils calls as one unit of work.
+
+    Writes made through the db_utils helpers inside the block are collected
+    and committed in a single batch when the block exits. If the block raises,
+    the pending writes are discarded. Nested blocks join the outer unit of work.
+
+    Yields:
+        UnitOfWork: The active unit of work.
+    """
+    current = _current_unit_of_work.get()
+    if current is not None:
+        yield current
+        return
+
+    uow = UnitOfWork(storage)
+    token = _current_unit_of_work.set(uow)
+    try:
+        yield uow
+    except BaseException:
+        uow.rollback()
+        raise
     else:
-        db = firestore.Client()
-    print("Connected to Production Firestore.")
-    
+        uow.commit()
+    finally:
+        _current_unit_of_work.reset(token)
+
+
+@asynccontextmanager
+async def async_unit_of_work():
+    """
+    Async counterpart of `unit_of_work`, committing through `async_storage`.
+
+    Each asyncio task has its own context, so concurrent requests on one
+    event loop collect their writes separately.
+
+    Yields:
+        UnitOfWork: The active unit of work.
+    """
+    current = _current_unit_of_work.get()
+    if current is not None:
+        yield current
+        return
+
+    uow = UnitOfWork(storage)
+    token = _current_unit_of_work.set(uow)
+    try:
+        yield uow
+    except BaseException:
+        uow.rollback()
+        raise
+    else:
+        await uow.commit_async(async_storage)
+    finally:
+        _current_unit_of_work.reset(token)
+
+
+def _set(collection, document_id, data):
+    uow = _current_unit_of_work.get()
+    if uow is not None:
+        uow.set(collection, document_id, data)
+    else:
+        storage.set(collection, document_id, data)
+
+
+def _update(collection, document_id, data):
+    uow = _current_unit_of_work.get()
+    if uow is not None:
+        uow.update(collection, document_id, data)
+    else:
+        storage.update(collection, document_id, data)
+
+
+def _delete(collection, document_id):
+    uow = _current_unit_of_work.get()
+    if uow is not None:
+        uow.delete(collection, document_id)
+    else:
+        storage.delete(collection, document_id)
+
+
+def _after_commit(callback):
+    uow = _current_unit_of_work.get()
+    if uow is not None:
+        uow.after_commit(callback)
+    else:
+        callback()
+
+
+# Collection Versions
+def get_collection_version(collection):
+    """
+    Read the version marker of a collection listed with ETags.
+
+    Returns:
+        tuple: The version and the time of the last write, or None if the
+        collection is not versioned.
+    """
+    if collection not in collection_versions.collections:
+        return None
     
+    return collection_versions.read(storage, collection)
+
 # Messages Collection
 def get_all_items_messages_collection():
-    docs = db.collection("messages").stream()
+    docs = storage.stream("messages")
+    
+    return docs
+
+def query_items_messages_collection(filters=(), order_by="created_at", descending=True,
+                                    limit=None, start_after=None):
+    # With archiving enabled, archived partitions are listed with the collection
+    query = message_archive.query if message_archive is not None else partial(storage.query, "messages")
+    docs = query(
+        filters=filters, order_by=order_by, descending=descending,
+        limit=limit, start_after=start_after,
+    )
     
     return docs
 
+def _stamp_message(data):
+    # Messages are listed in 'created_at' order
+    if "created_at" in data:
+        return data
+    return {**data, "created_at": datetime.now(timezone.utc)}
+
 def add_item_message_collection(data):
-    db.collection("messages").add(data)
+    data = _stamp_message(data)
+    if message_queue is not None:
+        message_queue.enqueue(data)
+    else:
+        # The generated ID lets the write join an active unit of work
+        _set("messages", storage.new_id("messages"), data)
     
     return 1
 
 def set_item_message_collection(message_id, data):
-    db.collection("messages").document(message_id).set(data)
+    data = _stamp_message(data)
+    if message_queue is not None:
+        message_queue.enqueue(data, document_id=message_id)
+    else:
+        _set("messages", message_id, data)
     
     return 1
 
 def update_item_message_collection(message_id, data):
-    db.collection("messages").document(message_id).update(data)
+    _update("messages", message_id, data)
     
     return 1
 
+# Message Chunks Collection
+def add_csv_message(chunks, imei=None):
+    """
+    Add a CSV upload to the 'messages' collection, chunked if it is large.
+
+    An upload that fits in one chunk is a message with 'csv_data', as
+    always. A larger one is a message with its 'csv_chunks', 'csv_bytes'
+    and 'csv_rows' counts, and its text is in 'message_chunks' documents
+    named '<message_id>-<index>'. Chunks are committed in batches of up to
+    CSV_BATCH_BYTES while the body is read, and the message is added last,
+    so a listed message always has all its chunks.
+
+    Args:
+        chunks (iterable of str): The CSV text in chunks of whole rows, see
+            app.utils.csv_upload.read_csv_chunks.
+        imei (str, optional): The 'Wep-Imei' header.
+
+    With meter readings enabled, the rows are parsed as they are read and
+    the readings queued for the background writer once the message is
+    committed.
+
+    Raises:
+        UploadTooLarge: Raised by `chunks`; chunks already written are deleted.
+    """
+    parser = ReadingParser() if meter_readings is not None else None
+    chunks = iter(parser.parse(chunks) if parser is not None else chunks)
+    first = next(chunks, "")
+    second = next(chunks, None)
+    if second is None:
+        add_item_message_collection({"csv_data": first, "imei": imei} if imei else {"csv_data": first})
+    else:
+        _add_chunked_csv_message(first, second, chunks, imei)
+
+    if parser is not None:
+        parser.close()
+        if parser.readings:
+            _after_commit(partial(meter_reading_writer.submit, parser.readings, imei))
+    
+    return 1
+
+def _add_chunked_csv_message(first, second, chunks, imei):
+    message_id = storage.new_id("messages")
+    written = []
+    batch, batch_bytes = [], 0
+    size = rows = 0
+    last = ""
+    try:
+        for index, chunk in enumerate(itertools.chain((first, second), chunks)):
+            chunk_bytes = len(chunk.encode("utf-8"))
+            if batch and (batch_bytes + chunk_bytes > Config.CSV_BATCH_BYTES or len(batch) >= 500):
+                storage.commit(batch)
+                written.extend(document_id for _, _, document_id, _ in batch)
+                batch, batch_bytes = [], 0
+            batch.append(("set", "message_chunks", f"{message_id}-{index:05d}", {
+                "message_id": message_id, "index": index, "csv_data": chunk,
+            }))
+            batch_bytes += chunk_bytes
+            size += chunk_bytes
+            rows += chunk.count("\n")
+            last = chunk or last
+        storage.commit(batch)
+    except BaseException:
+        if written:
+            storage.commit([("delete", "message_chunks", document_id, None) for document_id in written])
+        raise
+
+    message = {
+        "csv_chunks": index + 1,
+        "csv_bytes": size,
+        "csv_rows": rows + (0 if last.endswith("\n") else 1),
+    }
+    set_item_message_collection(message_id, {**message, "imei": imei} if imei else message)
+
+def get_csv_message_data(message_id, data):
+    """
+    Return the CSV text of a message added by `add_csv_message`.
+
+    Args:
+        message_id (str): The message ID.
+        data (dict): The message document.
+    """
+    if "csv_chunks" not in data:
+        return data.get("csv_data")
+    # An equality filter alone needs no composite index in Firestore
+    docs = storage.query("message_chunks", filters=[("message_id", "==", message_id)])
+    chunks = sorted((doc.to_dict() for doc in docs), key=lambda chunk: chunk["index"])
+    if len(chunks) < data["csv_chunks"] and message_archive is not None:
+        # Archived with the message, see app.utils.message_archive.MessageArchive
+        archived = message_archive.csv_data(message_id, data)
+        if archived is not None:
+            return archived
+    
+    return "".join(chunk["csv_data"] for chunk in chunks)
+
+# Meter Readings Collection
+def query_items_meter_readings_collection(meter_id, since=None, until=None, descending=False, limit=None):
+    docs = meter_readings.query(meter_id, since=since, until=until, descending=descending, limit=limit)
+    
+    return docs
+
+def get_latest_meter_reading(meter_id):
+    reading = meter_readings.latest(meter_id)
+    
+    return reading
+
 # Session Collection
+def get_all_items_session_collection():
+    docs = storage.stream("sessions")
+    
+    return docs
+
+def query_items_session_collection(**query):
+    docs = storage.query("sessions", **query)
+    
+    return docs
+
 def get_item_session_collection(session_id):
-    doc = db.collection("sessions").document(session_id).get()
+    doc = storage.get("sessions", session_id)
+    
+    return doc
+
+async def get_item_session_collection_async(session_id):
+    doc = await async_storage.get("sessions", session_id)
     
     return doc
 
+def _count_session_status(data):
+    if "status" in data:
+        _after_commit(lambda: HANDSHAKE_STATUS.inc(status=data["status"]))
+
+def _stamp_session(data, created=False):
+    # 'updated_at' dates the last status change; 'expires_at' drives the Firestore TTL policy
+    now = datetime.now(timezone.utc)
+    if not created:
+        return {**data, "updated_at": now}
+    return {
+        "created_at": now,
+        "expires_at": now + timedelta(seconds=Config.SESSION_TTL_SECONDS),
+        **data,
+        "updated_at": now,
+    }
+
 def set_item_session_collection(session_id, data):
-    db.collection("sessions").document(session_id).set(data)
+    _set("sessions", session_id, _stamp_session(data, created=True))
+    _count_session_status(data)
     
     return 1
 
 def update_item_session_collection(session_id, data):
-    db.collection("sessions").document(session_id).update(data)
+    _update("sessions", session_id, _stamp_session(data))
+    _count_session_status(data)
     
     return 1
 
 def delete_item_session_collection(session_id):
-    db.collection("sessions").document(session_id).delete()
+    _delete("sessions", session_id)
     
     return 1
 
+# Fields the server adds to a device document next to the reported config
+DEVICE_META_FIELDS = ("config_hash", "config_updated_at")
+
 # Swan Devices Collection
+def get_all_items_swan_devices_collection():
+    docs = storage.stream("swan_devices")
+    
+    return docs
+
+def query_items_swan_devices_collection(**query):
+    docs = storage.query("swan_devices", **query)
+    
+    return docs
+
 def get_item_swan_devices_collection(imei):
-    doc = db.collection("swan_devices").document(imei).get()
+    doc = storage.get("swan_devices", imei)
+    
+    return doc
+
+async def get_item_swan_devices_collection_async(imei):
+    doc = await async_storage.get("swan_devices", imei)
     
     return doc
 
 def set_item_swan_devices_collection(imei, data):
-    db.collection("swan_devices").document(imei).set(data)
+    _set("swan_devices", imei, data)
     
     return 1
 
 def update_item_swan_devices_collection(imei, data):
-    db.collection("swan_devices").document(imei).update(data)
+    _update("swan_devices", imei, data)
     
     return 1
 
 def delete_item_swan_devices_collection(imei):
-    db.collection("swan_devices").document(imei).delete()
+    _delete("swan_devices", imei)
+    
+    return 1
+    
+def device_config_hash(config):
+    canonical = json.dumps(config, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+def save_swan_device_config(imei, config, device_doc=None):
+    """
+    Persist the configuration a SWAN device reported, writing only what changed.
+
+    The report is compared with the config stored in the device document,
+    which the handshake reads anyway, so a document rewritten by another
+    worker or through the API since the last report is noticed. A device
+    that references a config profile stores only the keys that differ from
+    the resolved profile. A report that leaves the stored keys as they are
+    is not written at all. A changed report updates only the changed keys,
+    and records the change in 'swan_device_config_history' when
+    DEVICE_CONFIG_HISTORY is enabled. If stored keys disappeared, or the
+    device is unknown, the whole document is written. The document also
+    stores a hash of the reported config.
+
+    Args:
+        imei (str): The IMEI identifier for the SWAN device.
+        config (dict): The decoded configuration reported by the device.
+        device_doc (app.storage.Document, optional): The device document, if
+            the caller has already read it.
+
+    Returns:
+        str: 'unchanged', 'updated' or 'created'.
+    """
+    if device_doc is None:
+        device_doc = storage.get("swan_devices", imei)
+    stored = device_doc.to_dict()
+    previous, base = {}, {}
+    if stored is not None:
+        previous = {
+            key: value for key, value in stored.items()
+            if key not in DEVICE_META_FIELDS and key != PROFILE_FIELD
+        }
+        # A profile that no longer exists leaves the device with its full config
+        if PROFILE_FIELD in stored:
+            base = resolve_config_profile(stored[PROFILE_FIELD]) or {}
+    target = {key: value for key, value in config.items() if key not in base or base[key] != value}
+    if stored is not None and previous == target:
+        return "unchanged"
+
+    config_hash = device_config_hash(config)
+    meta = {"config_hash": config_hash, "config_updated_at": datetime.now(timezone.utc)}
+    if stored is None:
+        _set("swan_devices", imei, {**config, **meta})
+        result = "created"
+        changes = {key: {"new": value} for key, value in config.items()}
+    else:
+        reported = {**base, **previous}
+        changes = {
+            key: {"old": reported.get(key), "new": value}
+            for key, value in config.items()
+            if key not in reported or reported[key] != value
+        }
+        dropped = [key for key in previous if key not in target]
+        if dropped:
+            # The assigned profile is kept when the whole document is rewritten
+            profile = {PROFILE_FIELD: stored[PROFILE_FIELD]} if PROFILE_FIELD in stored else {}
+            _set("swan_devices", imei, {**target, **meta, **profile})
+            changes.update({key: {"old": previous[key]} for key in dropped if key not in config})
+        else:
+            updated = {key: value for key, value in target.items() if key not in previous or previous[key] != value}
+            _update("swan_devices", imei, {**updated, **meta})
+        result = "updated"
+
+    if Config.DEVICE_CONFIG_HISTORY and changes:
+        _set("swan_device_config_history", storage.new_id("swan_device_config_history"), {
+            "imei": imei,
+            "config_hash": config_hash,
+            "changes": changes,
+            "created_at": meta["config_updated_at"],
+        })
+
+    return result
+    
+# Config Profiles Collection
+def query_items_config_profiles_collection(**query):
+    docs = storage.query("config_profiles", **query)
+    
+    return docs
+
+def get_item_config_profiles_collection(profile_id):
+    doc = storage.get("config_profiles", profile_id)
+    
+    return doc
+
+def set_item_config_profiles_collection(profile_id, data):
+    _set("config_profiles", profile_id, data)
+    _after_commit(lambda: config_profiles.invalidate(None if profile_id == DEFAULT_PROFILE else profile_id))
     
     return 1
+
+def delete_item_config_profiles_collection(profile_id):
+    _delete("config_profiles", profile_id)
+    _after_commit(lambda: config_profiles.invalidate(None if profile_id == DEFAULT_PROFILE else profile_id))
     
+    return 1
+
+def resolve_config_profile(profile_id=DEFAULT_PROFILE, overrides=None):
+    return config_profiles.resolve(profile_id, overrides)
+
+def resolve_command_to_swan(command):
+    return config_profiles.resolve_command(command)
+
 # Command To Swan Collection
+def get_all_items_command_to_swan_collection():
+    docs = storage.stream("command_to_swan")
+    
+    return docs
+
+def query_items_command_to_swan_collection(**query):
+    docs = storage.query("command_to_swan", **query)
+    
+    return docs
+
 def get_item_command_to_swan_collection(imei):
-    doc = db.collection("command_to_swan").document(f"update-{imei}").get()
+    if command_index is not None:
+        return command_index.get(f"update-{imei}")
+    doc = storage.get("command_to_swan", f"update-{imei}")
+    
+    return doc
+
+async def resolve_command_to_swan_async(command):
+    # A profile not cached yet is read in a thread, then resolved from the cache
+    if PROFILE_FIELD in command:
+        await asyncio.to_thread(config_profiles.resolve, command[PROFILE_FIELD])
+    return config_profiles.resolve_command(command)
+
+async def get_item_command_to_swan_collection_async(imei):
+    if command_index is not None and command_index.fresh:
+        return command_index.get(f"update-{imei}")
+    if command_index is not None:
+        # Loading the index streams the whole collection
+        return await asyncio.to_thread(command_index.get, f"update-{imei}")
+    doc = await async_storage.get("command_to_swan", f"update-{imei}")
     
     return doc
 
 def set_item_command_to_swan_collection(imei, data):
-    db.collection("command_to_swan").document(f"update-{imei}").set(data)
+    _set("command_to_swan", f"update-{imei}", data)
+    if command_index is not None:
+        _after_commit(partial(command_index.put, f"update-{imei}", data))
     
     return 1
 
 def update_item_command_to_swan_collection(imei, data):
-    db.collection("command_to_swan").document(f"update-{imei}").update(data)
+    _update("command_to_swan", f"update-{imei}", data)
+    if command_index is not None:
+        _after_commit(partial(command_index.update, f"update-{imei}", data))
     
     return 1
 
 def delete_item_command_to_swan_collection(imei):
-    db.collection("command_to_swan").document(f"update-{imei}").delete()
+    _delete("command_to_swan", f"update-{imei}")
+    if command_index is not None:
+        _after_commit(partial(command_index.discard, f"update-{imei}"))
     
     return 1
 
+def _commit_in_chunks(writes):
+    """
+    Commit `(key, write)` pairs in batches, several batches at a time.
+
+    Batches hold at most BULK_BATCH_SIZE writes and up to
+    BULK_WRITE_PARALLELISM batches are committed concurrently. A failed
+    batch does not stop the others.
+
+    Returns:
+        dict: Maps the key of every write in a failed batch to the error message.
+    """
+    size = max(1, min(Config.BULK_BATCH_SIZE, 500))
+    chunks = [writes[start:start + size] for start in range(0, len(writes), size)]
+
+    def commit_chunk(chunk):
+        try:
+            storage.commit([write for _, write in chunk])
+        except Exception as exc:
+            return {key: str(exc) for key, _ in chunk}
+        return {}
+
+    def commit_in_context(context, chunk):
+        return context.run(commit_chunk, chunk)
+
+    # Each batch runs in a copy of the request's context, so its round trips are counted
+    contexts = [contextvars.copy_context() for _ in chunks]
+    errors = {}
+    with ThreadPoolExecutor(max_workers=max(1, Config.BULK_WRITE_PARALLELISM)) as executor:
+        for chunk_errors in executor.map(commit_in_context, contexts, chunks):
+            errors.update(chunk_errors)
+    return errors
+
+def set_items_command_to_swan_collection(commands):
+    """
+    Write the commands for many devices in batched writes.
+
+    Args:
+        commands (dict): Maps each IMEI to its command document.
+
+    Returns:
+        dict: Maps the IMEI of every command that was not written to the error message.
+    """
+    writes = [
+        (imei, ("set", "command_to_swan", f"update-{imei}", data))
+        for imei, data in commands.items()
+    ]
+    errors = _commit_in_chunks(writes)
+    if command_index is not None:
+        for imei, data in commands.items():
+            if imei not in errors:
+                command_index.put(f"update-{imei}", data)
+    
+    return errors
+
+def delete_items_command_to_swan_collection(imeis):
+    """
+    Delete the commands for many devices in batched writes.
+
+    Args:
+        imeis (list): The IMEIs whose commands are deleted.
+
+    Returns:
+        dict: Maps the IMEI of every command that was not deleted to the error message.
+    """
+    writes = [(imei, ("delete", "command_to_swan", f"update-{imei}", None)) for imei in imeis]
+    errors = _commit_in_chunks(writes)
+    if command_index is not None:
+        for imei in imeis:
+            if imei not in errors:
+                command_index.discard(f"update-{imei}")
+    
+    return errors
+
 
 
     
     
 __all__ = [
-    "db", 
+    "storage", 
+    "async_storage", 
     "UPLOAD_SERVER", 
+    "message_queue", 
+    "command_index", 
+    "session_compactor", 
+    "message_archive", 
+    "replay_cache", 
+    "shared_metrics", 
+    "collection_versions", 
+    "collection_version_writer", 
+    "get_collection_version",
+    "meter_readings", 
+    "start_background_tasks", 
+    "stop_background_tasks", 
+    "config_profiles", 
+    "UnitOfWork", 
+    "unit_of_work", 
+    "async_unit_of_work", 
+    "get_item_session_collection_async",
+    "get_item_swan_devices_collection_async",
+    "get_item_command_to_swan_collection_async",
+    "resolve_command_to_swan_async",
     "add_item_message_collection", 
+    "add_csv_message",
+    "get_csv_message_data",
+    "query_items_meter_readings_collection",
+    "get_latest_meter_reading",
     "set_item_session_collection",
     "update_item_session_collection",
     "delete_item_session_collection",
@@ -131,11 +854,29 @@ __all__ = [
     "update_item_swan_devices_collection",
     "delete_item_swan_devices_collection",
     "get_item_swan_devices_collection",
+    "save_swan_device_config",
+    "device_config_hash",
+    "DEVICE_META_FIELDS",
+    "query_items_config_profiles_collection",
+    "get_item_config_profiles_collection",
+    "set_item_config_profiles_collection",
+    "delete_item_config_profiles_collection",
+    "resolve_config_profile",
+    "resolve_command_to_swan",
     "set_item_command_to_swan_collection",
     "update_item_command_to_swan_collection",
     "delete_item_command_to_swan_collection",
+    "set_items_command_to_swan_collection",
+    "delete_items_command_to_swan_collection",
     "get_item_command_to_swan_collection",
     "get_all_items_messages_collection",
+    "query_items_messages_collection",
+    "get_all_items_session_collection",
+    "get_all_items_swan_devices_collection",
+    "get_all_items_command_to_swan_collection",
+    "query_items_session_collection",
+    "query_items_swan_devices_collection",
+    "query_items_command_to_swan_collection",
     "update_item_message_collection",
     "set_item_message_collection"
 ]
@@ -0,0 +1,84 @@
+import logging
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta, timezone
+
+
+class Lease:
+    """
+    A named lease in storage, held by at most one process at a time.
+
+    Maintenance jobs that must not run concurrently, like the session
+    compactor, run in every server worker but only do their work while
+    their process holds the job's lease. `acquire` takes the lease when it
+    is free or expired, or renews it for its holder, in a storage
+    transaction, so of several workers trying at once exactly one gets
+    it. A holder that dies without releasing the lease loses it once it
+    expires.
+
+    Args:
+        storage (app.storage.Storage): The storage backend.
+        name (str): The lease document ID.
+        ttl (float): Seconds an acquired lease is held without renewal.
+        collection (str): The leases collection.
+    """
+
+    def __init__(self, storage, name, ttl, collection="leases"):
+        self.storage = storage
+        self.name = name
+        self.ttl = ttl
+        self.collection = collection
+        self._holder = None
+        self._pid = None
+
+    @property
+    def holder(self):
+        """This process's holder ID; a forked worker gets its own."""
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._holder = f"{socket.gethostname()}:{self._pid}:{uuid.uuid4().hex[:8]}"
+        return self._holder
+
+    def acquire(self, now=None):
+        """
+        Take or renew the lease.
+
+        Args:
+            now (datetime, optional): The current time, for tests.
+
+        Returns:
+            bool: True if this process holds the lease for the next `ttl` seconds.
+        """
+        now = now or datetime.now(timezone.utc)
+        holder = self.holder
+
+        def take(transaction):
+            lease = transaction.get(self.collection, self.name).to_dict()
+            if lease is not None and lease.get("holder") != holder and lease.get("expires_at") > now:
+                return False
+            transaction.set(self.collection, self.name, {
+                "holder": holder,
+                "expires_at": now + timedelta(seconds=self.ttl),
+            })
+            return True
+
+        try:
+            return self.storage.transaction(take)
+        except Exception:
+            logging.exception(f"Failed to acquire lease {self.name!r}")
+            return False
+
+    def release(self):
+        """Give the lease up if this process holds it."""
+        holder = self.holder
+
+        def give_up(transaction):
+            lease = transaction.get(self.collection, self.name).to_dict()
+            if lease is not None and lease.get("holder") == holder:
+                transaction.delete(self.collection, self.name)
+
+        try:
+            self.storage.transaction(give_up)
+        except Exception:
+            logging.exception(f"Failed to release lease {self.name!r}")
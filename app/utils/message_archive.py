@@ -0,0 +1,429 @@
+import argparse
+import gzip
+import heapq
+import itertools
+import json
+import logging
+import operator
+import os
+from datetime import datetime, timedelta, timezone
+
+from app.storage.base import Document
+from app.utils.lease import Lease
+from app.utils.lru import LRUCache
+from app.utils.periodic import PeriodicTask
+
+
+# Firestore rejects batches with more than 500 writes
+_BATCH_SIZE = 500
+
+_COMPARATORS = {
+    "==": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "in": lambda value, options: value in options,
+}
+
+
+class LocalBlobStore:
+    """
+    Blobs stored as files under a directory.
+
+    Also the stand-in for object storage in development and tests.
+
+    Args:
+        root (str): The directory holding the blobs.
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def put(self, key, data):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Readers never see a partly written blob
+        temporary = f"{path}.tmp-{os.getpid()}"
+        with open(temporary, "wb") as file:
+            file.write(data)
+        os.replace(temporary, path)
+
+    def get(self, key):
+        with open(self._path(key), "rb") as file:
+            return file.read()
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def _path(self, key):
+        return os.path.join(self.root, *key.split("/"))
+
+
+class GCSBlobStore:
+    """
+    Blobs stored in a Google Cloud Storage bucket.
+
+    The google-cloud-storage library is not a requirement of the app; it is
+    imported when the first blob is read or written.
+
+    Args:
+        bucket (str): The bucket name.
+        prefix (str): Prefix of every blob name.
+    """
+
+    def __init__(self, bucket, prefix=""):
+        self.bucket_name = bucket
+        self.prefix = prefix.strip("/") + "/" if prefix.strip("/") else ""
+        self._bucket = None
+
+    def put(self, key, data):
+        self._blob(key).upload_from_string(data, content_type="application/gzip")
+
+    def get(self, key):
+        return self._blob(key).download_as_bytes()
+
+    def delete(self, key):
+        self._blob(key).delete()
+
+    def _blob(self, key):
+        if self._bucket is None:
+            from google.cloud import storage
+
+            self._bucket = storage.Client().bucket(self.bucket_name)
+        return self._bucket.blob(self.prefix + key)
+
+
+def create_blob_store(url):
+    """
+    Create the blob store for a MESSAGE_ARCHIVE_URL.
+
+    Args:
+        url (str): 'gs://bucket/prefix' for Cloud Storage, or a directory,
+            optionally as 'file:///path'.
+    """
+    if url.startswith("gs://"):
+        bucket, _, prefix = url[len("gs://"):].partition("/")
+        return GCSBlobStore(bucket, prefix)
+    if url.startswith("file://"):
+        url = url[len("file://"):]
+    return LocalBlobStore(url)
+
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return {"$dt": value.isoformat()}
+    return str(value)
+
+
+def _decode_object(obj):
+    if len(obj) == 1 and "$dt" in obj:
+        return datetime.fromisoformat(obj["$dt"])
+    return obj
+
+
+def encode_partition(documents):
+    """Encode documents as gzip-compressed NDJSON, one `{"id", "data"}` object per line."""
+    lines = (
+        json.dumps({"id": document.id, "data": document.to_dict()}, default=_encode_value, separators=(",", ":"))
+        for document in documents
+    )
+    return gzip.compress(("\n".join(lines) + "\n").encode("utf-8"))
+
+
+def decode_partition(blob):
+    """Decode a blob written by `encode_partition` into documents."""
+    documents = []
+    for line in gzip.decompress(blob).decode("utf-8").splitlines():
+        if line:
+            entry = json.loads(line, object_hook=_decode_object)
+            documents.append(Document(entry["id"], entry["data"]))
+    return documents
+
+
+def _matches(data, filters):
+    for field, op, value in filters:
+        if field not in data:
+            return False
+        try:
+            if not _COMPARATORS[op](data[field], value):
+                return False
+        except TypeError:
+            return False
+    return True
+
+
+def _day(value):
+    return datetime(value.year, value.month, value.day, tzinfo=timezone.utc)
+
+
+class MessageArchive:
+    """
+    Daily partitions of old messages, stored as compressed NDJSON blobs.
+
+    `archive` moves messages created more than `max_age` seconds ago out of
+    the messages collection: each UTC day becomes one gzip NDJSON blob, and
+    a document in `index_collection`, named after the day ('2024-06-01'),
+    records its blob key and message count. Only whole days are archived.
+    The chunks of chunked CSV uploads, see app.utils.db_utils.add_csv_message,
+    move with their messages into a second blob of the day, from which
+    `csv_data` reads them.
+
+    `query` reads the messages collection and the archived partitions as
+    one, so listings are unchanged by archiving. Decoded partitions are kept
+    in an LRU cache.
+
+    With a `lease`, only the process holding it archives, so every server
+    worker can start the archive without two of them writing the same
+    partition.
+
+    Args:
+        storage (app.storage.Storage): The storage backend.
+        blobs (LocalBlobStore or GCSBlobStore): Where partitions are stored.
+        collection (str): The messages collection.
+        index_collection (str): The collection of partition index documents.
+        max_age (float): Seconds a message stays in the messages collection.
+        cache_size (int): Number of decoded partitions kept in memory.
+        interval (float): Seconds between archive passes of the background thread.
+        chunks_collection (str): The collection of CSV upload chunks.
+        lease (app.utils.lease.Lease, optional): Lease a process must hold to archive.
+    """
+
+    def __init__(self, storage, blobs, collection="messages", index_collection="message_partitions",
+                 max_age=30 * 86400, cache_size=8, interval=3600.0, chunks_collection="message_chunks",
+                 lease=None):
+        self.storage = storage
+        self.blobs = blobs
+        self.collection = collection
+        self.chunks_collection = chunks_collection
+        self.index_collection = index_collection
+        self.max_age = max_age
+        self._cache = LRUCache(maxsize=cache_size)
+        self._task = PeriodicTask("message-archive", interval, self.archive, lease=lease)
+
+    def start(self):
+        """Run `archive` every `interval` seconds on a background thread."""
+        self._task.start()
+
+    def stop(self, timeout=10.0):
+        self._task.stop(timeout)
+
+    def archive(self, now=None):
+        """
+        Move the messages of every whole day older than `max_age` to partitions.
+
+        A day that already has a partition, for example after an interrupted
+        pass, is merged into it. Messages are deleted only after their
+        partition and its index document are written.
+
+        Args:
+            now (datetime, optional): The current time, for tests.
+
+        Returns:
+            dict: The number of 'partitions' written and 'messages' archived.
+        """
+        now = now or datetime.now(timezone.utc)
+        cutoff = _day(now - timedelta(seconds=self.max_age))
+        documents = self.storage.query(
+            self.collection, filters=[("created_at", "<", cutoff)], order_by="created_at"
+        )
+        partitions = archived = 0
+        for day, day_documents in itertools.groupby(documents, key=lambda doc: _day(doc.to_dict()["created_at"])):
+            archived += self._archive_day(day, list(day_documents), now)
+            partitions += 1
+        if partitions:
+            logging.info(f"Archived {archived} messages into {partitions} daily partitions")
+        return {"partitions": partitions, "messages": archived}
+
+    def query(self, filters=(), order_by="created_at", descending=False, limit=None, start_after=None):
+        """
+        Query the messages collection and the archived partitions together.
+
+        Takes the arguments of `Storage.query`; listings must be ordered by
+        'created_at'. Archived partitions are only read when the listing
+        reaches their days: messages created since the archive cutoff are
+        all in the messages collection, so a newest-first page they fill, or
+        a range starting after the cutoff, reads no partition.
+
+        Returns:
+            Iterator of Document.
+        """
+        if order_by != "created_at":
+            raise ValueError("Archived messages can only be listed by 'created_at'")
+        filters = list(filters)
+        hot = self.storage.query(
+            self.collection, filters=filters, order_by=order_by, descending=descending,
+            limit=limit, start_after=start_after,
+        )
+        # Partitions only hold days before the cutoff, unless max_age was raised since they were written
+        cutoff = _day(datetime.now(timezone.utc) - timedelta(seconds=self.max_age))
+        lower_bounds = [value for field, op, value in filters if field == "created_at" and op in (">", ">=")]
+        if start_after is not None and not descending:
+            lower_bounds.append(start_after[0])
+        if any(value >= cutoff for value in lower_bounds):
+            return itertools.islice(hot, limit)
+        merged = self._merge(hot, self._query_archived(filters, descending, start_after), descending, cutoff)
+        return itertools.islice(self._unique(merged), limit)
+
+    @staticmethod
+    def _merge(hot, archived, descending, cutoff):
+        # `archived` is a generator, so the partition index is not queried until the merge needs it
+        def sort_key(document):
+            return document.to_dict()["created_at"], document.id
+
+        hot = iter(hot)
+        if descending:
+            for document in hot:
+                if document.to_dict()["created_at"] < cutoff:
+                    hot = itertools.chain([document], hot)
+                    break
+                yield document
+        yield from heapq.merge(hot, archived, key=sort_key, reverse=descending)
+
+    def csv_data(self, message_id, data):
+        """
+        Return the CSV text of an archived chunked upload.
+
+        Args:
+            message_id (str): The message ID.
+            data (dict): The message document, with its 'created_at'.
+
+        Returns:
+            str: The text, or None if the day has no archived chunks.
+        """
+        index = self.storage.get(self.index_collection, _day(data["created_at"]).strftime("%Y-%m-%d")).to_dict()
+        if index is None or "chunks_blob" not in index:
+            return None
+        chunks = sorted(
+            (document.to_dict() for document in self._load(index, "chunks_blob")
+             if document.to_dict()["message_id"] == message_id),
+            key=lambda chunk: chunk["index"],
+        )
+        return "".join(chunk["csv_data"] for chunk in chunks) if chunks else None
+
+    @staticmethod
+    def _unique(documents):
+        # A message is in both tiers if a pass was interrupted before deleting it
+        previous = None
+        for document in documents:
+            if document.id != previous:
+                yield document
+            previous = document.id
+
+    def _archive_day(self, day, documents, now):
+        partition_id = day.strftime("%Y-%m-%d")
+        key = f"{self.collection}/{day:%Y/%m/%d}.ndjson.gz"
+        chunks_key = f"{self.chunks_collection}/{day:%Y/%m/%d}.ndjson.gz"
+        chunks = [
+            chunk
+            for document in documents if "csv_chunks" in document.to_dict()
+            for chunk in self.storage.query(self.chunks_collection, filters=[("message_id", "==", document.id)])
+        ]
+
+        index = self.storage.get(self.index_collection, partition_id)
+        partition, archived_chunks = documents, chunks
+        if index.exists:
+            partition = self._merged(
+                self._load(index.to_dict()), documents, key=lambda doc: (doc.to_dict()["created_at"], doc.id)
+            )
+            if "chunks_blob" in index.to_dict():
+                archived_chunks = self._merged(
+                    self._load(index.to_dict(), "chunks_blob"), chunks, key=lambda doc: doc.id
+                )
+
+        blob = encode_partition(partition)
+        self.blobs.put(key, blob)
+        entry = {
+            "day": day,
+            "blob": key,
+            "count": len(partition),
+            "bytes": len(blob),
+            "archived_at": now,
+        }
+        if archived_chunks:
+            self.blobs.put(chunks_key, encode_partition(archived_chunks))
+            entry["chunks_blob"] = chunks_key
+        self.storage.set(self.index_collection, partition_id, entry)
+        # Messages go first, so a message still listed from the messages collection has all its chunks there
+        deletes = [("delete", self.collection, document.id, None) for document in documents]
+        deletes += [("delete", self.chunks_collection, chunk.id, None) for chunk in chunks]
+        for start in range(0, len(deletes), _BATCH_SIZE):
+            self.storage.commit(deletes[start:start + _BATCH_SIZE])
+        return len(documents)
+
+    @staticmethod
+    def _merged(archived, documents, key):
+        merged = {document.id: document for document in archived}
+        merged.update((document.id, document) for document in documents)
+        return sorted(merged.values(), key=key)
+
+    def _query_archived(self, filters, descending, start_after):
+        day_filters = []
+        for field, op, value in filters:
+            if field == "created_at" and op in (">", ">="):
+                day_filters.append(("day", ">=", _day(value)))
+            elif field == "created_at" and op in ("<", "<="):
+                day_filters.append(("day", "<=", value))
+        if start_after is not None:
+            value, _ = start_after
+            day_filters.append(("day", "<=", value) if descending else ("day", ">=", _day(value)))
+
+        partitions = self.storage.query(
+            self.index_collection, filters=day_filters, order_by="day", descending=descending
+        )
+        cursor = tuple(start_after) if start_after is not None else None
+        for partition in partitions:
+            documents = self._load(partition.to_dict())
+            if descending:
+                documents = reversed(documents)
+            for document in documents:
+                data = document.to_dict()
+                if not _matches(data, filters):
+                    continue
+                if cursor is not None:
+                    key = (data["created_at"], document.id)
+                    if (key >= cursor) if descending else (key <= cursor):
+                        continue
+                yield document
+
+    def _load(self, index, field="blob"):
+        # Partitions are rewritten when merged; the write time tells the versions apart
+        cache_key = (index[field], index["archived_at"])
+        documents = self._cache.get(cache_key)
+        if documents is None:
+            documents = decode_partition(self.blobs.get(index[field]))
+            self._cache.set(cache_key, documents)
+        return documents
+
+
+def create_message_archive(storage, config):
+    return MessageArchive(
+        storage,
+        create_blob_store(config.MESSAGE_ARCHIVE_URL),
+        index_collection=config.MESSAGE_ARCHIVE_INDEX_COLLECTION,
+        max_age=config.MESSAGE_ARCHIVE_AGE_DAYS * 86400,
+        cache_size=config.MESSAGE_ARCHIVE_CACHE_SIZE,
+        interval=config.MESSAGE_ARCHIVE_INTERVAL,
+        lease=Lease(storage, "message-archive", ttl=3 * config.MESSAGE_ARCHIVE_INTERVAL),
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Archive old messages into daily partitions.")
+    parser.parse_args(argv)
+
+    from app import load_environment
+
+    load_environment()
+    from app.config import Config
+    from app.utils.db_utils import storage
+
+    print(create_message_archive(storage, Config).archive())
+
+
+if __name__ == "__main__":
+    main()
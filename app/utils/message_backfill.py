@@ -0,0 +1,116 @@
+import argparse
+import logging
+import threading
+from datetime import datetime, timezone
+
+from app.utils.conditional import to_datetime
+
+
+# Firestore rejects batches with more than 500 writes
+_BATCH_SIZE = 500
+
+MIGRATION_ID = "messages-created-at"
+
+# Messages without an update time sort before every other message
+_EPOCH = datetime.fromtimestamp(0, timezone.utc)
+
+
+def backfill_created_at(storage, collection="messages", batch_size=_BATCH_SIZE):
+    """
+    Set 'created_at' on messages written before messages were stamped with it.
+
+    GET /swan lists messages in 'created_at' order, and a document without
+    the field is left out of that order by every backend. A legacy message
+    gets its document's update time, the best record of when it was
+    written. The collection is read in pages of document IDs, with only the
+    'created_at' field projected, so CSV payloads are not read.
+
+    Args:
+        storage (app.storage.Storage): The storage backend.
+        collection (str): The messages collection.
+        batch_size (int): Documents per page and per batched write.
+
+    Returns:
+        int: The number of messages updated.
+    """
+    batch_size = max(1, min(batch_size, _BATCH_SIZE))
+    updated = 0
+    cursor = None
+    while True:
+        documents = list(storage.query(collection, limit=batch_size, start_after=cursor, select=["created_at"]))
+        writes = [
+            ("update", collection, document.id, {"created_at": to_datetime(document.update_time) or _EPOCH})
+            for document in documents
+            if "created_at" not in document.to_dict()
+        ]
+        if writes:
+            storage.commit(writes)
+            updated += len(writes)
+        if len(documents) < batch_size:
+            return updated
+        cursor = (None, documents[-1].id)
+
+
+def backfill_once(storage, migrations_collection="migrations", migration_id=MIGRATION_ID,
+                  backfill=backfill_created_at):
+    """
+    Run a backfill unless a previous run completed.
+
+    A completed run is recorded under `migration_id` in
+    `migrations_collection`, so later starts cost one read.
+
+    Args:
+        storage (app.storage.Storage): The storage backend.
+        migrations_collection (str): The collection completed runs are recorded in.
+        migration_id (str): The ID the run is recorded under.
+        backfill (callable): Called with `storage`, returns the number of documents updated.
+
+    Returns:
+        int: The number of documents updated.
+    """
+    if storage.get(migrations_collection, migration_id).exists:
+        return 0
+    updated = backfill(storage)
+    storage.set(migrations_collection, migration_id, {
+        "completed_at": datetime.now(timezone.utc),
+        "updated": updated,
+    })
+    if updated:
+        logging.info(f"Backfill {migration_id!r} updated {updated} documents")
+    return updated
+
+
+def start_backfill(storage, lease=None):
+    """
+    Run `backfill_once` on a background thread, logging rather than raising on failure.
+
+    Every server worker calls this on start; with a `lease`, see
+    app.utils.lease.Lease, only the worker that acquires it runs the backfill.
+    """
+    def run():
+        try:
+            if lease is not None and not lease.acquire():
+                return
+            backfill_once(storage)
+        except Exception:
+            logging.exception("Failed to backfill 'created_at' on messages")
+
+    thread = threading.Thread(target=run, name="message-backfill", daemon=True)
+    thread.start()
+    return thread
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Set 'created_at' on messages that lack it.")
+    parser.parse_args(argv)
+
+    from app import load_environment
+
+    load_environment()
+    from app.utils.db_utils import storage
+
+    print({"updated": backfill_created_at(storage)})
+
+
+if __name__ == "__main__":
+    main()
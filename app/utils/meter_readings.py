@@ -0,0 +1,397 @@
+import atexit
+import csv
+import io
+import itertools
+import logging
+import math
+import os
+import queue
+import threading
+from datetime import datetime, timezone
+from functools import partial
+
+from app.utils.pagination import parse_timestamp
+
+
+# Firestore rejects transactions with more than 500 writes
+_BATCH_SIZE = 500
+
+# Readings kept per document, one a second, well under Firestore's 1 MiB document limit
+_MAX_READINGS = 3600
+
+# Header names accepted for each reading field, lower case
+COLUMNS = {
+    "meter_id": ("meter_id", "meter", "meter_address", "address", "serial", "id"),
+    "manufacturer": ("manufacturer", "manuf", "mfct", "man"),
+    "device_type": ("device_type", "type", "medium", "dev_type"),
+    "timestamp": ("timestamp", "time", "ts", "datetime", "date"),
+    "rssi": ("rssi",),
+    "value": ("value", "reading", "volume", "energy"),
+}
+REQUIRED_COLUMNS = ("meter_id", "timestamp", "value")
+
+
+def _text(value):
+    return value.strip() or None
+
+
+def _meter_id(value):
+    value = value.strip()
+    # Meter IDs are part of document IDs and range keys
+    if not value or "/" in value or "|" in value:
+        raise ValueError(f"Invalid meter ID {value!r}")
+    return value
+
+
+def _timestamp(value):
+    try:
+        seconds = float(value)
+    except ValueError:
+        return parse_timestamp(value.strip()).astimezone(timezone.utc)
+    try:
+        return datetime.fromtimestamp(seconds, timezone.utc)
+    except (OverflowError, OSError) as exc:
+        raise ValueError(f"Invalid timestamp {value!r}") from exc
+
+
+def _value(value):
+    value = float(value)
+    if not math.isfinite(value):
+        raise ValueError("Meter values must be finite")
+    return value
+
+
+def _rssi(value):
+    return int(float(value)) if value.strip() else None
+
+
+CONVERTERS = {
+    "meter_id": _meter_id,
+    "manufacturer": _text,
+    "device_type": _text,
+    "timestamp": _timestamp,
+    "rssi": _rssi,
+    "value": _value,
+}
+
+
+class ReadingParser:
+    """
+    Parse the meter telegram CSV uploaded by SWAN devices into readings.
+
+    Columns are found by their header names, see COLUMNS; an upload
+    without a meter ID, timestamp and value column has no readings.
+    Timestamps are epoch seconds or ISO 8601. Text is fed in chunks, so a
+    large upload is parsed as it is read.
+
+    Rows are converted a column at a time, with `map` over each column of
+    a chunk, and row by row only for chunks with invalid rows, which are
+    counted in `rejected`.
+
+    Attributes:
+        readings (list): Reading dictionaries with the keys of COLUMNS.
+        rejected (int): Number of rows that could not be parsed.
+    """
+
+    def __init__(self):
+        self.readings = []
+        self.rejected = 0
+        self._columns = None
+        self._partial = ""
+
+    def parse(self, chunks):
+        """Feed every chunk of `chunks`, yielding it unchanged."""
+        for chunk in chunks:
+            self.feed(chunk)
+            yield chunk
+        self.close()
+
+    def feed(self, text):
+        """Parse the complete rows of `text`; a trailing partial row waits for the next chunk."""
+        rows, _, self._partial = (self._partial + text).rpartition("\n")
+        if rows:
+            self._parse(rows)
+
+    def close(self):
+        """Parse the last row, if the upload does not end with a newline."""
+        if self._partial:
+            self._parse(self._partial)
+            self._partial = ""
+
+    def _parse(self, text):
+        rows = csv.reader(io.StringIO(text))
+        if self._columns is None:
+            header = next(rows, None)
+            if header is None:
+                return
+            self._columns = self._resolve(header)
+        if not self._columns:
+            return
+        rows = [row for row in rows if row]
+        try:
+            self.readings.extend(self._convert_columns(rows))
+        except (ValueError, IndexError):
+            for row in rows:
+                try:
+                    self.readings.append(self._convert_row(row))
+                except (ValueError, IndexError):
+                    self.rejected += 1
+
+    @staticmethod
+    def _resolve(header):
+        positions = {name.strip().lower(): position for position, name in enumerate(header)}
+        columns = {}
+        for field, names in COLUMNS.items():
+            position = next((positions[name] for name in names if name in positions), None)
+            if position is not None:
+                columns[field] = position
+        if any(field not in columns for field in REQUIRED_COLUMNS):
+            return {}
+        return columns
+
+    def _convert_columns(self, rows):
+        values = {
+            field: list(map(CONVERTERS[field], [row[position] for row in rows]))
+            for field, position in self._columns.items()
+        }
+        fields = list(COLUMNS)
+        columns = [values.get(field, itertools.repeat(None)) for field in fields]
+        return [dict(zip(fields, reading)) for reading in zip(*columns)]
+
+    def _convert_row(self, row):
+        return {
+            field: CONVERTERS[field](row[self._columns[field]]) if field in self._columns else None
+            for field in COLUMNS
+        }
+
+
+def reading_key(meter_id, hour):
+    return f"{meter_id}|{hour:%Y-%m-%dT%H}"
+
+
+class MeterReadings:
+    """
+    Meter readings, one document per meter and UTC hour.
+
+    Documents are named '<meter_id>|<YYYY-MM-DDTHH>' and repeat that name in
+    their 'key' field, so the hours of a meter in a time range are one
+    single-field range query, which needs no composite index in Firestore.
+    A document holds the meter's 'manufacturer' and 'device_type' and its
+    'readings' of the hour, ordered by timestamp: `{'timestamp', 'value',
+    'rssi', 'imei'}` maps, one per timestamp, the last received winning.
+    A document keeps the newest `_MAX_READINGS` of its hour. Documents
+    written before readings were bucketed by hour, one per meter and day
+    named '<meter_id>|<YYYY-MM-DD>', are still read.
+
+    Readings are merged into the stored documents in a storage
+    transaction, so uploads of the same meter and hour received at once,
+    as when several gateways hear one wM-Bus meter, all keep their readings.
+
+    Args:
+        storage (app.storage.Storage): The storage backend.
+        collection (str): The readings collection.
+    """
+
+    def __init__(self, storage, collection="meter_readings"):
+        self.storage = storage
+        self.collection = collection
+
+    def add(self, readings, imei=None):
+        """
+        Store readings parsed by `ReadingParser`.
+
+        Args:
+            readings (list): Reading dictionaries.
+            imei (str, optional): The device that uploaded them.
+
+        Returns:
+            int: The number of documents written.
+        """
+        buckets = {}
+        for reading in readings:
+            key = reading_key(reading["meter_id"], reading["timestamp"])
+            buckets.setdefault(key, []).append(reading)
+
+        keys = sorted(buckets)
+        for start in range(0, len(keys), _BATCH_SIZE):
+            chunk = keys[start:start + _BATCH_SIZE]
+            self.storage.transaction(partial(self._merge_all, keys=chunk, buckets=buckets, imei=imei))
+        return len(keys)
+
+    def query(self, meter_id, since=None, until=None, descending=False, limit=None):
+        """
+        Return the readings of a meter, ordered by timestamp.
+
+        Args:
+            meter_id (str): The meter ID.
+            since (datetime, optional): The first timestamp, inclusive.
+            until (datetime, optional): The last timestamp, exclusive.
+            descending (bool): Newest first.
+            limit (int, optional): Maximum number of readings.
+
+        Returns:
+            Iterator of reading dictionaries, with the meter's fields.
+        """
+        # Documents are keyed by the UTC hour; the day of `since` also covers the legacy daily documents
+        low = f"{meter_id}|{since.astimezone(timezone.utc):%Y-%m-%d}" if since else f"{meter_id}|"
+        high = reading_key(meter_id, until.astimezone(timezone.utc)) if until else f"{meter_id}|\uf8ff"
+        documents = self.storage.query(
+            self.collection,
+            filters=[("key", ">=", low), ("key", "<=", high)],
+            order_by="key",
+            descending=descending,
+        )
+        return itertools.islice(self._readings(documents, since, until, descending), limit)
+
+    def latest(self, meter_id):
+        """Return the newest reading of a meter, or None."""
+        return next(self.query(meter_id, descending=True, limit=1), None)
+
+    def _merge_all(self, transaction, keys, buckets, imei):
+        for key, stored in zip(keys, transaction.get_all(self.collection, keys)):
+            transaction.set(self.collection, key, self._merge(key, stored.to_dict(), buckets[key], imei))
+
+    @staticmethod
+    def _merge(key, stored, readings, imei):
+        meter = readings[-1]
+        merged = {entry["timestamp"]: entry for entry in (stored or {}).get("readings", [])}
+        for reading in readings:
+            merged[reading["timestamp"]] = {
+                "timestamp": reading["timestamp"],
+                "value": reading["value"],
+                "rssi": reading["rssi"],
+                "imei": imei,
+            }
+        timestamps = sorted(merged)
+        if len(timestamps) > _MAX_READINGS:
+            logging.warning(f"Dropped {len(timestamps) - _MAX_READINGS} old readings of {key}")
+            timestamps = timestamps[-_MAX_READINGS:]
+        hour = meter["timestamp"]
+        return {
+            "key": key,
+            "meter_id": meter["meter_id"],
+            "manufacturer": meter["manufacturer"] or (stored or {}).get("manufacturer"),
+            "device_type": meter["device_type"] or (stored or {}).get("device_type"),
+            "hour": datetime(hour.year, hour.month, hour.day, hour.hour, tzinfo=timezone.utc),
+            "readings": [merged[timestamp] for timestamp in timestamps],
+        }
+
+    @staticmethod
+    def _readings(documents, since, until, descending):
+        for document in documents:
+            data = document.to_dict()
+            entries = reversed(data["readings"]) if descending else data["readings"]
+            for entry in entries:
+                if (since and entry["timestamp"] < since) or (until and entry["timestamp"] >= until):
+                    continue
+                yield {
+                    "meter_id": data["meter_id"],
+                    "manufacturer": data.get("manufacturer"),
+                    "device_type": data.get("device_type"),
+                    **entry,
+                }
+
+
+class MeterReadingWriter:
+    """
+    Store parsed readings on a background thread.
+
+    Storing the readings of an upload reads and writes the hourly documents
+    of each of its meters, so it is kept off the device's request and off the
+    event loop. Uploads wait in a bounded queue; when it is full, the
+    readings of an upload are dropped and logged, and its raw CSV stays in
+    the messages collection.
+
+    Args:
+        meter_readings (MeterReadings): Where readings are stored.
+        max_size (int): Uploads waiting to be stored, at most.
+    """
+
+    def __init__(self, meter_readings, max_size=1000):
+        self.meter_readings = meter_readings
+        self._queue = queue.Queue(maxsize=max_size)
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def start(self):
+        """Start the background thread if it is not running in this process."""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            if self._pid != os.getpid():
+                # Uploads inherited from the parent belong to the parent
+                self._queue = queue.Queue(maxsize=self._queue.maxsize)
+            self._pid = os.getpid()
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._run, name="meter-readings", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=10.0):
+        """Stop the background thread after storing every queued upload."""
+        thread = self._thread
+        if thread is None or self._pid != os.getpid():
+            return
+        self._stop_event.set()
+        thread.join(timeout)
+        self._thread = None
+        self.flush()
+
+    def submit(self, readings, imei=None):
+        """
+        Queue the readings of an upload for storing.
+
+        Returns:
+            bool: False if the queue was full and the readings were dropped.
+        """
+        self.start()
+        try:
+            self._queue.put_nowait((readings, imei))
+        except queue.Full:
+            logging.error(f"Dropped {len(readings)} meter readings, the queue is full")
+            return False
+        return True
+
+    def flush(self):
+        """Store every queued upload from the calling thread, and wait for the one in progress."""
+        while True:
+            try:
+                readings, imei = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            self._store(readings, imei)
+        self._queue.join()
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                readings, imei = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            self._store(readings, imei)
+
+    def _store(self, readings, imei):
+        try:
+            store_meter_readings(self.meter_readings, readings, imei)
+        finally:
+            self._queue.task_done()
+
+
+def create_meter_readings(storage, config):
+    return MeterReadings(storage, collection=config.METER_READINGS_COLLECTION)
+
+
+def create_meter_reading_writer(meter_readings, config):
+    """Build a MeterReadingWriter that is flushed when the interpreter exits."""
+    writer = MeterReadingWriter(meter_readings, max_size=config.METER_READINGS_QUEUE_SIZE)
+    atexit.register(writer.stop)
+    return writer
+
+
+def store_meter_readings(meter_readings, readings, imei=None):
+    """Store parsed readings, logging rather than raising on failure."""
+    try:
+        meter_readings.add(readings, imei)
+    except Exception:
+        logging.exception(f"Failed to store {len(readings)} meter readings")
@@ -0,0 +1,472 @@
+import bisect
+import copy
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from app.utils.periodic import PeriodicTask
+
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = [*zip(labelnames, values), *extra]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_number(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self, others=()):
+        """
+        Render the metric, adding the values of other processes.
+
+        Args:
+            others (iterable): Snapshots of the metric in other processes,
+                as returned by `snapshot`.
+        """
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        values = {key: value for key, value in self.snapshot()}
+        for snapshot in others:
+            for key, value in snapshot:
+                key = tuple(key)
+                values[key] = self._combine(values[key], value) if key in values else value
+        for key, value in sorted(values.items()):
+            lines.extend(self._samples(key, value))
+        return lines
+
+    def snapshot(self):
+        """Return the values of this process as JSON-serializable `[key, value]` pairs."""
+        with self._lock:
+            return [[key, copy.deepcopy(value)] for key, value in self._values.items()]
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def _combine(self, value, other):
+        return value + other
+
+
+class Counter(_Metric):
+    """A value that only goes up, per combination of label values."""
+
+    type = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(f"{name}_total", documentation, labelnames)
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def _samples(self, key, value):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_number(value)}"]
+
+
+class Gauge(_Metric):
+    """
+    A value that goes up and down, per combination of label values.
+
+    A gauge without labels can instead read its value from a function
+    when rendered, see `set_function`.
+    """
+
+    type = "gauge"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._function = None
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def set_function(self, function):
+        """Read the value from `function()` whenever the gauge is rendered."""
+        self._key({})
+        self._function = function
+
+    def value(self, **labels):
+        if self._function is not None:
+            return self._function()
+        return self._values.get(self._key(labels), 0)
+
+    def snapshot(self):
+        if self._function is not None:
+            with self._lock:
+                self._values[()] = self._function()
+        return super().snapshot()
+
+    def _samples(self, key, value):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_number(value)}"]
+
+
+class Histogram(_Metric):
+    """
+    Observations counted into cumulative buckets, per combination of label values.
+
+    Args:
+        buckets (tuple): Upper bounds of the buckets, in increasing order.
+    """
+
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0, 0.0]
+            state[0][index] += 1
+            state[1] += 1
+            state[2] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of a block, in seconds."""
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started_at, **labels)
+
+    def count(self, **labels):
+        state = self._values.get(self._key(labels))
+        return state[1] if state is not None else 0
+
+    def _combine(self, state, other):
+        return [[a + b for a, b in zip(state[0], other[0])], state[1] + other[1], state[2] + other[2]]
+
+    def _samples(self, key, state):
+        counts, count, total = state
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip((*self.buckets, float("inf")), counts):
+            cumulative += bucket_count
+            labels = _format_labels(self.labelnames, key, [("le", _format_number(float(bound)))])
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f"{self.name}_count{labels} {count}")
+        lines.append(f"{self.name}_sum{labels} {_format_number(total)}")
+        return lines
+
+
+class Registry:
+    """
+    The metrics of this process, rendered in the Prometheus text format.
+
+    Metrics are kept per process. With several gunicorn workers a scrape
+    sees only the worker that answered it, unless the workers share their
+    metrics through `SharedMetrics`.
+    """
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self, others=()):
+        """
+        Render every metric, adding the values of other processes.
+
+        Args:
+            others (iterable): Registry snapshots of other processes, as
+                returned by `snapshot`.
+        """
+        others = list(others)
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render([snapshot[metric.name] for snapshot in others if metric.name in snapshot]))
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self, gauges=True):
+        """Return the values of every metric, by metric name, as JSON-serializable data."""
+        return {
+            metric.name: metric.snapshot()
+            for metric in self._metrics
+            if gauges or metric.type != "gauge"
+        }
+
+    def merge(self, snapshot, other):
+        """Add the values of registry snapshot `other` to those of `snapshot`."""
+        metrics = {metric.name: metric for metric in self._metrics}
+        merged = dict(snapshot)
+        for name, values in other.items():
+            if name not in metrics:
+                continue
+            combined = {tuple(key): value for key, value in merged.get(name, ())}
+            for key, value in values:
+                key = tuple(key)
+                combined[key] = metrics[name]._combine(combined[key], value) if key in combined else value
+            merged[name] = [[list(key), value] for key, value in combined.items()]
+        return merged
+
+    def clear(self):
+        for metric in self._metrics:
+            metric.clear()
+
+
+class SharedMetrics:
+    """
+    Report the metrics of every process that shares a directory, as one scrape.
+
+    Like prometheus_client's multiprocess mode, for gunicorn workers. Each
+    process writes a snapshot of its registry to `directory` every
+    `interval` seconds, and `render` adds the latest snapshots of the other
+    processes to its own values, so any worker answers a scrape with the
+    totals of all of them, up to `interval` seconds old. Counters and gauges
+    are summed, and histograms are summed per bucket.
+
+    A process that stops folds its counters and histograms into one file of
+    retired values, so totals do not go down when gunicorn recycles a
+    worker. Gauges are reported for running processes only.
+
+    Args:
+        registry (Registry): The registry of this process.
+        directory (str): The directory shared by the processes.
+        interval (float): Seconds between snapshots.
+    """
+
+    RETIRED = "retired.json"
+
+    def __init__(self, registry, directory, interval=5.0):
+        self.registry = registry
+        self.directory = directory
+        self._task = PeriodicTask("metrics-sync", interval, self.sync)
+
+    def start(self):
+        """Start writing snapshots of this process."""
+        os.makedirs(self.directory, exist_ok=True)
+        self._task.start()
+
+    def stop(self):
+        """Stop writing snapshots, and retire the values of this process."""
+        self._task.stop()
+        try:
+            self.retire()
+        except OSError:
+            logging.exception(f"Failed to retire the metrics of process {os.getpid()}")
+
+    def sync(self):
+        """Write a snapshot of this process's metrics."""
+        path = os.path.join(self.directory, _snapshot_name(os.getpid()))
+        self._write(path, {"pid": os.getpid(), "metrics": self.registry.snapshot()})
+
+    def retire(self):
+        """Fold this process's counters and histograms into the retired values."""
+        import fcntl
+
+        with open(os.path.join(self.directory, "retired.lock"), "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            retired = self._read(os.path.join(self.directory, self.RETIRED)) or {"metrics": {}}
+            metrics = self.registry.merge(retired["metrics"], self.registry.snapshot(gauges=False))
+            self._write(os.path.join(self.directory, self.RETIRED), {"metrics": metrics})
+            try:
+                os.remove(os.path.join(self.directory, _snapshot_name(os.getpid())))
+            except FileNotFoundError:
+                pass
+        # Counted in the retired values from now on
+        self.registry.clear()
+
+    def render(self):
+        """Render the metrics of this process and the latest snapshots of the others."""
+        own = _snapshot_name(os.getpid())
+        gauges = {metric.name for metric in self.registry._metrics if metric.type == "gauge"}
+        others = []
+        for file_name in sorted(os.listdir(self.directory)):
+            if not file_name.endswith(".json") or file_name == own:
+                continue
+            snapshot = self._read(os.path.join(self.directory, file_name))
+            if snapshot is None:
+                continue
+            metrics = snapshot["metrics"]
+            if snapshot.get("pid") is not None and not _is_running(snapshot["pid"]):
+                # A process that ended without retiring; its gauges are stale
+                metrics = {name: values for name, values in metrics.items() if name not in gauges}
+            others.append(metrics)
+        return self.registry.render(others)
+
+    def _read(self, path):
+        try:
+            with open(path, encoding="utf-8") as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return None
+        except ValueError:
+            logging.warning(f"Ignoring unreadable metrics snapshot {path}")
+            return None
+
+    def _write(self, path, data):
+        # Readers never see a partly written file
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, "w", encoding="utf-8") as file:
+            json.dump(data, file)
+        os.replace(temporary, path)
+
+
+def _snapshot_name(pid):
+    return f"process-{pid}.json"
+
+
+def _is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def create_shared_metrics(registry, config):
+    """
+    Build a SharedMetrics from the application configuration.
+
+    Returns:
+        SharedMetrics: The shared metrics, or None if METRICS_DIR is not set.
+    """
+    if not config.METRICS_DIR:
+        return None
+    return SharedMetrics(registry, config.METRICS_DIR, interval=config.METRICS_SYNC_INTERVAL)
+
+
+REGISTRY = Registry()
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+REQUEST_SECONDS = REGISTRY.histogram(
+    "swan_http_request_duration_seconds",
+    "Time to handle an HTTP request, by route.",
+    ("method", "route", "status"),
+)
+HANDSHAKE_STEP_SECONDS = REGISTRY.histogram(
+    "swan_handshake_step_duration_seconds",
+    "Time to handle one step of the SWAN handshake, by command result type and code.",
+    ("type", "res_code"),
+)
+DECODE_SECONDS = REGISTRY.histogram(
+    "swan_config_decode_duration_seconds",
+    "Time to decode the base64 JSON config of a get_cfg result.",
+)
+HANDSHAKE_STATUS = REGISTRY.counter(
+    "swan_handshake_status",
+    "Session status changes committed, by status.",
+    ("status",),
+)
+STORAGE_SECONDS = REGISTRY.histogram(
+    "swan_storage_operation_duration_seconds",
+    "Time of storage round trips, by collection and operation.",
+    ("collection", "operation"),
+)
+STORAGE_CALLS = REGISTRY.counter(
+    "swan_storage_operations",
+    "Storage round trips, by collection and operation.",
+    ("collection", "operation"),
+)
+STORAGE_ERRORS = REGISTRY.counter(
+    "swan_storage_errors",
+    "Storage round trips that failed, by collection and operation.",
+    ("collection", "operation"),
+)
+STORAGE_DOCUMENTS = REGISTRY.counter(
+    "swan_storage_documents",
+    "Documents read, written or deleted, by collection and kind.",
+    ("collection", "kind"),
+)
+
+
+def observe_storage(operation, counts, seconds, error):
+    """
+    Storage observer recording round trips in the storage metrics.
+
+    A commit spanning several collections is recorded under each of them.
+    """
+    for collection, kinds in counts.items():
+        STORAGE_SECONDS.observe(seconds, collection=collection, operation=operation)
+        STORAGE_CALLS.inc(collection=collection, operation=operation)
+        if error is not None:
+            STORAGE_ERRORS.inc(collection=collection, operation=operation)
+        for kind, amount in kinds.items():
+            if amount:
+                STORAGE_DOCUMENTS.inc(amount, collection=collection, kind=kind)
+
+
+def register_request_metrics(app):
+    """
+    Record the latency of every request in `swan_http_request_duration_seconds`.
+
+    Requests are labelled with their route pattern, not their path, so
+    device IMEIs in URLs do not create new series.
+
+    Args:
+        app (flask.Flask): The application.
+    """
+    from flask import g, request
+
+    @app.before_request
+    def start_request_timer():
+        g.metrics_started_at = time.perf_counter()
+
+    @app.after_request
+    def observe_request(response):
+        started_at = g.get("metrics_started_at")
+        if started_at is not None:
+            REQUEST_SECONDS.observe(
+                time.perf_counter() - started_at,
+                method=request.method,
+                route=request.url_rule.rule if request.url_rule is not None else "<unmatched>",
+                status=response.status_code,
+            )
+        return response
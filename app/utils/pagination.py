@@ -0,0 +1,90 @@
+import base64
+import json
+from datetime import datetime, timezone
+
+
+def encode_cursor(value, document_id):
+    """
+    Encode the position after a document as an opaque cursor token.
+
+    Args:
+        value: The document's value of the field the listing is ordered by.
+        document_id (str): The document ID.
+
+    Returns:
+        str: A URL-safe cursor token.
+    """
+    if isinstance(value, datetime):
+        value = {"$dt": value.isoformat()}
+    payload = json.dumps({"v": value, "id": document_id}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(token):
+    """
+    Decode a cursor token created by `encode_cursor`.
+
+    Args:
+        token (str): The cursor token.
+
+    Returns:
+        tuple: `(value, document_id)`, as accepted by `Storage.query(start_after=...)`.
+
+    Raises:
+        ValueError: If the token is malformed.
+    """
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        value, document_id = payload["v"], payload["id"]
+    except (ValueError, KeyError, TypeError) as exc:
+        raise ValueError("Invalid cursor") from exc
+    if isinstance(value, dict) and "$dt" in value:
+        value = datetime.fromisoformat(value["$dt"])
+    return value, document_id
+
+
+def parse_timestamp(text):
+    """
+    Parse an ISO 8601 timestamp query parameter.
+
+    Timestamps without a timezone are taken to be UTC.
+
+    Args:
+        text (str): The timestamp, e.g. '2024-05-01T00:00:00Z'.
+
+    Returns:
+        datetime.datetime: A timezone-aware datetime.
+
+    Raises:
+        ValueError: If the text is not an ISO 8601 timestamp.
+    """
+    if text.endswith("Z"):
+        text = text[:-1] + "+00:00"
+    value = datetime.fromisoformat(text)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value
+
+
+def parse_limit(text, default, maximum):
+    """
+    Parse a page size query parameter.
+
+    Args:
+        text (str): The parameter value, or None when it was not given.
+        default (int): The page size to use when no value was given.
+        maximum (int): The largest page size allowed.
+
+    Returns:
+        int: The page size.
+
+    Raises:
+        ValueError: If the value is not a positive integer.
+    """
+    if text is None:
+        return default
+    limit = int(text)
+    if limit < 1:
+        raise ValueError("limit must be a positive integer")
+    return min(limit, maximum)
@@ -0,0 +1,64 @@
+import logging
+import os
+import threading
+
+
+class PeriodicTask:
+    """
+    Call a function every `interval` seconds on a background thread.
+
+    Like the message write-behind queue, the thread is started lazily and
+    restarted after a fork, so tasks can be created before gunicorn forks
+    its workers. A call that raises is logged and the task keeps running.
+
+    With a `lease`, see app.utils.lease.Lease, the task runs in every
+    process but the function is only called in the one holding the lease,
+    which is renewed before each call and released when the task stops.
+
+    Args:
+        name (str): The thread name, also used in log messages.
+        interval (float): Seconds between the end of a call and the next one.
+        function (callable): Called without arguments.
+        lease (app.utils.lease.Lease, optional): Lease the process must hold to call the function.
+    """
+
+    def __init__(self, name, interval, function, lease=None):
+        self.name = name
+        self.interval = interval
+        self.function = function
+        self.lease = lease
+
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def start(self):
+        """Start the thread if it is not running in this process."""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=10.0):
+        """Stop the thread, letting a running call finish."""
+        thread = self._thread
+        if thread is None or self._pid != os.getpid():
+            return
+        self._stop_event.set()
+        thread.join(timeout)
+        self._thread = None
+        if self.lease is not None:
+            self.lease.release()
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            if self.lease is not None and not self.lease.acquire():
+                continue
+            try:
+                self.function()
+            except Exception:
+                logging.exception(f"{self.name} failed")
@@ -0,0 +1,142 @@
+import re
+from datetime import datetime
+
+from app.utils.pagination import decode_cursor, encode_cursor, parse_limit, parse_timestamp
+
+
+# Parameters with a fixed meaning; every other parameter is a filter
+RESERVED_PARAMETERS = {"fields", "limit", "start_after", "order_by", "order", "format"}
+
+# Filter parameters are '<field>' for equality or '<field>__<suffix>'
+FILTER_SUFFIXES = {
+    "": "==",
+    "ne": "!=",
+    "lt": "<",
+    "lte": "<=",
+    "gt": ">",
+    "gte": ">=",
+    "in": "in",
+}
+
+# Fields stored as datetimes, whatever the collection
+TIMESTAMP_FIELDS = ("created_at", "updated_at", "expires_at", "config_updated_at", "archived_at")
+
+_FIELD_NAME = re.compile(r"^[A-Za-z0-9_]+$")
+
+
+def _check_field(field):
+    if not _FIELD_NAME.match(field):
+        raise ValueError(f"Invalid field name: {field!r}")
+    return field
+
+
+def _coerce(value, field_type):
+    if field_type is int:
+        return int(value)
+    if field_type is float:
+        return float(value)
+    if field_type is datetime:
+        return parse_timestamp(value)
+    return value
+
+
+def parse_list_query(args, field_types=None, default_limit=None, max_limit=1000):
+    """
+    Parse the query parameters of a collection listing endpoint.
+
+    Supported parameters:
+
+    - `fields`: comma-separated fields to return (projection).
+    - `<field>=<value>`: equality filter. `<field>__ne`, `__lt`, `__lte`,
+      `__gt` and `__gte` give the other comparisons, and `<field>__in` can be
+      repeated to match any of several values.
+    - `order_by` and `order` ('asc' or 'desc'). A range filter without an
+      explicit `order_by` orders by the filtered field, as Firestore requires.
+    - `limit` and `start_after`: page size, `default_limit` when omitted
+      (unlimited by default), and the cursor returned in the `X-Next-Cursor`
+      header of the previous page.
+
+    Filter values are converted to the type given in `field_types`. Fields
+    in TIMESTAMP_FIELDS are parsed as ISO 8601 timestamps unless listed
+    there, and other fields are compared as strings.
+
+    Args:
+        args (werkzeug.datastructures.MultiDict): The request query parameters.
+        field_types (dict, optional): Maps field names to `int`, `float`,
+            `str` or `datetime`.
+        default_limit (int, optional): The page size when none is requested;
+            None lists every matching document.
+        max_limit (int): The largest page size allowed.
+
+    Returns:
+        dict: Keyword arguments for `Storage.query`.
+
+    Raises:
+        ValueError: If a parameter is invalid.
+    """
+    field_types = {**dict.fromkeys(TIMESTAMP_FIELDS, datetime), **(field_types or {})}
+
+    filters = []
+    range_field = None
+    for key in args:
+        if key in RESERVED_PARAMETERS:
+            continue
+        field, _, suffix = key.partition("__")
+        if suffix not in FILTER_SUFFIXES:
+            raise ValueError(f"Unsupported filter: {key!r}")
+        _check_field(field)
+        op = FILTER_SUFFIXES[suffix]
+        field_type = field_types.get(field, str)
+        if op == "in":
+            value = [_coerce(item, field_type) for item in args.getlist(key)]
+        else:
+            value = _coerce(args[key], field_type)
+        if op in ("<", "<=", ">", ">="):
+            range_field = field
+        filters.append((field, op, value))
+
+    select = None
+    if args.get("fields") is not None:
+        select = [_check_field(field) for field in args["fields"].split(",") if field]
+
+    order_by = args.get("order_by") or range_field
+    if order_by is not None:
+        _check_field(order_by)
+    if select is not None and order_by is not None and order_by not in select:
+        # The cursor for the next page needs the ordered field
+        select.append(order_by)
+    order = args.get("order", "asc")
+    if order not in ("asc", "desc"):
+        raise ValueError("order must be 'asc' or 'desc'")
+
+    limit = parse_limit(args.get("limit"), default_limit, max_limit)
+    start_after = decode_cursor(args["start_after"]) if args.get("start_after") else None
+
+    return {
+        "filters": filters,
+        "order_by": order_by,
+        "descending": order == "desc",
+        "limit": limit,
+        "start_after": start_after,
+        "select": select,
+    }
+
+
+def next_page_cursor(documents, query):
+    """
+    Build the cursor for the page after `documents`.
+
+    Args:
+        documents (list): The documents of the current page.
+        query (dict): The query arguments the page was fetched with.
+
+    Returns:
+        str: The cursor, or None when the page was the last one.
+    """
+    limit = query.get("limit")
+    if not documents or limit is None or len(documents) < limit:
+        return None
+    last = documents[-1]
+    order_by = query.get("order_by")
+    value = last.to_dict().get(order_by) if order_by else None
+    return encode_cursor(value, last.id)
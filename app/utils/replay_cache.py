@@ -0,0 +1,155 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from app.utils.lru import LRUCache
+from app.utils.metrics import REGISTRY
+
+
+REPLAYED = REGISTRY.counter(
+    "swan_replayed_responses",
+    "Retransmitted command results answered from the replay cache, by tier.",
+    ("tier",),
+)
+
+
+def replay_key(imei, data, body):
+    """
+    Key a command result posted by a device.
+
+    Args:
+        imei (str): The 'Wep-Imei' header.
+        data: The parsed JSON body.
+        body (bytes): The raw body.
+
+    Returns:
+        tuple: The IMEI and a fingerprint of the command result, or None if
+        the request is not a command result from a device.
+    """
+    if not imei or not isinstance(data, dict) or not isinstance(data.get("cmd_res"), dict):
+        return None
+    result = data["cmd_res"]
+    digest = hashlib.sha256(body).hexdigest()
+    return imei, f"{result.get('id')}|{result.get('type')}|{digest}"
+
+
+class _SharedStore:
+    # SQLite file shared by the workers of one host; connections are per process and thread
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._puts = 0
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=1.0, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS replays "
+                "(imei TEXT PRIMARY KEY, response TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self._local.connection, self._local.pid = connection, os.getpid()
+        return connection
+
+    def get(self, imei):
+        row = self._connection().execute(
+            "SELECT response FROM replays WHERE imei = ? AND expires_at > ?", (imei, time.time())
+        ).fetchone()
+        return row[0] if row else None
+
+    def put(self, imei, response, ttl):
+        connection = self._connection()
+        connection.execute(
+            "INSERT OR REPLACE INTO replays (imei, response, expires_at) VALUES (?, ?, ?)",
+            (imei, response, time.time() + ttl),
+        )
+        self._puts += 1
+        if self._puts % 1000 == 0:
+            connection.execute("DELETE FROM replays WHERE expires_at <= ?", (time.time(),))
+
+
+class ReplayCache:
+    """
+    Responses to device command results, replayed when a device retransmits.
+
+    NB-IoT devices resend a POST when its acknowledgement is lost. The
+    response to the last command result of each device is remembered for
+    `window` seconds with a fingerprint of the result (its 'cmd_res' ID and
+    type and a hash of the body), so an identical retry is answered without
+    touching storage. Only the last result is replayed: a handshake may post
+    the same result twice, as when get_cfg is repeated after an unchanged
+    set_cfg, and the second one must be handled.
+
+    Responses are kept in a bounded LRU cache in process and, when `path`
+    is given, in a SQLite file shared by the workers of the host. A shared
+    store that fails is skipped; the in-process cache still works.
+
+    Args:
+        window (float): Seconds a response is replayed.
+        maxsize (int): Maximum number of devices kept in process.
+        path (str, optional): The SQLite file shared across workers.
+    """
+
+    def __init__(self, window=300.0, maxsize=10000, path=None):
+        self.window = window
+        self._cache = LRUCache(maxsize=maxsize, ttl=window)
+        self._shared = _SharedStore(path) if path else None
+
+    def get(self, key):
+        """
+        Return the response to the command result keyed `key`, if it was the device's last.
+
+        Args:
+            key (tuple): As returned by `replay_key`.
+
+        Returns:
+            tuple: The JSON payload and HTTP status code, or None.
+        """
+        imei, fingerprint = key
+        response = self._cache.get(imei)
+        tier = "process"
+        if response is None and self._shared is not None:
+            try:
+                response = self._shared.get(imei)
+            except sqlite3.Error as exc:
+                logging.warning(f"Replay cache read failed: {exc}")
+                response = None
+            if response is not None:
+                self._cache.set(imei, response)
+                tier = "shared"
+        if response is None:
+            return None
+        last, payload, status = json.loads(response)
+        if last != fingerprint:
+            return None
+        REPLAYED.inc(tier=tier)
+        return payload, status
+
+    def put(self, key, payload, status):
+        """Remember the response to a handled command result, replacing the device's previous one."""
+        imei, fingerprint = key
+        response = json.dumps([fingerprint, payload, status])
+        self._cache.set(imei, response)
+        if self._shared is not None:
+            try:
+                self._shared.put(imei, response, self.window)
+            except sqlite3.Error as exc:
+                logging.warning(f"Replay cache write failed: {exc}")
+
+    def clear(self):
+        """Forget the responses kept in process."""
+        self._cache.clear()
+
+
+def create_replay_cache(config):
+    return ReplayCache(
+        window=config.REPLAY_CACHE_WINDOW,
+        maxsize=config.REPLAY_CACHE_SIZE,
+        path=config.REPLAY_CACHE_PATH or None,
+    )
@@ -0,0 +1,128 @@
+import contextvars
+import threading
+from contextlib import contextmanager
+
+
+# Response header carrying the storage round trips of a request, when enabled
+HEADER = "X-Storage-Round-Trips"
+
+# Tally of the request being handled; copied into threads started with its context
+_current = contextvars.ContextVar("round_trips", default=None)
+
+
+class RoundTrips:
+    """
+    The storage round trips of one request, and the documents they touched.
+
+    A round trip is one call to the storage backend: a `get`, a `stream` or
+    `query`, or a `commit`, however many documents it reads or writes.
+
+    Attributes:
+        round_trips (int): Calls to the storage backend.
+        reads (int): Documents read.
+        writes (int): Documents set or updated.
+        deletes (int): Documents deleted.
+        operations (list): `(operation, collections)` of every round trip, in order.
+    """
+
+    def __init__(self):
+        self.round_trips = 0
+        self.reads = 0
+        self.writes = 0
+        self.deletes = 0
+        self.operations = []
+        self._lock = threading.Lock()
+
+    def add(self, operation, counts):
+        with self._lock:
+            self.round_trips += 1
+            self.operations.append((operation, tuple(counts)))
+            for kinds in counts.values():
+                self.reads += kinds.get("reads", 0)
+                self.writes += kinds.get("writes", 0)
+                self.deletes += kinds.get("deletes", 0)
+
+    def as_dict(self):
+        return {
+            "round_trips": self.round_trips,
+            "reads": self.reads,
+            "writes": self.writes,
+            "deletes": self.deletes,
+        }
+
+    def header(self):
+        """Return the tally as a header value, e.g. 'round_trips=2;reads=1;writes=2;deletes=0'."""
+        return ";".join(f"{key}={value}" for key, value in self.as_dict().items())
+
+    def __repr__(self):
+        return f"RoundTrips({self.header()}, operations={self.operations!r})"
+
+
+def observe_round_trip(operation, counts, seconds, error):
+    """Storage observer adding each round trip to the tally of the current request."""
+    tally = _current.get()
+    if tally is not None:
+        tally.add(operation, counts)
+
+
+@contextmanager
+def count_round_trips():
+    """
+    Count the storage round trips made by a block of work.
+
+    Calls made from threads started with a copy of the current context, such
+    as `asyncio.to_thread`, are counted too; the write-behind message queue
+    writes outside any request and is not.
+
+    Yields:
+        RoundTrips: The tally, updated as the block runs.
+    """
+    tally = RoundTrips()
+    token = _current.set(tally)
+    try:
+        yield tally
+    finally:
+        _current.reset(token)
+
+
+def register_round_trip_accounting(app, config):
+    """
+    Count the storage round trips of every request.
+
+    The tally is added to the request's access log record as a 'storage'
+    field and, when ROUND_TRIP_HEADER is enabled, returned in the
+    X-Storage-Round-Trips response header. Register it after
+    `register_request_logging`, so its tally is bound before the access
+    record is written.
+
+    Args:
+        app (flask.Flask): The application.
+        config (type): The configuration class.
+    """
+    from flask import g
+
+    from app.log import bind_log_context
+
+    @app.before_request
+    def start_round_trips():
+        g.round_trips = RoundTrips()
+        g.round_trips_token = _current.set(g.round_trips)
+
+    @app.after_request
+    def report_round_trips(response):
+        tally = g.get("round_trips")
+        if tally is not None:
+            bind_log_context(storage=tally.as_dict())
+            if config.ROUND_TRIP_HEADER:
+                response.headers[HEADER] = tally.header()
+        return response
+
+    @app.teardown_request
+    def end_round_trips(exc):
+        token = g.pop("round_trips_token", None)
+        if token is not None:
+            try:
+                _current.reset(token)
+            except ValueError:
+                # Streamed responses may finish in another context
+                _current.set(None)
@@ -0,0 +1,254 @@
+import argparse
+import logging
+from datetime import datetime, timedelta, timezone
+from functools import partial
+
+from app.utils.conditional import to_datetime
+from app.utils.lease import Lease
+from app.utils.message_backfill import backfill_once
+from app.utils.metrics import REGISTRY
+from app.utils.periodic import PeriodicTask
+
+
+# Session statuses, as in app.views.main.swan_session_steps
+COMPLETED_STATUSES = ("returned to Galooli", "error")
+INTERMEDIATE_STATUSES = ("created", "sent get_cfg", "received get_cfg", "sent set_cfg", "received set_cfg")
+ERROR_STATUS = "error"
+
+BACKFILL_MIGRATION_ID = "sessions-timestamps"
+
+# Sessions without an update time are the oldest of all
+_EPOCH = datetime.fromtimestamp(0, timezone.utc)
+_TIMESTAMPS = ("created_at", "updated_at", "expires_at")
+
+SESSIONS_COLLECTED = REGISTRY.counter(
+    "swan_sessions_collected",
+    "Sessions removed or resolved by the session compactor, by action.",
+    ("action",),
+)
+
+
+class SessionCompactor:
+    """
+    Remove finished sessions and resolve stuck ones, in batched writes.
+
+    Sessions carry 'created_at', 'updated_at' and 'expires_at' timestamps.
+    A pass of the compactor:
+
+    - marks sessions still in an intermediate status `stuck_after` seconds
+      after their last update as errored, with the status they were stuck in
+      as 'error_reason';
+    - deletes completed and errored sessions last updated more than
+      `retention` seconds ago, copying them to `archive_collection` first
+      when one is given.
+
+    'expires_at' is meant for a Firestore TTL policy on the sessions
+    collection, which deletes whatever the compactor has not. Both queries
+    filter on 'status' and order by 'updated_at', which needs a composite
+    index in Firestore. Sessions written before they were stamped are
+    given their timestamps by `backfill_session_timestamps` on the first
+    pass.
+
+    Each batch is written in a transaction that re-reads its sessions and
+    leaves out those whose status or 'updated_at' changed since the query,
+    so a session a device just finished is not marked as errored. With a
+    `lease`, only the process holding it runs passes, so every server
+    worker can start the compactor.
+
+    Args:
+        storage (app.storage.Storage): The storage backend.
+        collection (str): The sessions collection.
+        retention (float): Seconds a finished session is kept.
+        stuck_after (float): Seconds after which an unfinished session is stuck.
+        batch_size (int): Sessions per batched write.
+        interval (float): Seconds between passes of the background thread.
+        archive_collection (str, optional): Collection finished sessions are copied to.
+        ttl (float): Seconds after creation a backfilled session expires.
+        lease (app.utils.lease.Lease, optional): Lease a process must hold to run passes.
+    """
+
+    def __init__(self, storage, collection="sessions", retention=86400.0, stuck_after=3600.0,
+                 batch_size=500, interval=300.0, archive_collection=None, ttl=30 * 86400.0, lease=None):
+        self.storage = storage
+        self.collection = collection
+        self.retention = retention
+        self.stuck_after = stuck_after
+        self.ttl = ttl
+        # Firestore rejects batches with more than 500 writes; archiving writes twice per session
+        self.batch_size = max(1, min(batch_size, 250 if archive_collection else 500))
+        self.archive_collection = archive_collection
+        self._backfilled = False
+        self._task = PeriodicTask("session-compactor", interval, self.run_once, lease=lease)
+
+    def run_once(self, now=None):
+        """
+        Run one pass over the sessions collection.
+
+        Args:
+            now (datetime, optional): The current time, for tests.
+
+        Returns:
+            dict: The number of sessions 'timed_out', and 'archived' or 'deleted'.
+        """
+        now = now or datetime.now(timezone.utc)
+        if not self._backfilled:
+            backfill_once(
+                self.storage,
+                migration_id=BACKFILL_MIGRATION_ID,
+                backfill=partial(
+                    backfill_session_timestamps, collection=self.collection, ttl=self.ttl,
+                    batch_size=self.batch_size,
+                ),
+            )
+            self._backfilled = True
+        timed_out = self._collect(
+            INTERMEDIATE_STATUSES, now - timedelta(seconds=self.stuck_after), self._time_out_writes(now)
+        )
+        removed = self._collect(
+            COMPLETED_STATUSES, now - timedelta(seconds=self.retention), self._remove_writes
+        )
+        action = "archived" if self.archive_collection else "deleted"
+        SESSIONS_COLLECTED.inc(timed_out, action="timed_out")
+        SESSIONS_COLLECTED.inc(removed, action=action)
+        if timed_out or removed:
+            logging.info(f"Session compactor: {timed_out} timed out, {removed} {action}")
+        return {"timed_out": timed_out, action: removed}
+
+    def start(self):
+        """Run a pass every `interval` seconds on a background thread."""
+        self._task.start()
+
+    def stop(self, timeout=10.0):
+        """Stop the background thread, letting a running pass finish."""
+        self._task.stop(timeout)
+
+    def _collect(self, statuses, cutoff, make_writes):
+        # Written sessions no longer match, so every batch re-runs the query from the start
+        total = 0
+        while True:
+            documents = list(self.storage.query(
+                self.collection,
+                filters=[("status", "in", list(statuses)), ("updated_at", "<", cutoff)],
+                order_by="updated_at",
+                limit=self.batch_size,
+                select=["status", "updated_at"],
+            ))
+            if documents:
+                total += self.storage.transaction(partial(
+                    self._write_unchanged, [document.id for document in documents], statuses, cutoff, make_writes
+                ))
+            if len(documents) < self.batch_size:
+                return total
+
+    def _write_unchanged(self, session_ids, statuses, cutoff, make_writes, transaction):
+        # Sessions updated since the query are left for a later pass
+        written = 0
+        for document in transaction.get_all(self.collection, session_ids):
+            session = document.to_dict() or {}
+            updated_at = session.get("updated_at")
+            if session.get("status") not in statuses or updated_at is None or updated_at >= cutoff:
+                continue
+            transaction.writes.extend(make_writes(document))
+            written += 1
+        return written
+
+    def _time_out_writes(self, now):
+        def make_writes(document):
+            status = document.to_dict().get("status")
+            return [("update", self.collection, document.id, {
+                "status": ERROR_STATUS,
+                "error_reason": f"Timed out in status {status!r}",
+                "updated_at": now,
+            })]
+        return make_writes
+
+    def _remove_writes(self, document):
+        writes = []
+        if self.archive_collection:
+            writes.append(("set", self.archive_collection, document.id, document.to_dict()))
+        writes.append(("delete", self.collection, document.id, None))
+        return writes
+
+
+def backfill_session_timestamps(storage, collection="sessions", ttl=30 * 86400.0, batch_size=500):
+    """
+    Set 'created_at', 'updated_at' and 'expires_at' on sessions written before they were stamped.
+
+    The compactor selects sessions by 'updated_at' and the TTL policy
+    deletes them by 'expires_at', so a session without them would be kept
+    forever. A legacy session gets its document's update time as creation
+    and update time, and expires `ttl` seconds after creation. Each page
+    is filled in a transaction that re-reads its sessions, so timestamps
+    written by a request in the meantime are kept.
+
+    Args:
+        storage (app.storage.Storage): The storage backend.
+        collection (str): The sessions collection.
+        ttl (float): Seconds after creation a session expires.
+        batch_size (int): Sessions per page and per transaction.
+
+    Returns:
+        int: The number of sessions updated.
+    """
+    batch_size = max(1, min(batch_size, 500))
+    updated = 0
+    cursor = None
+    while True:
+        documents = list(storage.query(collection, limit=batch_size, start_after=cursor, select=list(_TIMESTAMPS)))
+        legacy = [document.id for document in documents if not set(_TIMESTAMPS) <= document.to_dict().keys()]
+        if legacy:
+            updated += storage.transaction(partial(_fill_timestamps, collection, legacy, ttl))
+        if len(documents) < batch_size:
+            return updated
+        cursor = (None, documents[-1].id)
+
+
+def _fill_timestamps(collection, session_ids, ttl, transaction):
+    updated = 0
+    for document in transaction.get_all(collection, session_ids):
+        session = document.to_dict()
+        if session is None:
+            continue
+        written = to_datetime(document.update_time) or _EPOCH
+        created_at = session.get("created_at") or written
+        timestamps = {
+            "created_at": created_at,
+            "updated_at": session.get("updated_at") or written,
+            "expires_at": session.get("expires_at") or created_at + timedelta(seconds=ttl),
+        }
+        missing = {field: value for field, value in timestamps.items() if field not in session}
+        if missing:
+            transaction.update(collection, document.id, missing)
+            updated += 1
+    return updated
+
+
+def create_session_compactor(storage, config):
+    return SessionCompactor(
+        storage,
+        retention=config.SESSION_RETENTION_SECONDS,
+        stuck_after=config.SESSION_STUCK_SECONDS,
+        batch_size=config.SESSION_GC_BATCH_SIZE,
+        interval=config.SESSION_GC_INTERVAL,
+        archive_collection=config.SESSION_ARCHIVE_COLLECTION or None,
+        ttl=config.SESSION_TTL_SECONDS,
+        # Held across passes; a pass that outlasts it may overlap another, which the transactions make safe
+        lease=Lease(storage, "session-compactor", ttl=3 * config.SESSION_GC_INTERVAL),
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run one pass of the session compactor.")
+    parser.parse_args(argv)
+
+    from app import load_environment
+
+    load_environment()
+    from app.config import Config
+    from app.utils.db_utils import storage
+
+    print(create_session_compactor(storage, Config).run_once())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,366 @@
+import argparse
+import base64
+import json
+import math
+import os
+import random
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Requests a device sends in one check-in before it gives up on the handshake
+MAX_STEPS = 10
+
+
+def percentile(values, fraction):
+    """
+    Return the nearest-rank percentile of `values`, or None if it is empty.
+
+    Args:
+        values (list): The observations.
+        fraction (float): The percentile as a fraction, e.g. 0.99.
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(fraction * len(ordered)) - 1))]
+
+
+class HTTPTransport:
+    """
+    Send the simulated requests to a running server.
+
+    Args:
+        base_url (str): The server URL, e.g. 'http://localhost:8000'.
+        timeout (float): Seconds to wait for each response.
+    """
+
+    def __init__(self, base_url, timeout=30.0):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def post(self, path, headers, body):
+        import requests
+
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        response = session.post(self.base_url + path, headers=headers, data=body, timeout=self.timeout)
+        try:
+            return response.status_code, response.json()
+        except ValueError:
+            return response.status_code, None
+
+
+class AppTransport:
+    """
+    Send the simulated requests to an app in this process, through the Flask test client.
+
+    Args:
+        app (flask.Flask): The application.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._local = threading.local()
+
+    def post(self, path, headers, body):
+        client = getattr(self._local, "client", None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        response = client.post(path, headers=headers, data=body)
+        return response.status_code, response.get_json(silent=True)
+
+
+class VirtualDevice:
+    """
+    A SWAN device speaking the check-in protocol.
+
+    A check-in uploads CSV data, then answers every command the server sends
+    back: a get_cfg with the device's config encoded in base64, a set_cfg by
+    applying its content to the config and acknowledging it. The check-in
+    ends when a response carries no command.
+
+    Args:
+        imei (str): The device IMEI, sent in the 'Wep-Imei' header.
+        config (dict): The device's current config.
+    """
+
+    def __init__(self, imei, config):
+        self.imei = imei
+        self.config = dict(config)
+
+    def check_in(self, transport, csv_data):
+        """
+        Run one check-in against the server.
+
+        Args:
+            transport: `HTTPTransport` or `AppTransport`.
+            csv_data (str): The CSV body of the upload.
+
+        Returns:
+            dict: The 'seconds' the handshake took, its 'steps' as
+            `(request, status, seconds)` tuples, and the 'error' that ended
+            it, or None.
+        """
+        started_at = time.perf_counter()
+        steps = []
+        request, content_type, body = "upload", "text/csv", csv_data.encode("utf-8")
+        error = None
+        for _ in range(MAX_STEPS):
+            step_started_at = time.perf_counter()
+            try:
+                status, payload = transport.post(
+                    "/swan", {"Wep-Imei": self.imei, "Content-Type": content_type}, body
+                )
+            except Exception as exc:
+                steps.append((request, None, time.perf_counter() - step_started_at))
+                error = f"{request}: {type(exc).__name__}"
+                break
+            steps.append((request, status, time.perf_counter() - step_started_at))
+            if status >= 400 or not isinstance(payload, dict):
+                error = f"{request}: HTTP {status}"
+                break
+            command = payload.get("cmd")
+            if command is None:
+                break
+            try:
+                result = self.execute(command)
+            except ValueError as exc:
+                error = f"{request}: {exc}"
+                break
+            request, content_type = result["type"], "application/json"
+            body = json.dumps({"cmd_res": result}).encode("utf-8")
+        else:
+            error = f"No end of handshake after {MAX_STEPS} requests"
+        return {"seconds": time.perf_counter() - started_at, "steps": steps, "error": error}
+
+    def execute(self, command):
+        """
+        Execute a command from the server.
+
+        Returns:
+            dict: The 'cmd_res' object to post back.
+
+        Raises:
+            ValueError: If the command type is unknown.
+        """
+        if command.get("type") == "get_cfg":
+            content = base64.b64encode(json.dumps(self.config).encode("utf-8")).decode("ascii")
+            return {"type": "get_cfg", "id": command.get("id"), "res_code": 0, "content": content}
+        if command.get("type") == "set_cfg":
+            try:
+                self.config.update(json.loads(command.get("content") or "{}"))
+                res_code = 0
+            except ValueError:
+                res_code = 1
+            return {"type": "set_cfg", "id": command.get("id"), "res_code": res_code}
+        raise ValueError(f"Unknown command {command.get('type')!r}")
+
+
+def create_fleet(count, bursts=1, jitter=0, imei_prefix="35", defaults=None):
+    """
+    Create virtual devices spread over `bursts` upload start hours.
+
+    Device `n` uploads at start hour `n % bursts`, with an upload jitter of
+    `jitter` seconds.
+
+    Returns:
+        list: The `VirtualDevice` objects.
+    """
+    if defaults is None:
+        from app.config import SWAN_DEFAULT_CONFIG as defaults
+
+    width = max(1, 15 - len(imei_prefix))
+    return [
+        VirtualDevice(
+            f"{imei_prefix}{index:0{width}d}",
+            {**defaults, "upload_start_hour": index % bursts, "upload_jitter": jitter},
+        )
+        for index in range(count)
+    ]
+
+
+def arrival_offsets(devices, pattern="burst", burst_interval=60.0, duration=60.0, rng=random):
+    """
+    Work out when each device checks in, in seconds from the start of the run.
+
+    With 'burst', the devices of each upload start hour wake together,
+    `burst_interval` seconds after the previous hour's, and each waits a
+    random part of its 'upload_jitter' first, as the firmware does. With
+    'uniform', check-ins are spread at random over `duration`.
+
+    Returns:
+        list: One offset per device.
+    """
+    if pattern == "burst":
+        return [
+            device.config.get("upload_start_hour", 0) * burst_interval
+            + rng.uniform(0, device.config.get("upload_jitter", 0))
+            for device in devices
+        ]
+    if pattern == "uniform":
+        return [rng.uniform(0, duration) for _ in devices]
+    raise ValueError(f"Unknown arrival pattern: {pattern!r}")
+
+
+def run_fleet(transport, devices, offsets, concurrency=64, csv_data="meter_id,timestamp,value\n1,0,0\n"):
+    """
+    Check every device in at its offset, with at most `concurrency` check-ins in flight.
+
+    Check-ins that cannot start on time because `concurrency` are already
+    in flight wait for a free slot, as devices retrying a busy server would.
+
+    Returns:
+        dict: The summary of the run, see `summarize`.
+    """
+    schedule = sorted(zip(offsets, range(len(devices))))
+    started_at = time.perf_counter()
+
+    def check_in(item):
+        offset, index = item
+        delay = started_at + offset - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        result = devices[index].check_in(transport, csv_data)
+        result["lag"] = max(0.0, -delay)
+        return result
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        results = list(executor.map(check_in, schedule))
+    return summarize(results, time.perf_counter() - started_at)
+
+
+def summarize(results, wall_seconds):
+    """
+    Summarize the check-ins of a run.
+
+    Returns:
+        dict: 'devices', 'handshakes' completed, 'errors', 'error_rate',
+        'wall_seconds', 'throughput' (handshakes per second), handshake
+        latency 'p50', 'p99' and 'max' in seconds, the p99 start 'lag'
+        behind schedule, per-request 'steps' statistics, and the most
+        common error messages.
+    """
+    completed = [result["seconds"] for result in results if result["error"] is None]
+    errors = Counter(result["error"] for result in results if result["error"] is not None)
+
+    steps = {}
+    for result in results:
+        for request, status, seconds in result["steps"]:
+            step = steps.setdefault(request, {"seconds": [], "errors": 0})
+            step["seconds"].append(seconds)
+            if status is None or status >= 400:
+                step["errors"] += 1
+
+    return {
+        "devices": len(results),
+        "handshakes": len(completed),
+        "errors": sum(errors.values()),
+        "error_rate": sum(errors.values()) / len(results) if results else 0.0,
+        "wall_seconds": wall_seconds,
+        "throughput": len(completed) / wall_seconds if wall_seconds > 0 else 0.0,
+        "p50": percentile(completed, 0.50),
+        "p99": percentile(completed, 0.99),
+        "max": max(completed, default=None),
+        "lag_p99": percentile([result.get("lag", 0.0) for result in results], 0.99),
+        "steps": {
+            request: {
+                "count": len(step["seconds"]),
+                "errors": step["errors"],
+                "p50": percentile(step["seconds"], 0.50),
+                "p99": percentile(step["seconds"], 0.99),
+            }
+            for request, step in steps.items()
+        },
+        "error_messages": errors.most_common(5),
+    }
+
+
+def queue_commands(transport, devices, fraction, config, rng=random):
+    """
+    Queue a config command for a random `fraction` of the devices, through the bulk API.
+
+    Returns:
+        int: The number of devices that got a command.
+    """
+    imeis = [device.imei for device in devices if rng.random() < fraction]
+    if imeis:
+        status, payload = transport.post(
+            "/api/commands", {"Content-Type": "application/json"},
+            json.dumps({"imeis": imeis, "config": config}).encode("utf-8"),
+        )
+        if status != 200:
+            raise RuntimeError(f"Failed to queue commands: HTTP {status} {payload}")
+    return len(imeis)
+
+
+def _format_seconds(value):
+    return "-" if value is None else f"{value * 1000:.1f}ms"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Simulate a fleet of SWAN devices checking in.",
+        epilog="Without --url the app runs in this process, on the backend given by --backend. "
+        "With --backend firestore and FIRESTORE_EMULATOR_HOST set, it uses the Firestore emulator.",
+    )
+    parser.add_argument("--url", help="URL of a running server, e.g. http://localhost:8000")
+    parser.add_argument("--backend", default="memory", choices=("memory", "sqlite", "firestore"),
+                        help="storage backend of the in-process app")
+    parser.add_argument("--devices", type=int, default=100, help="number of virtual devices")
+    parser.add_argument("--pattern", default="burst", choices=("burst", "uniform"), help="arrival pattern")
+    parser.add_argument("--bursts", type=int, default=1, help="number of upload start hours")
+    parser.add_argument("--burst-interval", type=float, default=10.0,
+                        help="seconds between the bursts of consecutive start hours")
+    parser.add_argument("--jitter", type=int, default=5, help="upload_jitter of the devices, in seconds")
+    parser.add_argument("--duration", type=float, default=60.0, help="seconds the 'uniform' pattern spreads over")
+    parser.add_argument("--concurrency", type=int, default=64, help="check-ins in flight at most")
+    parser.add_argument("--commands", type=float, default=0.1,
+                        help="fraction of devices with a pending config command")
+    parser.add_argument("--seed", type=int, help="random seed, for repeatable runs")
+    parser.add_argument("--json", action="store_true", help="print the summary as JSON")
+    args = parser.parse_args(argv)
+
+    if args.url:
+        transport = HTTPTransport(args.url)
+    else:
+        # Settings are read when the app is first imported
+        os.environ["STORAGE_BACKEND"] = args.backend
+        os.environ.setdefault("LOG_LEVEL", "WARNING")
+        from app import create_app
+
+        transport = AppTransport(create_app())
+
+    rng = random.Random(args.seed)
+    devices = create_fleet(args.devices, bursts=max(1, args.bursts), jitter=args.jitter)
+    queue_commands(transport, devices, args.commands, {"nb1_apn": "simulated"}, rng)
+    offsets = arrival_offsets(devices, args.pattern, args.burst_interval, args.duration, rng)
+    summary = run_fleet(transport, devices, offsets, args.concurrency)
+
+    if args.json:
+        print(json.dumps(summary, indent=2))
+        return
+    print(f"{'devices':<16}{summary['devices']:>10}")
+    print(f"{'handshakes':<16}{summary['handshakes']:>10}")
+    print(f"{'error rate':<16}{summary['error_rate']:>10.2%}")
+    print(f"{'wall time':<16}{summary['wall_seconds']:>9.1f}s")
+    print(f"{'throughput':<16}{summary['throughput']:>8.1f}/s")
+    print(f"{'latency p50':<16}{_format_seconds(summary['p50']):>10}")
+    print(f"{'latency p99':<16}{_format_seconds(summary['p99']):>10}")
+    print(f"{'start lag p99':<16}{_format_seconds(summary['lag_p99']):>10}")
+    print("\nRequests:")
+    for request, step in summary["steps"].items():
+        print(
+            f"  {request:<10}{step['count']:>8}  p50 {_format_seconds(step['p50']):>9}"
+            f"  p99 {_format_seconds(step['p99']):>9}  errors {step['errors']}"
+        )
+    for message, count in summary["error_messages"]:
+        print(f"  {count:>6}  {message}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+
+
+# Run in a fresh interpreter by `measure_startup`
+_STARTUP_SCRIPT = """
+import json, sys, time
+started_at = time.perf_counter()
+from app import create_app
+imported_at = time.perf_counter()
+app = create_app()
+created_at = time.perf_counter()
+response = app.test_client().get(sys.argv[1])
+responded_at = time.perf_counter()
+print(json.dumps({
+    "import_seconds": imported_at - started_at,
+    "create_app_seconds": created_at - imported_at,
+    "first_response_seconds": responded_at - created_at,
+    "startup_seconds": responded_at - started_at,
+    "status": response.status_code,
+}))
+"""
+
+
+def profile_first_response(app, started_at):
+    """
+    Log how long the app took to start and to answer its first request.
+
+    Args:
+        app (flask.Flask): The application.
+        started_at (float): `time.perf_counter()` when the app package was imported.
+    """
+    ready_at = time.perf_counter()
+    logging.info(f"Startup: app created {ready_at - started_at:.3f}s after import")
+    responded = False
+
+    @app.after_request
+    def log_first_response(response):
+        nonlocal responded
+        if not responded:
+            responded = True
+            logging.info(f"Startup: first response {time.perf_counter() - started_at:.3f}s after import")
+        return response
+
+
+def parse_importtime(output):
+    """
+    Parse the report written to stderr by `python -X importtime`.
+
+    Args:
+        output (str): The stderr output.
+
+    Returns:
+        list: `(module, self_us, cumulative_us)` tuples, in import order. The
+        module names keep their indentation, which shows the import nesting.
+    """
+    imports = []
+    for line in output.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            # The header line
+            continue
+        imports.append((fields[2][1:].rstrip(), int(fields[0]), int(fields[1])))
+    return imports
+
+
+def measure_startup(path="/index", env=None, top=15):
+    """
+    Measure a cold start of the app in a fresh interpreter.
+
+    The interpreter imports the app, creates it and serves one request to
+    `path` through the test client, with `-X importtime` enabled.
+
+    Args:
+        path (str): The path requested as the first request.
+        env (dict, optional): Environment variables to set for the interpreter.
+        top (int): Number of slowest top-level imports to report.
+
+    Returns:
+        dict: The phase timings in seconds ('import_seconds',
+        'create_app_seconds', 'first_response_seconds', 'startup_seconds'),
+        the 'status' of the first response, the interpreter's 'wall_seconds'
+        and the slowest 'imports' as `(module, cumulative_seconds)` pairs.
+
+    Raises:
+        RuntimeError: If the interpreter fails.
+    """
+    root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    started_at = time.perf_counter()
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", _STARTUP_SCRIPT, path],
+        cwd=root, env={**os.environ, **(env or {})}, capture_output=True, text=True,
+    )
+    wall_seconds = time.perf_counter() - started_at
+    if process.returncode != 0:
+        raise RuntimeError(f"Startup failed:\n{process.stderr[-2000:]}")
+
+    result = json.loads(process.stdout.strip().splitlines()[-1])
+    result["wall_seconds"] = wall_seconds
+    # Top-level imports are the ones without leading indentation in the module column
+    imports = [
+        (module, cumulative / 1e6)
+        for module, _, cumulative in parse_importtime(process.stderr)
+        if not module.startswith(" ")
+    ]
+    result["imports"] = sorted(imports, key=lambda item: item[1], reverse=True)[:top]
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Profile a cold start of the app.")
+    parser.add_argument("--path", default="/index", help="path of the first request")
+    parser.add_argument("--top", type=int, default=15, help="number of slowest imports to list")
+    args = parser.parse_args(argv)
+
+    result = measure_startup(args.path, top=args.top)
+    for phase in ("import_seconds", "create_app_seconds", "first_response_seconds", "startup_seconds", "wall_seconds"):
+        print(f"{phase:<24}{result[phase]:8.3f}")
+    print(f"{'first response status':<24}{result['status']:8d}")
+    print("\nSlowest imports (cumulative seconds):")
+    for module, seconds in result["imports"]:
+        print(f"  {seconds:8.3f}  {module}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,322 @@
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+
+from app.utils.metrics import REGISTRY
+
+MESSAGE_QUEUE_MESSAGES = REGISTRY.counter(
+    "swan_message_queue_messages",
+    "Audit log messages handled by the write-behind queue, by outcome.",
+    ("outcome",),
+)
+MESSAGE_QUEUE_FLUSH_ERRORS = REGISTRY.counter(
+    "swan_message_queue_flush_errors",
+    "Failed batched writes of the write-behind queue.",
+)
+MESSAGE_QUEUE_DEPTH = REGISTRY.gauge(
+    "swan_message_queue_depth",
+    "Messages waiting in the write-behind queue.",
+)
+
+# Counters of `MessageWriteQueue.stats()` exported as outcomes of MESSAGE_QUEUE_MESSAGES
+_OUTCOMES = ("enqueued", "written", "requeued", "dropped", "sync_writes")
+
+# Queued by `flush` to end the batch the background thread is collecting
+_FLUSH = object()
+
+
+class MessageWriteQueue:
+    """
+    Write-behind queue for the 'messages' audit log.
+
+    Message documents are queued in process and written to storage by a
+    background thread in batched writes. A batch is flushed as soon as it
+    holds `batch_size` documents or `flush_interval` seconds after its first
+    document was queued, whichever comes first.
+
+    The queue is bounded. When it is full, `enqueue` waits up to
+    `put_timeout` seconds and then falls back to writing the document
+    synchronously, so callers are slowed down instead of losing messages.
+
+    A batch whose write still fails after `max_retries` attempts is put
+    back in the queue and retried with the next flush; only messages that
+    no longer fit in the queue are dropped. A synchronous write that fails
+    raises to the caller.
+    """
+
+    def __init__(self, storage, collection="messages", max_size=10000, batch_size=500,
+                 flush_interval=1.0, put_timeout=0.05, max_retries=3):
+        self.storage = storage
+        self.collection = collection
+        # Firestore rejects batches with more than 500 writes
+        self.batch_size = max(1, min(batch_size, 500))
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.max_retries = max_retries
+
+        self._queue = queue.Queue(maxsize=max_size)
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._pid = None
+
+        self._stats = {
+            "enqueued": 0,
+            "written": 0,
+            "requeued": 0,
+            "dropped": 0,
+            "sync_writes": 0,
+            "flushes": 0,
+            "flush_errors": 0,
+            "last_flush_seconds": 0.0,
+            "max_flush_seconds": 0.0,
+            "total_flush_seconds": 0.0,
+        }
+
+    def start(self):
+        """
+        Start the background flush thread if it is not running in this process.
+
+        The thread is started lazily and restarted after a fork, so the queue
+        can be created before gunicorn forks its workers.
+        """
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            if self._pid != os.getpid():
+                # Items inherited from the parent belong to the parent
+                self._queue = queue.Queue(maxsize=self._queue.maxsize)
+            self._pid = os.getpid()
+            self._stop_event.clear()
+            self._thread = threading.Thread(
+                target=self._run, name="message-write-behind", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self, timeout=10.0):
+        """
+        Stop the background thread after flushing every queued message.
+
+        Args:
+            timeout (float): Maximum number of seconds to wait for the final flush.
+        """
+        thread = self._thread
+        if thread is None or self._pid != os.getpid():
+            return
+        self._stop_event.set()
+        thread.join(timeout)
+        self._thread = None
+        # Anything queued after the thread exited is written synchronously
+        if not self._drain():
+            lost = self._queue.qsize()
+            self._count(dropped=lost)
+            logging.error(f"Dropped {lost} queued messages at shutdown after failed flushes")
+
+    def enqueue(self, data, document_id=None):
+        """
+        Queue a message document for writing.
+
+        Args:
+            data (dict): The message document.
+            document_id (str, optional): The document ID. A generated ID is
+                used when omitted.
+
+        Returns:
+            bool: True if the document was queued, False if the queue was full
+            and the document was written synchronously instead.
+
+        Raises:
+            Exception: The storage error, if the synchronous write failed.
+        """
+        self.start()
+        try:
+            self._queue.put((document_id, data), timeout=self.put_timeout)
+        except queue.Full:
+            self._write_batch([(document_id, data)])
+            self._count(sync_writes=1)
+            return False
+        self._count(enqueued=1)
+        return True
+
+    def flush(self, timeout=10.0):
+        """
+        Write every currently queued message from the calling thread.
+
+        A batch the background thread has already taken from the queue is
+        waited for, up to `timeout` seconds, so every message queued before
+        the call is written, or requeued after a failed write, on return.
+        """
+        if not self._drain():
+            return
+        thread = self._thread
+        if thread is not None and thread.is_alive() and self._pid == os.getpid():
+            try:
+                self._queue.put_nowait(_FLUSH)
+            except queue.Full:
+                pass
+        pending = self._queue
+        with pending.all_tasks_done:
+            pending.all_tasks_done.wait_for(lambda: not pending.unfinished_tasks, timeout)
+
+    def stats(self):
+        """
+        Return queue counters.
+
+        Returns:
+            dict: Queue depth, write and error counts, and flush latency figures
+            in seconds.
+        """
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["queue_depth"] = self._queue.qsize()
+        stats["queue_capacity"] = self._queue.maxsize
+        flushes = stats["flushes"]
+        stats["avg_flush_seconds"] = stats["total_flush_seconds"] / flushes if flushes else 0.0
+        return stats
+
+    def _count(self, **increments):
+        with self._stats_lock:
+            for name, value in increments.items():
+                self._stats[name] += value
+        for name in _OUTCOMES:
+            if increments.get(name):
+                MESSAGE_QUEUE_MESSAGES.inc(increments[name], outcome=name)
+        if increments.get("flush_errors"):
+            MESSAGE_QUEUE_FLUSH_ERRORS.inc(increments["flush_errors"])
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                first = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            if first is _FLUSH:
+                self._queue.task_done()
+                continue
+
+            batch = [first]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or self._stop_event.is_set():
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is _FLUSH:
+                    self._queue.task_done()
+                    break
+                batch.append(item)
+
+            flushed = self._flush_batch(batch)
+            self._done(batch)
+            if not flushed:
+                # Give storage a moment before the requeued batch is retried
+                self._stop_event.wait(self.flush_interval)
+
+        self._drain()
+
+    def _drain(self):
+        """Write the queued messages in batches; stop at a failed batch and return False."""
+        while True:
+            batch = []
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _FLUSH:
+                    self._queue.task_done()
+                else:
+                    batch.append(item)
+            if not batch:
+                return True
+            flushed = self._flush_batch(batch)
+            self._done(batch)
+            if not flushed:
+                return False
+
+    def _done(self, items):
+        # Requeued items were put back first, so `flush` keeps waiting for them
+        for _ in items:
+            self._queue.task_done()
+
+    def _flush_batch(self, items):
+        try:
+            self._write_batch(items)
+        except Exception:
+            self._requeue(items)
+            return False
+        return True
+
+    def _requeue(self, items):
+        requeued = 0
+        for item in items:
+            try:
+                self._queue.put_nowait(item)
+            except queue.Full:
+                break
+            requeued += 1
+        self._count(requeued=requeued, dropped=len(items) - requeued)
+        if requeued < len(items):
+            logging.error(
+                f"Dropped {len(items) - requeued} messages after {self.max_retries} failed flushes, "
+                f"the queue is full"
+            )
+
+    def _write_batch(self, items):
+        writes = [
+            ("set", self.collection, document_id or self.storage.new_id(self.collection), data)
+            for document_id, data in items
+        ]
+        for attempt in range(1, self.max_retries + 1):
+            start = time.perf_counter()
+            try:
+                self.storage.commit(writes)
+            except Exception:
+                self._count(flush_errors=1)
+                logging.exception(
+                    f"Failed to flush {len(items)} messages (attempt {attempt}/{self.max_retries})"
+                )
+                if attempt == self.max_retries:
+                    raise
+                time.sleep(min(0.1 * 2 ** attempt, 2.0))
+                continue
+
+            elapsed = time.perf_counter() - start
+            self._count(flushes=1, written=len(items), total_flush_seconds=elapsed)
+            with self._stats_lock:
+                self._stats["last_flush_seconds"] = elapsed
+                self._stats["max_flush_seconds"] = max(self._stats["max_flush_seconds"], elapsed)
+            return
+
+
+def create_message_queue(storage, config):
+    """
+    Build a MessageWriteQueue from the application configuration.
+
+    The queue is flushed when the interpreter exits; gunicorn workers also
+    flush it from the `worker_exit` hook.
+
+    Args:
+        storage (app.storage.Storage): The storage backend to write to.
+        config (type): The configuration class holding the MESSAGE_QUEUE_* settings.
+
+    Returns:
+        MessageWriteQueue: The configured queue.
+    """
+    message_queue = MessageWriteQueue(
+        storage,
+        max_size=config.MESSAGE_QUEUE_MAX_SIZE,
+        batch_size=config.MESSAGE_QUEUE_BATCH_SIZE,
+        flush_interval=config.MESSAGE_QUEUE_FLUSH_INTERVAL,
+        put_timeout=config.MESSAGE_QUEUE_PUT_TIMEOUT,
+    )
+    atexit.register(message_queue.stop)
+    MESSAGE_QUEUE_DEPTH.set_function(lambda: message_queue.stats()["queue_depth"])
+    return message_queue
@@ -1,3 +1,351 @@
-from flask import Blueprint, request, jsonify, Response
+from flask import Blueprint, request, jsonify
+
+from app.config import Config
+from app.utils.config_schema import SWAN_CONFIG_SCHEMA, ConfigError
+from app.utils.config_profiles import DEFAULT_PROFILE, PROFILE_FIELD
+from app.utils.db_utils import (
+    query_items_swan_devices_collection,
+    query_items_command_to_swan_collection,
+    query_items_config_profiles_collection,
+    get_item_config_profiles_collection,
+    set_item_config_profiles_collection,
+    delete_item_config_profiles_collection,
+    resolve_config_profile,
+    set_items_command_to_swan_collection,
+    delete_items_command_to_swan_collection,
+    meter_readings,
+    query_items_meter_readings_collection,
+    get_latest_meter_reading,
+)
+from app.utils.pagination import parse_limit, parse_timestamp
 
 api_bp = Blueprint('api', __name__)
+
+# Firestore rejects queries with more than 30 disjunctions, so a selector
+# lists at most 30 values, and for one field only
+_SELECTOR_MAX_VALUES = 30
+
+
+def select_devices(selector, limit=None):
+    """
+    Resolve a device selector to the IMEIs of the matching SWAN devices.
+
+    Config fields match the keys a device document stores. Keys a device
+    inherits from its config profile are not stored; select by `profile`.
+
+    Args:
+        selector (dict): Maps device config fields, or the config profile
+            field, to a value, or, for at most one field, to a list of
+            values to match any of them.
+        limit (int, optional): The most IMEIs to return.
+
+    Returns:
+        list: The IMEIs of the matching devices.
+
+    Raises:
+        ValueError: If the selector is empty, not a dictionary, names an
+            unknown field, lists values for more than one field or has a
+            value that is not a string or number.
+    """
+    if not isinstance(selector, dict) or not selector:
+        raise ValueError("'selector' must be a non-empty object")
+    if sum(1 for value in selector.values() if isinstance(value, list)) > 1:
+        raise ValueError("'selector' can list values for one field only")
+    filters = []
+    for field, value in selector.items():
+        if field not in SWAN_CONFIG_SCHEMA.fields and field != PROFILE_FIELD:
+            raise ValueError(f"Unknown selector field {field!r}")
+        values = value if isinstance(value, list) else [value]
+        if not values or len(values) > _SELECTOR_MAX_VALUES:
+            raise ValueError(f"Selector field {field!r} must list 1 to {_SELECTOR_MAX_VALUES} values")
+        if not all(isinstance(item, (str, int, float)) for item in values):
+            raise ValueError(f"Selector field {field!r} must match strings or numbers")
+        filters.append((field, "in" if isinstance(value, list) else "==", value))
+    # Only the document IDs are needed
+    return [doc.id for doc in query_items_swan_devices_collection(filters=filters, select=[], limit=limit)]
+
+
+def resolve_targets(data, with_config=True):
+    """
+    Work out which devices a bulk request applies to.
+
+    The request names its devices with exactly one of `commands` (an object
+    mapping each IMEI to its own config), `imeis` (a list) or `selector`.
+    With `imeis` and `selector` the same `config` is used for every device,
+    and a `profile` makes each command reference that config profile.
+
+    Args:
+        data (dict): The request body.
+        with_config (bool): Whether the request carries configs.
+
+    Returns:
+        dict: Maps each IMEI to its config, or to None if `with_config` is False.
+
+    Raises:
+        ValueError: If the request body is invalid.
+    """
+    forms = [key for key in ("commands", "imeis", "selector") if key in data]
+    if len(forms) != 1 or (forms[0] == "commands" and not with_config):
+        allowed = "'commands', 'imeis' or 'selector'" if with_config else "'imeis' or 'selector'"
+        raise ValueError(f"Give exactly one of {allowed}")
+
+    if forms[0] == "commands":
+        commands = data["commands"]
+        if not isinstance(commands, dict):
+            raise ValueError("'commands' must map IMEIs to configs")
+        targets = commands
+    else:
+        if forms[0] == "imeis":
+            imeis = data["imeis"]
+            if not isinstance(imeis, list) or not all(isinstance(imei, str) for imei in imeis):
+                raise ValueError("'imeis' must be a list of strings")
+        else:
+            # One match past the limit is enough to reject the request
+            imeis = select_devices(data["selector"], limit=Config.BULK_MAX_ITEMS + 1)
+        config = None
+        if with_config:
+            config = data.get("config", {} if PROFILE_FIELD in data else None)
+            if not isinstance(config, dict):
+                raise ValueError("'config' must be an object")
+            if PROFILE_FIELD in data:
+                config = {**config, PROFILE_FIELD: data[PROFILE_FIELD]}
+        targets = {imei: config for imei in imeis}
+
+    if len(targets) > Config.BULK_MAX_ITEMS:
+        raise ValueError(f"At most {Config.BULK_MAX_ITEMS} devices per request")
+    return targets
+
+
+def is_valid_imei(imei):
+    # IMEIs are part of document IDs
+    return isinstance(imei, str) and bool(imei) and "/" not in imei
+
+
+def check_profile(profile_id):
+    if not isinstance(profile_id, str) or resolve_config_profile(profile_id) is None:
+        raise ConfigError(f"Unknown config profile {profile_id!r}")
+
+
+def bulk_response(results):
+    failed = sum(1 for result in results if result["status"] != "ok")
+    summary = {"total": len(results), "ok": len(results) - failed, "failed": failed}
+    return jsonify({"summary": summary, "results": results}), 207 if failed else 200
+
+
+@api_bp.route("/commands", methods=["POST"])
+def bulk_set_commands():
+    """
+    Queue config commands for many SWAN devices at once.
+
+    Commands are written in batched writes, several batches in parallel, and
+    replace any command already waiting for a device. Every device gets its
+    own result, so invalid configs or failed batches do not fail the rest.
+
+    Returns:
+        flask.Response: A JSON summary and per-device results, with a 200 HTTP
+        status code if every command was written, 207 if some were not, or
+        400 if the request body is invalid.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "Expected a JSON object"}), 400
+    try:
+        targets = resolve_targets(data)
+    except ValueError as exc:
+        return jsonify({"error": str(exc)}), 400
+
+    results = {}
+    commands = {}
+    for imei, config in targets.items():
+        if not is_valid_imei(imei):
+            results[str(imei)] = {"imei": imei, "status": "invalid", "error": "Invalid IMEI"}
+            continue
+        try:
+            if not isinstance(config, dict):
+                raise ConfigError("config must be an object")
+            SWAN_CONFIG_SCHEMA.validate(config)
+            if PROFILE_FIELD in config:
+                check_profile(config[PROFILE_FIELD])
+        except ConfigError as exc:
+            results[imei] = {"imei": imei, "status": "invalid", "error": str(exc)}
+            continue
+        commands[imei] = config
+
+    errors = set_items_command_to_swan_collection(commands)
+    for imei in commands:
+        if imei in errors:
+            results[imei] = {"imei": imei, "status": "failed", "error": errors[imei]}
+        else:
+            results[imei] = {"imei": imei, "status": "ok"}
+
+    return bulk_response([results[str(imei)] for imei in targets])
+
+
+@api_bp.route("/commands", methods=["DELETE"])
+def bulk_delete_commands():
+    """
+    Delete the pending commands of many SWAN devices at once.
+
+    Returns:
+        flask.Response: A JSON summary and per-device results, with a 200 HTTP
+        status code if every command was deleted, 207 if some were not, or
+        400 if the request body is invalid.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "Expected a JSON object"}), 400
+    try:
+        imeis = list(resolve_targets(data, with_config=False))
+    except ValueError as exc:
+        return jsonify({"error": str(exc)}), 400
+
+    valid = [imei for imei in imeis if is_valid_imei(imei)]
+    errors = delete_items_command_to_swan_collection(valid)
+    results = [
+        {"imei": imei, "status": "invalid", "error": "Invalid IMEI"} if not is_valid_imei(imei)
+        else {"imei": imei, "status": "failed", "error": errors[imei]} if imei in errors
+        else {"imei": imei, "status": "ok"}
+        for imei in imeis
+    ]
+    return bulk_response(results)
+
+
+@api_bp.route("/profiles", methods=["GET"])
+def get_profiles():
+    """
+    List the stored config profiles.
+
+    Returns:
+        flask.Response: A JSON list of `{profile_id: overrides}` entries, with
+        a 200 HTTP status code.
+    """
+    profiles = [{doc.id: doc.to_dict()} for doc in query_items_config_profiles_collection()]
+    return jsonify(profiles), 200
+
+
+@api_bp.route("/profiles/<profile_id>", methods=["GET"])
+def get_profile(profile_id):
+    """
+    Return a config profile and the config it resolves to.
+
+    Returns:
+        flask.Response: A JSON object with the profile's overrides and the
+        resolved config, with a 200 HTTP status code, or 404 if the profile
+        does not exist.
+    """
+    config = resolve_config_profile(profile_id)
+    if config is None:
+        return jsonify({"error": "Config profile not found"}), 404
+    overrides = get_item_config_profiles_collection(profile_id).to_dict() or {}
+    return jsonify({"profile": overrides, "config": config}), 200
+
+
+@api_bp.route("/profiles/<profile_id>", methods=["PUT"])
+def put_profile(profile_id):
+    """
+    Create or replace a config profile.
+
+    The body holds only the keys that differ from the defaults (or, for the
+    'default' profile, from the built-in SWAN defaults). Devices and commands
+    referencing the profile pick up the change without being rewritten.
+
+    Returns:
+        flask.Response: A JSON message with a 201 HTTP status code if the
+        profile was created, 200 if it was replaced, or 400 if the body is
+        invalid.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "Expected a JSON object"}), 400
+    unknown = sorted(key for key in data if key not in SWAN_CONFIG_SCHEMA.fields)
+    if unknown:
+        return jsonify({"error": f"Unknown config keys: {', '.join(unknown)}"}), 400
+    try:
+        SWAN_CONFIG_SCHEMA.validate(data)
+    except ConfigError as exc:
+        return jsonify({"error": str(exc)}), 400
+
+    exists = get_item_config_profiles_collection(profile_id).exists
+    set_item_config_profiles_collection(profile_id, data)
+    if exists:
+        return jsonify({"message": "Config profile updated successfully!"}), 200
+    return jsonify({"message": "Config profile created successfully!"}), 201
+
+
+@api_bp.route("/profiles/<profile_id>", methods=["DELETE"])
+def delete_profile(profile_id):
+    """
+    Delete a config profile that no device or pending command references.
+
+    Returns:
+        flask.Response: A JSON message with a 200 HTTP status code, 404 if the
+        profile does not exist, or 409 if devices or pending commands still
+        reference it.
+    """
+    if not get_item_config_profiles_collection(profile_id).exists:
+        return jsonify({"error": "Config profile not found"}), 404
+    if profile_id != DEFAULT_PROFILE:
+        # Devices store only their overrides, so they cannot be resolved without the profile
+        for query_items, referrers in (
+            (query_items_swan_devices_collection, "devices"),
+            (query_items_command_to_swan_collection, "pending commands"),
+        ):
+            referenced = query_items(filters=[(PROFILE_FIELD, "==", profile_id)], limit=1, select=[])
+            if any(True for _ in referenced):
+                return jsonify({"error": f"Config profile is referenced by {referrers}"}), 409
+
+    delete_item_config_profiles_collection(profile_id)
+    return jsonify({"message": "Config profile deleted successfully!"}), 200
+
+
+def reading_to_json(reading):
+    return {**reading, "timestamp": reading["timestamp"].isoformat()}
+
+
+@api_bp.route("/meters/<meter_id>/readings", methods=["GET"])
+def get_meter_readings(meter_id):
+    """
+    List the readings of a meter, parsed from the CSV uploads of SWAN devices.
+
+    Supported parameters are `since` (inclusive) and `until` (exclusive) as
+    ISO 8601 timestamps, `order` ('asc' or 'desc' by timestamp) and `limit`.
+
+    Returns:
+        flask.Response: A JSON list of readings with a 200 HTTP status code,
+        400 if a parameter is invalid, or 404 if meter readings are disabled.
+    """
+    if meter_readings is None:
+        return jsonify({"error": "Meter readings are disabled"}), 404
+    args = request.args
+    try:
+        since = parse_timestamp(args["since"]) if args.get("since") else None
+        until = parse_timestamp(args["until"]) if args.get("until") else None
+        order = args.get("order", "asc")
+        if order not in ("asc", "desc"):
+            raise ValueError("order must be 'asc' or 'desc'")
+        # Readings are paged like message listings
+        limit = parse_limit(args.get("limit"), Config.MESSAGES_PAGE_SIZE, Config.MESSAGES_MAX_PAGE_SIZE)
+    except ValueError as exc:
+        return jsonify({"error": str(exc)}), 400
+
+    readings = query_items_meter_readings_collection(
+        meter_id, since=since, until=until, descending=order == "desc", limit=limit
+    )
+    return jsonify([reading_to_json(reading) for reading in readings]), 200
+
+
+@api_bp.route("/meters/<meter_id>/readings/latest", methods=["GET"])
+def get_meter_latest_reading(meter_id):
+    """
+    Return the newest reading of a meter.
+
+    Returns:
+        flask.Response: The reading as JSON with a 200 HTTP status code, or
+        404 if the meter has no readings.
+    """
+    if meter_readings is None:
+        return jsonify({"error": "Meter readings are disabled"}), 404
+    reading = get_latest_meter_reading(meter_id)
+    if reading is None:
+        return jsonify({"error": "No readings for this meter"}), 404
+    return jsonify(reading_to_json(reading)), 200
@@ -1,22 +1,28 @@
-from flask import request, jsonify, Blueprint
-from flask import render_template
+from flask import request, jsonify, Blueprint, Response
+from flask import render_template, current_app, make_response, stream_with_context
 import logging
-import google.cloud.firestore
-from google.cloud import firestore
 import os
 import uuid
 import json
 import base64
 
-from dotenv import load_dotenv
 import time
 
-from app.config import SWAN_DEFAULT_CONFIG
+from app.config import Config
+from app.utils.config_schema import SWAN_CONFIG_SCHEMA, ConfigError
+from app.utils.pagination import decode_cursor, parse_timestamp, parse_limit
+from app.utils.query_params import parse_list_query, next_page_cursor
 from app.utils.db_utils import (
-    db, 
-    UPLOAD_SERVER, 
     get_all_items_messages_collection,
+    query_items_messages_collection,
+    get_all_items_session_collection,
+    get_all_items_swan_devices_collection,
+    get_all_items_command_to_swan_collection,
+    query_items_session_collection,
+    query_items_swan_devices_collection,
+    query_items_command_to_swan_collection,
     add_item_message_collection, 
+    add_csv_message,
     set_item_session_collection,
     update_item_session_collection,
     delete_item_session_collection,
@@ -30,8 +36,21 @@ from app.utils.db_utils import (
     delete_item_command_to_swan_collection,
     get_item_command_to_swan_collection,
     update_item_message_collection,
-    set_item_message_collection
+    set_item_message_collection,
+    save_swan_device_config,
+    resolve_config_profile,
+    resolve_command_to_swan,
+    replay_cache,
+    shared_metrics,
+    get_collection_version,
+    unit_of_work
 )
+from app.utils.config_profiles import DEFAULT_PROFILE, PROFILE_FIELD
+from app.log import bind_log_context
+from app.utils.conditional import content_etag, is_not_modified, make_etag, set_validators, to_datetime
+from app.utils.csv_upload import UploadTooLarge, check_upload_size, read_csv_chunks
+from app.utils.replay_cache import replay_key
+from app.utils.metrics import CONTENT_TYPE, DECODE_SECONDS, HANDSHAKE_STEP_SECONDS, REGISTRY
 
 main_bp = Blueprint("main", __name__)
 
@@ -46,8 +65,6 @@ swan_session_steps = {
 }
 
 
-# Load .env file
-load_dotenv()
 UPLOAD_SERVER = os.getenv("UPLOAD_SERVER")
 
 
@@ -65,52 +82,100 @@ def json_to_string(json_obj):
     return formatted_str
 
 def format_configuration_string(dict):
-    format_configuration_string = ""
-    for key, value in dict.items():
-        if type(value) == str:
-            format_configuration_string += f"\"{key}\":\"{value}\","
-        else:
-            format_configuration_string += f"\"{key}\":{value}"
-        
-    return (f"\u007b{format_configuration_string[:-1]}\u007d")
+    # Encoded in SWAN key order, with values checked against the config schema
+    return SWAN_CONFIG_SCHEMA.encode(dict)
 
 
-# Configure logging to file
-logging.basicConfig(
-    filename="server.log",
-    level=logging.INFO,
-    format="%(asctime)s - %(message)s",
-    datefmt="%Y-%m-%d %H:%M:%S",
-)
+def parse_message_query(args):
+    """
+    Parse the listing parameters of a GET /swan request.
+
+    Supported parameters are `limit`, `start_after` (a cursor returned in the
+    `X-Next-Cursor` header of the previous page), `order` ('asc' or 'desc' by
+    `created_at`), and the filters `session_id`, `imei`, `since` and `until`
+    (ISO 8601 timestamps, `since` inclusive and `until` exclusive).
 
-# Create a handler for logging to console
-console_handler = logging.StreamHandler()
-console_handler.setLevel(logging.INFO)
-console_handler.setFormatter(logging.Formatter("%(asctime)s - %(message)s"))
+    Paging is opt-in: without `limit` every matching message is returned, as
+    before paging existed, and `limit` is capped at MESSAGES_MAX_PAGE_SIZE.
 
-# Add the console handler to the root logger
-logging.getLogger().addHandler(console_handler)
+    Args:
+        args (werkzeug.datastructures.MultiDict): The request query parameters.
 
+    Returns:
+        dict: Keyword arguments for `query_items_messages_collection`.
 
-def log_request_details(req):
-    logging.info(f"Request method: {req.method}")
-    logging.info(f"Request headers:\n{req.headers}")
+    Raises:
+        ValueError: If a parameter is invalid.
+    """
+    filters = []
+    for field in ("session_id", "imei"):
+        if args.get(field):
+            filters.append((field, "==", args[field]))
+    if args.get("since"):
+        filters.append(("created_at", ">=", parse_timestamp(args["since"])))
+    if args.get("until"):
+        filters.append(("created_at", "<", parse_timestamp(args["until"])))
+
+    order = args.get("order", "desc")
+    if order not in ("asc", "desc"):
+        raise ValueError("order must be 'asc' or 'desc'")
+
+    limit = parse_limit(args.get("limit"), None, Config.MESSAGES_MAX_PAGE_SIZE)
+
+    start_after = decode_cursor(args["start_after"]) if args.get("start_after") else None
+
+    return {
+        "filters": filters,
+        "order_by": "created_at",
+        "descending": order == "desc",
+        "limit": limit,
+        "start_after": start_after,
+    }
 
 
-def fetch_swan_messages():
+def fetch_swan_messages(query):
     """
-    Fetch all messages from the 'messages' collection.
+    Fetch one page of messages from the 'messages' collection.
 
-    Retrieves all documents in the 'messages' collection, converts them to 
-    dictionaries, and returns them as a list.
+    Args:
+        query (dict): Query arguments from `parse_message_query`.
 
     Returns:
-        list: A list of dictionaries, where each dictionary represents a document 
-        from the 'messages' collection.
+        tuple: A list of message dictionaries, and the cursor for the next
+        page, or None when this is the last page.
     """
-    results = get_all_items_messages_collection()
+    results = list(query_items_messages_collection(**query))
     data_list = [doc.to_dict() for doc in results]
-    return data_list
+    return data_list, next_page_cursor(results, query)
+
+
+def stream_swan_messages(query):
+    """
+    Stream messages from the 'messages' collection as NDJSON.
+
+    Documents are encoded and sent one line at a time as the storage backend
+    returns them, so the listing is never held in memory as a whole.
+
+    Args:
+        query (dict): Query arguments from `parse_message_query`.
+
+    Returns:
+        flask.Response: A streamed 'application/x-ndjson' response.
+    """
+    dumps = current_app.json.dumps
+
+    def generate():
+        for doc in query_items_messages_collection(**query):
+            yield dumps(doc.to_dict()) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+
+def wants_ndjson(request):
+    return (
+        request.args.get("format") == "ndjson"
+        or request.accept_mimetypes.best == "application/x-ndjson"
+    )
 
 
 def handle_post_request(request):
@@ -125,25 +190,57 @@ def handle_post_request(request):
         request (flask.Request): The incoming request object.
 
     Returns:
-        flask.Response: A JSON response indicating success or failure of 
-        the operation, along with the appropriate HTTP status code.
+        tuple: A JSON payload indicating success or failure of the
+        operation, and the appropriate HTTP status code.
     """
     content_type = request.headers.get("Content-Type")
+    imei = request.headers.get("Wep-Imei")
 
     if content_type == "application/json":
-        # Handle JSON data
         data = request.get_json()
-        add_item_message_collection(data)
-        return jsonify({"message": "JSON Data added successfully!"}), 201
+    elif content_type == "text/csv":
+        # Large uploads are read and stored in chunks, never as one string
+        try:
+            check_upload_size(request.content_length, Config.CSV_MAX_BODY_BYTES)
+        except UploadTooLarge as exc:
+            return {"error": str(exc)}, 413
+        data = read_csv_chunks(request.stream, Config.CSV_CHUNK_BYTES, Config.CSV_MAX_BODY_BYTES)
+    else:
+        data = None
+    return record_message(content_type, imei, data)
+
+
+def record_message(content_type, imei, data):
+    """
+    Add the data of a POST request to the 'messages' collection.
+
+    Args:
+        content_type (str): The 'Content-Type' header of the request.
+        imei (str): The 'Wep-Imei' header of the request, if any.
+        data: The parsed JSON body, or the CSV body as text or as chunks
+            of text.
+
+    Returns:
+        tuple: A JSON payload indicating success or failure of the
+        operation, and the appropriate HTTP status code.
+    """
+    if content_type == "application/json":
+        # Handle JSON data
+        add_item_message_collection({**data, "imei": imei} if imei else data)
+        return {"message": "JSON Data added successfully!"}, 201
 
     elif content_type == "text/csv":
         # Handle CSV data
-        csv_string = request.data.decode("utf-8")
-        add_item_message_collection({"csv_data": csv_string})
-        return jsonify({"message": "CSV Data added successfully!"}), 201
+        try:
+            add_csv_message([data] if isinstance(data, str) else data, imei)
+        except UploadTooLarge as exc:
+            return {"error": str(exc)}, 413
+        except UnicodeDecodeError:
+            return {"error": "CSV data is not UTF-8"}, 400
+        return {"message": "CSV Data added successfully!"}, 201
 
     else:
-        return jsonify({"error": "Unsupported Content-Type"}), 400
+        return {"error": "Unsupported Content-Type"}, 400
 
 
 def handle_post_csv_type(imei):
@@ -157,23 +254,24 @@ def handle_post_csv_type(imei):
         imei (str): The IMEI identifier for the SWAN device.
 
     Returns:
-        flask.Response: A JSON response containing the command to retrieve 
-        configuration, along with a 200 HTTP status code.
+        tuple: The command to retrieve configuration, and a 200 HTTP status code.
     """
-    session_id = f"session_{imei}_{str(uuid.uuid4())[:6]}"
-    session_data = {"session_id": session_id, "status": swan_session_steps["0"]}
-    set_item_session_collection(session_id, session_data)
-    
-    command = {
-        "cmd": {"type": "get_cfg", "id": session_id}
-    }
+    with HANDSHAKE_STEP_SECONDS.time(type="upload", res_code="none"):
+        session_id = f"session_{imei}_{str(uuid.uuid4())[:6]}"
+        bind_log_context(session_id=session_id)
+        session_data = {"session_id": session_id, "status": swan_session_steps["0"]}
+        set_item_session_collection(session_id, session_data)
+        
+        command = {
+            "cmd": {"type": "get_cfg", "id": session_id}
+        }
 
-    update_item_session_collection(session_id, {"status": swan_session_steps["1"]})
+        update_item_session_collection(session_id, {"status": swan_session_steps["1"]})
     
-    return jsonify(command), 200
+    return command, 200
 
 
-def send_back_to_upload_server(session_id):
+def send_back_to_upload_server(session_id, imei=None):
     """
     Send a configuration command back to the upload server.
 
@@ -182,10 +280,10 @@ def send_back_to_upload_server(session_id):
 
     Args:
         session_id (str): The unique identifier for the session.
+        imei (str, optional): The IMEI identifier for the SWAN device.
 
     Returns:
-        flask.Response: A JSON response containing the command to set the 
-        configuration, along with a 200 HTTP status code.
+        tuple: The command to set the configuration, and a 200 HTTP status code.
     """
     update_item_session_collection(session_id, {"status": swan_session_steps["5"]})
     content = {"upload_server": UPLOAD_SERVER}
@@ -197,31 +295,59 @@ def send_back_to_upload_server(session_id):
         }
     }
     
-    add_item_message_collection({"session_id": session_id, "description": "Sent SET_CFG command", "content": command})
-    return jsonify(command), 200
+    add_item_message_collection({"session_id": session_id, "imei": imei, "description": "Sent SET_CFG command", "content": command})
+    return command, 200
 
 
-def send_configuration_to_swan(configuration_elements, session_id, imei):
+def send_configuration_to_swan(configuration_elements, session_id, imei, reported_config=None):
     """
     Send configuration data to a SWAN device.
 
     Prepares and sends a 'set_cfg' command with the given configuration elements 
     to the SWAN device identified by the IMEI. Updates session status and logs the action.
 
+    A command that references a config profile sends the resolved profile
+    with the command's own keys applied on top.
+
+    When the device's reported configuration is given, only the keys that
+    differ from it are sent. If none differ, the command is already applied:
+    it is deleted and the device is sent back to the upload server.
+
     Args:
-        configuration_elements (dict): The configuration data to be sent.
+        configuration_elements (dict): The configuration data to be sent, or
+            a command referencing a config profile.
         session_id (str): The unique identifier for the session.
         imei (str): The IMEI identifier for the SWAN device.
+        reported_config (dict, optional): The configuration the device reported
+            in its get_cfg response.
 
     Returns:
-        flask.Response: A JSON response containing the command to set the 
-        configuration, along with a 200 HTTP status code.
+        tuple: The command to set the configuration, and a 200 HTTP status code.
     """
+    try:
+        configuration_elements = resolve_command_to_swan(configuration_elements)
+    except ConfigError as exc:
+        logging.error(f"Invalid command for {imei}: {exc}")
+        return send_back_to_upload_server(session_id, imei)
+
+    if reported_config is not None and Config.SET_CFG_DELTA_ONLY:
+        configuration_elements = SWAN_CONFIG_SCHEMA.delta(configuration_elements, reported_config)
+        if not configuration_elements:
+            delete_item_command_to_swan_collection(imei)
+            return send_back_to_upload_server(session_id, imei)
+
+    try:
+        content = format_configuration_string(configuration_elements)
+    except ConfigError as exc:
+        # Leave the command in place so it can be corrected
+        logging.error(f"Invalid command for {imei}: {exc}")
+        return send_back_to_upload_server(session_id, imei)
+
     command = {
         "cmd": {
             "type": "set_cfg", 
             "id": session_id,
-            "content": format_configuration_string(configuration_elements)
+            "content": content
         }
     }
     
@@ -229,9 +355,149 @@ def send_configuration_to_swan(configuration_elements, session_id, imei):
     delete_item_command_to_swan_collection(imei)
     
     document_id = f"{session_id}_{int(time.time())}"
-    set_item_message_collection(document_id, {"session_id": document_id, "description": "Sent SET_CFG command", "content": command})
+    set_item_message_collection(document_id, {"session_id": session_id, "imei": imei, "description": "Sent SET_CFG command", "content": command})
                         
-    return jsonify(command), 200
+    return command, 200
+
+
+def handle_swan_post(request):
+    """
+    Handle a POST request to the SWAN endpoint.
+
+    Stores the posted data and, for requests from SWAN devices, advances the
+    device session. Writes made here are committed by the caller's unit of work.
+
+    Args:
+        request (flask.Request): The incoming request object.
+
+    Returns:
+        tuple: The JSON payload to send back to the client, and the HTTP
+        status code.
+    """
+    resp = handle_post_request(request)
+
+    # Extract headers to check if the request is from a SWAN device
+    imei = request.headers.get("Wep-Imei")
+    content_type = request.headers.get("Content-Type")
+
+    # If IMEI is not present, or the data was rejected, return the response
+    if not imei or resp[1] >= 400:
+        return resp
+
+    # Handle CSV content type specifically
+    if content_type == "text/csv":
+        return handle_post_csv_type(imei)
+    
+    # If content type is not JSON, return the response
+    if content_type != "application/json":
+        return resp
+    
+    # Parse the JSON data from the request
+    data = request.get_json()
+    session_doc = get_item_session_collection(data['cmd_res']['id'])
+    return handle_command_result(imei, data, session_doc)
+
+
+def handle_command_result(imei, data, session_doc, command_doc=None, device_doc=None):
+    """
+    Advance a device session from the result of the last command sent to it.
+
+    Documents that the caller has already read are passed in; the others are
+    read here when needed.
+
+    Args:
+        imei (str): The IMEI identifier for the SWAN device.
+        data (dict): The JSON body the device posted, with a 'cmd_res' object.
+        session_doc (app.storage.Document): The session named by the result.
+        command_doc (app.storage.Document, optional): The device's pending command.
+        device_doc (app.storage.Document, optional): The device document.
+
+    Returns:
+        tuple: The JSON payload to send back to the device, and the HTTP
+        status code.
+    """
+    result = data['cmd_res']
+    # Unknown values share one label so devices cannot create new series
+    step = {
+        "type": result.get('type') if result.get('type') in ("get_cfg", "set_cfg") else "other",
+        "res_code": result.get('res_code') if result.get('res_code') in (0, 1) else "other",
+    }
+    with HANDSHAKE_STEP_SECONDS.time(**step):
+        return advance_session(imei, data, session_doc, command_doc, device_doc)
+
+
+def advance_session(imei, data, session_doc, command_doc=None, device_doc=None):
+    session_id = data['cmd_res']['id']
+    bind_log_context(session_id=session_id)
+
+    # If session document does not exist, log it and handle appropriately
+    if not session_doc.exists:
+        # It is odd if it doesn't exist. Log it. Think of how to handle it.
+        pass
+    
+    # Handle the response code from the SWAN device
+    if data['cmd_res']['res_code'] == 0:
+        if data['cmd_res']['type'] == "get_cfg":
+            # Decode the base64 content and persist what changed in the SWAN devices collection
+            content = data['cmd_res']['content']
+            with DECODE_SECONDS.time():
+                decoded_content = json.loads(base64.b64decode(content).decode("utf-8"))
+            
+            save_swan_device_config(imei, decoded_content, device_doc)
+            
+            # Get the command to SWAN collection document
+            doc = command_doc if command_doc is not None else get_item_command_to_swan_collection(imei)
+            
+            # Check the session status
+            session_status = session_doc.to_dict()["status"]
+            if session_status == swan_session_steps["5"]:
+                return {"message": "Session already completed"}, 200
+            
+            # If document exists, send configuration to SWAN
+            if doc.exists:
+                configuration_elements = doc.to_dict()
+                return send_configuration_to_swan(configuration_elements, session_id, imei, decoded_content)
+            else:
+                # If no updates, send back to upload server
+                return send_back_to_upload_server(session_id, imei)
+                
+        if data['cmd_res']['type'] == "set_cfg":
+            # Prepare a command to get configuration and return it
+            command = {
+                "cmd": {
+                    "type": "get_cfg", 
+                    "id": session_id
+                }
+            }
+            return command, 200
+            # Return to Galooli
+            
+    elif data['cmd_res']['res_code'] == 1:
+        # Update session status to indicate an error and return an error response
+        update_item_session_collection(session_id, {"status": swan_session_steps["6"]})
+        return {"error": "Error setting configuration"}, 400
+    
+    else:
+        # Handle unexpected response codes
+        # result doesn't equal 1 or 0 and it is not handled 
+        pass
+
+
+@main_bp.route("/metrics", methods=["GET"])
+def metrics():
+    """
+    Report the metrics in the Prometheus text format.
+
+    Covers request latency per route, handshake step latency per command
+    result, session status changes, and storage round trips per collection
+    and operation. With METRICS_DIR set, as under gunicorn, the values of
+    every worker are summed; otherwise only this process is reported.
+
+    Returns:
+        flask.Response: The metrics, with a 200 HTTP status code.
+    """
+    text = shared_metrics.render() if shared_metrics is not None else REGISTRY.render()
+    return Response(text, mimetype=None, content_type=CONTENT_TYPE)
 
 
 @main_bp.route("/index", methods=["GET"])
@@ -248,8 +514,12 @@ def handle_request():
     either GET or POST. The function performs different operations based on 
     the request method:
 
-    - **GET**: Fetches all messages related to SWAN devices, logs the request,
-      and returns the data as a JSON response with a 200 OK status.
+    - **GET**: Fetches a page of messages related to SWAN devices, newest
+      first, and returns it as a JSON list with a 200 OK status. The cursor
+      for the next page is returned in the `X-Next-Cursor` header. With
+      `format=ndjson` or `Accept: application/x-ndjson` the messages are
+      streamed as NDJSON instead. See `parse_message_query` for the
+      supported parameters.
     
     - **POST**: Handles data sent from SWAN devices or other clients, either 
       in JSON or CSV format. Depending on the content type and other headers,
@@ -273,152 +543,222 @@ def handle_request():
           the function.
     """
     if request.method == "GET":
-        # Fetch messages from SWAN and log the GET request
-        data_list = fetch_swan_messages()
         logging.info(f"Received GET request: {request.path}")
+        streaming = wants_ndjson(request)
+        try:
+            query = parse_message_query(request.args)
+        except ValueError as exc:
+            return jsonify({"error": str(exc)}), 400
+
+        def list_messages():
+            if streaming:
+                return stream_swan_messages(query)
 
-        # Return the fetched data as JSON with a 200 OK status
-        return jsonify(data_list), 200
+            # Fetch one page of messages and return it as JSON with a 200 OK status
+            data_list, next_cursor = fetch_swan_messages(query)
+            headers = {"X-Next-Cursor": next_cursor} if next_cursor else {}
+            return jsonify(data_list), 200, headers
+
+        return conditional_listing("messages", list_messages, streaming)
 
     elif request.method == "POST":
-        # Handle the POST request and log it
-        resp = handle_post_request(request)
+        key = None
+        if replay_cache is not None and request.headers.get("Content-Type") == "application/json":
+            # A retransmitted command result gets the response already sent, without storage calls
+            key = replay_key(request.headers.get("Wep-Imei"), request.get_json(silent=True), request.get_data())
+            replayed = replay_cache.get(key) if key is not None else None
+            if replayed is not None:
+                return replayed
 
-        # Extract headers to check if the request is from a SWAN device
-        imei = request.headers.get("Wep-Imei")
-        content_type = request.headers.get("Content-Type")
+        # Commit all Firestore writes of the handshake step in one batch
+        with unit_of_work():
+            response = handle_swan_post(request)
+        remember_response(key, response)
+        return response
 
-        # If IMEI is not present, return the response
-        if not imei:
-            return resp
 
-        # Handle CSV content type specifically
-        if content_type == "text/csv":
-            return handle_post_csv_type(imei)
-        
-        # If content type is not JSON, return the response
-        if content_type != "application/json":
-            return resp
-        
-        # Parse the JSON data from the request
-        data = request.get_json()
-        session_id = data['cmd_res']['id']
-        session_doc = get_item_session_collection(session_id)
+def remember_response(key, response):
+    """Keep the response to a command result for retransmissions, once its writes are committed."""
+    if key is not None and response is not None and response[0] is not None and response[1] < 500:
+        replay_cache.put(key, *response)
 
-        # If session document does not exist, log it and handle appropriately
-        if not session_doc.exists:
-            # It is odd if it doesn't exist. Log it. Think of how to handle it.
-            pass
-        
-        # Handle the response code from the SWAN device
-        if data['cmd_res']['res_code'] == 0:
-            if data['cmd_res']['type'] == "get_cfg":
-                # Decode the base64 content and update the SWAN devices collection
-                content = data['cmd_res']['content']
-                decoded_content = json.loads(base64.b64decode(content).decode("utf-8"))
-                
-                set_item_swan_devices_collection(imei, decoded_content)
-                
-                # Get the command to SWAN collection document
-                doc = get_item_command_to_swan_collection(imei)
-                
-                # Check the session status
-                session_status = session_doc.to_dict()["status"]
-                if session_status == swan_session_steps["5"]:
-                    return jsonify({"message": "Session already completed"}), 200
-                
-                # If document exists, send configuration to SWAN
-                if doc.exists:
-                    configuration_elements = doc.to_dict()
-                    return send_configuration_to_swan(configuration_elements, session_id, imei)
-                else:
-                    # If no updates, send back to upload server
-                    return send_back_to_upload_server(session_id)
-                    
-            if data['cmd_res']['type'] == "set_cfg":
-                # Prepare a command to get configuration and return it
-                command = {
-                    "cmd": {
-                        "type": "get_cfg", 
-                        "id": session_id
-                    }
-                }
-                return jsonify(command), 200
-                # Return to Galooli
-                
-        elif data['cmd_res']['res_code'] == 1:
-            # Update session status to indicate an error and return an error response
-            session_doc.update({"status": swan_session_steps["6"]})
-            return jsonify({"error": "Error setting configuration"}), 400
-        
-        else:
-            # Handle unexpected response codes
-            # result doesn't equal 1 or 0 and it is not handled 
-            pass
+
+# Field types of device and command documents, for typed query filters
+SWAN_CONFIG_FIELD_TYPES = SWAN_CONFIG_SCHEMA.field_types()
+
+
+def conditional_listing(collection, list_documents, *variant, depends_on=()):
+    """
+    Answer a listing request conditionally, from the collection's version marker.
+
+    For collections in ETAG_VERSIONED_COLLECTIONS the ETag derives from the
+    version marker, the request URL and `variant`, and 'Last-Modified' is
+    the time of the last write. A request whose 'If-None-Match' or
+    'If-Modified-Since' matches gets 304 without the collection being read
+    or anything encoded. Other collections are listed unconditionally.
+
+    Args:
+        collection (str): The listed collection.
+        list_documents (callable): Returns the listing response.
+        variant: Anything else that selects the representation.
+        depends_on (tuple): Other collections the listing is resolved from.
+            Their markers are part of the ETag and 'Last-Modified', and the
+            listing is unconditional if one of them is not versioned.
+
+    Returns:
+        flask.Response: The listing, or an empty 304 response.
+    """
+    markers = [get_collection_version(name) for name in (collection, *depends_on)]
+    if any(marker is None for marker in markers):
+        return list_documents()
+    versions = [version for version, _ in markers]
+    last_modified = max((modified for _, modified in markers if modified is not None), default=None)
+    etag = make_etag(collection, *versions, request.full_path, *variant)
+    if is_not_modified(request, etag, last_modified):
+        return set_validators(current_app.response_class(status=304), etag, last_modified)
+
+    response = make_response(list_documents())
+    if response.status_code == 200:
+        set_validators(response, etag, last_modified)
+    return response
+
+
+def list_collection(query_items, field_types=None, collection=None, resolve=None, depends_on=()):
+    """
+    List documents of a collection, filtered and projected as requested.
+
+    Parses the listing parameters of the current request (see
+    `parse_list_query`), runs the query in the storage backend and returns
+    the documents as a list of `{document_id: document}` entries. Paging is
+    opt-in: without `limit` the whole collection is listed, and with it the
+    cursor for the next page, if any, is returned in the `X-Next-Cursor`
+    header.
+
+    Args:
+        query_items (callable): The db_utils query helper of the collection.
+        field_types (dict, optional): Field types used to convert filter values.
+        collection (str, optional): The collection name, for conditional
+            requests; see `conditional_listing`.
+        resolve (callable, optional): Completes each document before it is
+            projected, e.g. from its config profile. Filters still match the
+            stored documents.
+        depends_on (tuple): Collections `resolve` reads; see
+            `conditional_listing`.
+
+    Returns:
+        flask.Response: A JSON response with a 200 HTTP status code, 304 if
+        the client's copy is current, or 400 when a parameter is invalid.
+    """
+    try:
+        query = parse_list_query(
+            request.args, field_types, default_limit=None, max_limit=Config.MESSAGES_MAX_PAGE_SIZE,
+        )
+    except ValueError as exc:
+        return jsonify({"error": str(exc)}), 400
+
+    select = query["select"]
+    if resolve is not None and select is not None:
+        # Resolving needs the profile reference; the projection is applied afterwards
+        query = {**query, "select": [*select, PROFILE_FIELD]}
+
+    def to_entry(doc):
+        details = doc.to_dict()
+        if resolve is not None:
+            details = resolve(details)
+            if select is not None:
+                details = {key: value for key, value in details.items() if key in select}
+        return {doc.id: details}
+
+    def list_documents():
+        results = list(query_items(**query))
+        document_list = [to_entry(doc) for doc in results]
+        next_cursor = next_page_cursor(results, query)
+        headers = {"X-Next-Cursor": next_cursor} if next_cursor else {}
+        return jsonify(document_list), 200, headers
+
+    if collection is None:
+        return list_documents()
+    return conditional_listing(collection, list_documents, depends_on=depends_on)
+
+
+def resolve_device(details):
+    """Complete a device document with the keys it inherits from its config profile."""
+    if PROFILE_FIELD not in details:
+        return details
+    return resolve_config_profile(details[PROFILE_FIELD], details) or details
 
 
 # Can be moved to API blueprint
 @main_bp.route("/get_swan_devices", methods=["GET"])
 def get_swan_devices():
-    devices = db.collection("swan_devices").stream()
-    device_list = [{device.id: device.to_dict()} for device in devices]
-    return jsonify(device_list), 200
+    return list_collection(
+        query_items_swan_devices_collection, SWAN_CONFIG_FIELD_TYPES, "swan_devices",
+        resolve=resolve_device, depends_on=("config_profiles",),
+    )
 
 
 @main_bp.route("/get_swan_device/<imei>", methods=["GET"])
 def get_swan_device(imei):
-    device_ref = db.collection("swan_devices").document(imei)
-    device = device_ref.get()
+    device = get_item_swan_devices_collection(imei)
     if device.exists:
-        return jsonify({"device_details": device.to_dict()}), 200
+        details = device.to_dict()
+        last_modified = to_datetime(device.update_time)
+        if PROFILE_FIELD in details:
+            # Keys the device does not override come from its profile, which changes on its own
+            details = resolve_device(details)
+            last_modified = None
+        etag = content_etag(details)
+        if is_not_modified(request, etag, last_modified):
+            return set_validators(current_app.response_class(status=304), etag, last_modified)
+        return set_validators(make_response(jsonify({"device_details": details}), 200), etag, last_modified)
     else:
         return jsonify({"error": "Device not found"}), 404
 
 
 @main_bp.route("/get_command_to_swan", methods=["GET"])
 def get_command_to_swan():
-    commands = db.collection("command_to_swan").stream()
-    command_list = [{command.id: command.to_dict()} for command in commands]
-    return jsonify(command_list), 200
+    return list_collection(query_items_command_to_swan_collection, SWAN_CONFIG_FIELD_TYPES, "command_to_swan")
 
 
 @main_bp.route("/get_sessions", methods=["GET"])
 def get_sessions():
-    commands = db.collection("sessions").stream()
-    command_list = [{command.id: command.to_dict()} for command in commands]
-    return jsonify(command_list), 200
+    return list_collection(query_items_session_collection, collection="sessions")
 
 
 @main_bp.route("/add/swan/<imei>", methods=["GET"])
 def add_swan(imei):
-    data = SWAN_DEFAULT_CONFIG
+    # The device references its profile; the full config is resolved on demand
+    profile_id = request.args.get(PROFILE_FIELD, DEFAULT_PROFILE)
+    if resolve_config_profile(profile_id) is None:
+        return jsonify({"error": f"Config profile {profile_id!r} not found"}), 404
 
-    db.collection("swan_devices").document(imei).set(data)
+    set_item_swan_devices_collection(imei, {PROFILE_FIELD: profile_id})
     return jsonify({"message": "Swan device added successfully!"}), 201
 
 
 @main_bp.route("/add/command_to_swan/<imei>", methods=["POST"])
 def update_swan(imei):
     data = request.get_json()
-    doc_ref = db.collection("command_to_swan").document(f"update-{imei}")
-
-    if doc_ref.get().exists:
-        doc_ref.set(data)
+    try:
+        SWAN_CONFIG_SCHEMA.validate(data)
+        resolve_command_to_swan(data)
+    except ConfigError as exc:
+        return jsonify({"error": str(exc)}), 400
+
+    if get_item_command_to_swan_collection(imei).exists:
+        set_item_command_to_swan_collection(imei, data)
         return jsonify({"message": "Swan device updated successfully!"}), 200
     else:
-        doc_ref.set(data)
+        set_item_command_to_swan_collection(imei, data)
         return jsonify({"message": "Swan device created successfully!"}), 201
 
 
 @main_bp.route("/delete/swan/<imei>", methods=["GET", "DELETE"])
 def delete_swan(imei):
-    # Reference to the document with the given IMEI
-    doc_ref = db.collection("swan_devices").document(imei)
-
     # Check if the document exists
-    if doc_ref.get().exists:
+    if get_item_swan_devices_collection(imei).exists:
         # Delete the document
-        doc_ref.delete()
+        delete_item_swan_devices_collection(imei)
         return jsonify({"message": "Swan device deleted successfully!"}), 200
     else:
         return jsonify({"error": "Swan device not found!"}), 404
@@ -426,13 +766,10 @@ def delete_swan(imei):
 
 @main_bp.route("/delete/command_to_swan/<imei>", methods=["GET", "DELETE"])
 def delete_command_to_swan(imei):
-    # Reference to the document with the given IMEI
-    doc_ref = db.collection("command_to_swan").document(f"update-{imei}")
-
     # Check if the document exists
-    if doc_ref.get().exists:
+    if get_item_command_to_swan_collection(imei).exists:
         # Delete the document
-        doc_ref.delete()
+        delete_item_command_to_swan_collection(imei)
         return jsonify({"message": "Swan command deleted successfully!"}), 200
     else:
-        return jsonify({"error": "Swan command not found!"}), 404
\ No newline at end of file
+        return jsonify({"error": "Swan command not found!"}), 404
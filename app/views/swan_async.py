@@ -0,0 +1,110 @@
+import asyncio
+import io
+import json
+import logging
+
+from app.config import Config
+from app.utils.config_schema import ConfigError
+from app.utils.csv_upload import read_csv_chunks
+from app.utils.db_utils import (
+    async_unit_of_work,
+    get_item_session_collection_async,
+    get_item_swan_devices_collection_async,
+    get_item_command_to_swan_collection_async,
+    resolve_command_to_swan_async,
+    replay_cache,
+)
+from app.utils.replay_cache import replay_key
+from app.views.main import handle_command_result, handle_post_csv_type, record_message, remember_response
+
+
+async def handle_swan_post_async(headers, body):
+    """
+    Handle a POST request to the SWAN endpoint without blocking the event loop.
+
+    Follows the same steps as `handle_swan_post`: the posted data is stored
+    and, for requests from SWAN devices, the device session is advanced. The
+    reads a step needs are made concurrently through the async storage, and
+    its writes are committed in one batch when the step is done. Retransmitted
+    command results are answered from the replay cache.
+
+    Args:
+        headers (dict): The request headers, with lower-case names.
+        body (bytes): The request body.
+
+    Returns:
+        tuple: The JSON payload to send back to the client, and the HTTP
+        status code. The payload is None if the request was not handled.
+    """
+    content_type = headers.get("content-type")
+    imei = headers.get("wep-imei")
+
+    if content_type == "application/json":
+        try:
+            data = json.loads(body)
+        except ValueError:
+            return {"error": "Invalid JSON"}, 400
+    elif content_type == "text/csv":
+        data = read_csv_chunks(io.BytesIO(body), Config.CSV_CHUNK_BYTES, Config.CSV_MAX_BODY_BYTES)
+    else:
+        data = None
+
+    key = None
+    if replay_cache is not None and content_type == "application/json":
+        key = replay_key(imei, data, body)
+        replayed = replay_cache.get(key) if key is not None else None
+        if replayed is not None:
+            return replayed
+
+    async with async_unit_of_work():
+        # Queuing a message can block on a full queue and write synchronously, and
+        # chunks of a large upload are committed while it is stored; both run off
+        # the event loop, in the context of the unit of work
+        resp = await asyncio.to_thread(record_message, content_type, imei, data)
+
+        # Only requests from SWAN devices, with accepted data, advance a session
+        if not imei or resp[1] >= 400:
+            return resp
+        if content_type == "text/csv":
+            return await asyncio.to_thread(handle_post_csv_type, imei)
+        if content_type != "application/json":
+            return resp
+        response = await handle_command_result_async(imei, data)
+    remember_response(key, response)
+    return response
+
+
+async def handle_command_result_async(imei, data):
+    """
+    Read what a command result needs concurrently, then advance the session.
+
+    The session and, for a reported config, the pending command and the
+    device document are read at the same time. The session is then advanced
+    by `handle_command_result` on a worker thread, as it can still read
+    storage synchronously, for a command's config profile that is not
+    cached.
+
+    Args:
+        imei (str): The IMEI identifier for the SWAN device.
+        data (dict): The JSON body the device posted, with a 'cmd_res' object.
+
+    Returns:
+        tuple: The JSON payload to send back to the device, and the HTTP
+        status code.
+    """
+    result = data["cmd_res"]
+    reads = [get_item_session_collection_async(result["id"])]
+    if result["res_code"] == 0 and result["type"] == "get_cfg":
+        reads.append(get_item_command_to_swan_collection_async(imei))
+        reads.append(get_item_swan_devices_collection_async(imei))
+
+    session_doc, command_doc, device_doc = [*await asyncio.gather(*reads), None, None][:3]
+
+    if command_doc is not None and command_doc.exists:
+        try:
+            # Loads the command's config profile, if it is not cached yet
+            await resolve_command_to_swan_async(command_doc.to_dict())
+        except ConfigError as exc:
+            logging.warning(f"Invalid command for {imei}: {exc}")
+
+    return await asyncio.to_thread(handle_command_result, imei, data, session_doc, command_doc, device_doc)
@@ -1,12 +1,78 @@
 # gunicorn_config.py
+import os
+import tempfile
 
-bind = '0.0.0.0:8000'
-workers = 1  # You can adjust this based on your testing needs
-timeout = 60  # Keep-alive timeout (seconds)
+
+def _cpu_count():
+    # CPUs this process may run on, which can be fewer than the machine has
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+# Worker profiles:
+# - 'gthread': threaded workers, for the Flask app under WSGI
+# - 'sync': one request at a time per worker
+# - 'uvicorn': asyncio workers for "app.asgi:create_asgi_app()" (see app/asgi.py)
+profile = os.environ.get('GUNICORN_PROFILE', 'gthread')
+_PROFILE_WORKER_CLASSES = {
+    'gthread': 'gthread',
+    'sync': 'sync',
+    'uvicorn': 'uvicorn.workers.UvicornWorker',
+}
+_PROFILE_APPS = {
+    'gthread': 'app:create_app()',
+    'sync': 'app:create_app()',
+    'uvicorn': 'app.asgi:create_asgi_app()',
+}
+if profile not in _PROFILE_WORKER_CLASSES:
+    raise ValueError(f"Unknown GUNICORN_PROFILE: {profile!r}")
+
+# The application of the profile; an app named on the command line takes precedence
+wsgi_app = os.environ.get('GUNICORN_APP', _PROFILE_APPS[profile])
+
+cpus = _cpu_count()
+_default_workers = {'gthread': cpus + 1, 'sync': 2 * cpus + 1, 'uvicorn': cpus}[profile]
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', _PROFILE_WORKER_CLASSES[profile])
+workers = int(os.environ.get('WEB_CONCURRENCY') or _default_workers)
+threads = int(os.environ.get('GUNICORN_THREADS', '4' if profile == 'gthread' else '1'))
+timeout = 60  # Worker timeout (seconds)
 keepalive = 60  # Connection keep-alive duration (seconds)
-max_requests = 50  # Max client requests per connection
+
+# Recycle workers now and then, at staggered times so they never restart together
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', '10000'))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', str(max_requests // 10)))
+
+# Import the app once in the master; workers share its memory and connect after the fork
+preload_app = os.environ.get('GUNICORN_PRELOAD', 'true') == 'true'
+# The log listener thread is started in each worker, never in the master that forks them
+os.environ.setdefault('LOG_DEFER_LISTENER', 'true')
+
+# Workers share their metrics through a directory, so any worker answers /metrics for all of them
+os.environ.setdefault('METRICS_DIR', tempfile.mkdtemp(prefix='swan-metrics-'))
 
 # logging
 accesslog = '-'  # log to stdout
 errorlog = '-'  # log to stdout
 
+
+def post_fork(server, worker):
+    # Start logging, connect to storage and start the maintenance threads in the new worker,
+    # before its first request
+    from app.log import start_listener
+
+    start_listener()
+    from app.utils.db_utils import start_background_tasks, storage
+
+    storage.connect()
+    start_background_tasks()
+
+
+def worker_exit(server, worker):
+    # Write out audit messages still waiting in the write-behind queue
+    from app.utils.db_utils import stop_background_tasks
+
+    stop_background_tasks()
@@ -0,0 +1,52 @@
+"""
+Microbenchmarks of the /swan hot path, run with pytest-benchmark.
+
+pytest-benchmark is a development requirement:
+
+    pip install -r requirements-dev.txt
+
+Without it the benchmarks are skipped, and the skip reason says so. Save a
+baseline before changing one of the benchmarked functions:
+
+    python -m pytest tests/benchmarks --benchmark-only --benchmark-autosave
+
+then compare the change against it, failing on a regression of the mean or
+the median:
+
+    python -m pytest tests/benchmarks --benchmark-only --benchmark-compare \
+        --benchmark-compare-fail=mean:10% --benchmark-compare-fail=median:10%
+
+Baselines are kept in .benchmarks/, per machine and Python version, so
+compare only runs made on the same machine.
+"""
+import base64
+import json
+
+import pytest
+from app import create_app
+from app.config import SWAN_DEFAULT_CONFIG
+
+
+@pytest.fixture
+def app():
+    app = create_app()
+    app.config['TESTING'] = True
+    return app
+
+
+@pytest.fixture
+def client(app):
+    with app.test_client() as client:
+        with app.app_context():
+            yield client
+
+
+@pytest.fixture
+def full_config():
+    return dict(SWAN_DEFAULT_CONFIG)
+
+
+@pytest.fixture
+def encoded_config(full_config):
+    """A full SWAN config as a device reports it in a get_cfg result."""
+    return base64.b64encode(json.dumps(full_config).encode("utf-8")).decode("ascii")
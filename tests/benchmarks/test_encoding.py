@@ -0,0 +1,34 @@
+import base64
+import json
+
+import pytest
+
+pytest.importorskip("pytest_benchmark", reason="pytest-benchmark is not installed, see requirements-dev.txt")
+
+from app.views.main import format_configuration_string, json_to_string
+
+
+def test_format_configuration_string(benchmark, full_config):
+    content = benchmark(format_configuration_string, full_config)
+
+    assert json.loads(content) == full_config
+
+
+def test_format_configuration_string_delta(benchmark):
+    # The usual set_cfg: a few keys that differ from the reported config
+    content = benchmark(format_configuration_string, {"nb1_apn": "iot", "ntp_port": 123, "upload_start_hour": 3})
+
+    assert content == '{"nb1_apn":"iot","ntp_port":123,"upload_start_hour":3}'
+
+
+def test_json_to_string(benchmark, full_config):
+    formatted = benchmark(json_to_string, full_config)
+
+    assert formatted.startswith('"{\\"')
+
+
+def test_decode_config(benchmark, full_config, encoded_config):
+    def decode(content):
+        return json.loads(base64.b64decode(content).decode("utf-8"))
+
+    assert benchmark(decode, encoded_config) == full_config
@@ -0,0 +1,32 @@
+import pytest
+
+pytest.importorskip("pytest_benchmark", reason="pytest-benchmark is not installed, see requirements-dev.txt")
+
+from app.utils.meter_readings import ReadingParser
+
+# A large upload: 10,000 telegrams from 500 meters
+UPLOAD = "meter_id,manufacturer,device_type,timestamp,rssi,value\n" + "".join(
+    f"{n % 500:08d},KAM,water,{1714521600 + n * 60},-{60 + n % 40},{n * 0.25}\n" for n in range(10000)
+)
+
+
+def parse(text):
+    parser = ReadingParser()
+    parser.feed(text)
+    parser.close()
+    return parser
+
+
+def test_parse_upload(benchmark):
+    parser = benchmark(parse, UPLOAD)
+
+    assert (len(parser.readings), parser.rejected) == (10000, 0)
+
+
+def test_parse_upload_with_invalid_rows(benchmark):
+    # Each chunk with an invalid row falls back to converting row by row
+    text = UPLOAD.replace(",KAM,water,1714521600,", ",KAM,water,never,")
+
+    parser = benchmark(parse, text)
+
+    assert (len(parser.readings), parser.rejected) == (9999, 1)
@@ -0,0 +1,149 @@
+import pytest
+
+pytest.importorskip("pytest_benchmark", reason="pytest-benchmark is not installed, see requirements-dev.txt")
+
+from flask import Request
+from werkzeug.test import EnvironBuilder
+
+from app.utils import db_utils
+from app.views.main import handle_post_request
+
+IMEI = "123111111113"
+SESSION_ID = f"session_{IMEI}_1"
+
+# Fixed rounds keep the write-behind message queue below its limit
+ROUNDS = 500
+WARMUP_ROUNDS = 20
+
+
+def bench(benchmark, function, *args, setup=lambda: None, **kwargs):
+    """Run `function` after `setup` in every round, timing only `function`."""
+    def prepare():
+        # Every round is handled, not replayed as a retransmission
+        if db_utils.replay_cache is not None:
+            db_utils.replay_cache.clear()
+        setup()
+        return args, kwargs
+
+    return benchmark.pedantic(function, setup=prepare, rounds=ROUNDS, warmup_rounds=WARMUP_ROUNDS)
+
+
+def build_request(**kwargs):
+    return Request(EnvironBuilder(path="/swan", method="POST", **kwargs).get_environ())
+
+
+@pytest.mark.parametrize("kwargs", [
+    {"headers": {"Wep-Imei": IMEI}, "json": {"meter": "A1", "value": 42}},
+    {"headers": {"Wep-Imei": IMEI}, "content_type": "text/csv", "data": "meter,value\nA1,42\nA2,43\n"},
+], ids=["json", "csv"])
+def test_handle_post_request(benchmark, kwargs):
+    def setup():
+        # A new request per round, so the body is parsed every time
+        return (build_request(**kwargs),), {}
+
+    payload, status = benchmark.pedantic(
+        handle_post_request, setup=setup, rounds=ROUNDS, warmup_rounds=WARMUP_ROUNDS,
+    )
+
+    assert status == 201
+
+
+def set_session(status):
+    def setup():
+        db_utils.storage.set("sessions", SESSION_ID, {"session_id": SESSION_ID, "status": status})
+    return setup
+
+
+def first_check_in():
+    # A device seen for the first time, with a pending command
+    set_session("sent get_cfg")()
+    db_utils.storage.set("command_to_swan", f"update-{IMEI}", {"nb1_apn": "iot"})
+    db_utils.storage.delete("swan_devices", IMEI)
+
+
+def cmd_res(type, res_code=0, content=None):
+    result = {"type": type, "id": SESSION_ID, "res_code": res_code}
+    if content is not None:
+        result["content"] = content
+    return {"cmd_res": result}
+
+
+def test_get_swan(benchmark, client):
+    for n in range(50):
+        db_utils.storage.set("messages", f"message-{n}", {"imei": IMEI, "csv_data": "a,b\n1,2"})
+
+    response = benchmark(client.get, "/swan")
+
+    assert response.status_code == 200
+
+
+def test_post_without_imei(benchmark, client):
+    response = bench(benchmark, client.post, "/swan", json={"meter": "A1"})
+
+    assert response.status_code == 201
+
+
+def test_post_csv_upload(benchmark, client):
+    response = bench(
+        benchmark, client.post, "/swan",
+        headers={"Wep-Imei": IMEI, "Content-Type": "text/csv"}, data="meter,value\nA1,42\n",
+    )
+
+    assert response.get_json()["cmd"]["type"] == "get_cfg"
+
+
+def test_post_get_cfg_first_check_in(benchmark, client, encoded_config):
+    response = bench(
+        benchmark, client.post, "/swan", setup=first_check_in,
+        headers={"Wep-Imei": IMEI}, json=cmd_res("get_cfg", content=encoded_config),
+    )
+
+    assert response.get_json()["cmd"]["type"] == "set_cfg"
+
+
+def test_post_get_cfg_unchanged_config(benchmark, client, encoded_config):
+    # The common check-in: the device reports the config it already had, nothing is pending
+    response = bench(
+        benchmark, client.post, "/swan", setup=set_session("sent get_cfg"),
+        headers={"Wep-Imei": IMEI}, json=cmd_res("get_cfg", content=encoded_config),
+    )
+
+    assert response.status_code == 200
+    assert "cmd" in response.get_json()
+
+
+def test_post_get_cfg_session_completed(benchmark, client, encoded_config):
+    response = bench(
+        benchmark, client.post, "/swan", setup=set_session("returned to Galooli"),
+        headers={"Wep-Imei": IMEI}, json=cmd_res("get_cfg", content=encoded_config),
+    )
+
+    assert response.get_json() == {"message": "Session already completed"}
+
+
+def test_post_retransmitted_result(benchmark, client, encoded_config):
+    set_session("sent get_cfg")()
+    kwargs = {"headers": {"Wep-Imei": IMEI}, "json": cmd_res("get_cfg", content=encoded_config)}
+    first = client.post("/swan", **kwargs)
+
+    response = benchmark(client.post, "/swan", **kwargs)
+
+    assert response.get_json() == first.get_json()
+
+
+def test_post_set_cfg(benchmark, client):
+    response = bench(
+        benchmark, client.post, "/swan", setup=set_session("sent set_cfg"),
+        headers={"Wep-Imei": IMEI}, json=cmd_res("set_cfg"),
+    )
+
+    assert response.get_json()["cmd"]["type"] == "get_cfg"
+
+
+def test_post_error(benchmark, client):
+    response = bench(
+        benchmark, client.post, "/swan", setup=set_session("sent set_cfg"),
+        headers={"Wep-Imei": IMEI}, json=cmd_res("set_cfg", res_code=1),
+    )
+
+    assert response.status_code == 400
@@ -0,0 +1,21 @@
+import os
+
+# Run the suite against the in-memory storage backend, logging to the console only
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+os.environ.setdefault("LOG_FILE", "")
+
+import pytest
+
+from app.utils import db_utils
+
+
+@pytest.fixture(autouse=True)
+def storage():
+    yield db_utils.storage
+    if db_utils.message_queue is not None:
+        db_utils.message_queue.flush()
+    if db_utils.meter_reading_writer is not None:
+        db_utils.meter_reading_writer.flush()
+    db_utils.storage.clear()
+    if db_utils.replay_cache is not None:
+        db_utils.replay_cache.clear()
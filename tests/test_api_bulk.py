@@ -0,0 +1,100 @@
+from unittest.mock import patch
+
+import pytest
+from app import create_app
+from app.config import SWAN_DEFAULT_CONFIG
+
+
+@pytest.fixture
+def client():
+    app = create_app()
+    app.config['TESTING'] = True
+    with app.test_client() as client:
+        with app.app_context():
+            yield client
+
+
+def test_bulk_commands_for_imei_list(client, storage):
+    imeis = [f"35{n:013d}" for n in range(1200)]
+    with patch.object(storage, "commit", wraps=storage.commit) as commit:
+        response = client.post("/api/commands", json={"imeis": imeis, "config": {"nb1_apn": "iot"}})
+
+    assert response.status_code == 200
+    assert response.get_json()["summary"] == {"total": 1200, "ok": 1200, "failed": 0}
+    # 1200 writes in batches of at most 500
+    assert commit.call_count == 3
+    assert storage.get("command_to_swan", f"update-{imeis[-1]}").to_dict() == {"nb1_apn": "iot"}
+
+
+def test_bulk_commands_per_device_with_invalid_items(client, storage):
+    response = client.post("/api/commands", json={"commands": {
+        "123111111111": {"nb1_apn": "iot"},
+        "123111111112": {"ntp_port": "abc"},
+        "123111111113": "not a config",
+    }})
+
+    assert response.status_code == 207
+    body = response.get_json()
+    assert body["summary"] == {"total": 3, "ok": 1, "failed": 2}
+    assert [result["status"] for result in body["results"]] == ["ok", "invalid", "invalid"]
+    assert storage.get("command_to_swan", "update-123111111111").exists
+    assert not storage.get("command_to_swan", "update-123111111112").exists
+
+
+def test_bulk_commands_by_selector(client, storage):
+    storage.set("swan_devices", "123111111111", {**SWAN_DEFAULT_CONFIG, "nb1_bands": "20"})
+    storage.set("swan_devices", "123111111112", SWAN_DEFAULT_CONFIG)
+
+    response = client.post("/api/commands", json={"selector": {"nb1_bands": "20"}, "config": {"nb1_bands": "8,20"}})
+    assert response.get_json()["results"] == [{"imei": "123111111111", "status": "ok"}]
+
+    response = client.delete("/api/commands", json={"selector": {"nb1_bands": ["20", "3,8,20"]}})
+    assert response.get_json()["summary"]["ok"] == 2
+    assert not storage.get("command_to_swan", "update-123111111111").exists
+
+
+def test_selector_reads_at_most_one_device_past_the_limit(client, storage, monkeypatch):
+    monkeypatch.setattr("app.views.api.Config.BULK_MAX_ITEMS", 2)
+    for n in range(5):
+        storage.set("swan_devices", f"12311111111{n}", SWAN_DEFAULT_CONFIG)
+
+    with patch.object(storage, "query", wraps=storage.query) as query:
+        response = client.post("/api/commands", json={"selector": {"nb1_bands": "3,8,20"}, "config": {}})
+    assert response.status_code == 400
+    assert query.call_args.kwargs["limit"] == 3
+
+
+def test_failed_batch_is_reported_per_item(client, storage):
+    with patch.object(storage, "commit", side_effect=RuntimeError("unavailable")):
+        response = client.post("/api/commands", json={"imeis": ["123111111111"], "config": {"nb1_apn": "iot"}})
+
+    assert response.status_code == 207
+    assert response.get_json()["results"] == [{"imei": "123111111111", "status": "failed", "error": "unavailable"}]
+
+
+@pytest.mark.parametrize("body", [
+    {"imeis": ["123111111111"]},
+    {"imeis": "123111111111", "config": {}},
+    {"imeis": [], "selector": {"nb1_bands": "20"}, "config": {}},
+    {"selector": {}, "config": {}},
+    {"selector": {"nb1_bands": "20", "owner": "x"}, "config": {}},
+    {"selector": {"nb1_bands": {}}, "config": {}},
+    {"selector": {"nb1_bands": []}, "config": {}},
+    {"selector": {"nb1_bands": ["20"], "nb1_apn": ["iot"]}, "config": {}},
+    {"imeis": [{}], "config": {}},
+    {"imeis": ["123111111111", 5], "config": {}},
+])
+def test_bulk_commands_rejects_invalid_body(client, body):
+    assert client.post("/api/commands", json=body).status_code == 400
+
+
+def test_bulk_delete_reports_invalid_imeis(client, storage):
+    storage.set("command_to_swan", "update-123111111111", {"nb1_apn": "iot"})
+    response = client.delete("/api/commands", json={"imeis": ["123111111111", "a/b"]})
+
+    assert response.status_code == 207
+    assert response.get_json()["results"] == [
+        {"imei": "123111111111", "status": "ok"},
+        {"imei": "a/b", "status": "invalid", "error": "Invalid IMEI"},
+    ]
+    assert client.delete("/api/commands", json={"imeis": [{}]}).status_code == 400
@@ -0,0 +1,78 @@
+import pytest
+
+from app.storage.memory import MemoryStorage
+from app.utils.command_cache import CommandIndex
+
+
+class PollingStorage(MemoryStorage):
+    """Memory storage without change notifications, like SQLite."""
+
+    def watch(self, collection, callback):
+        raise NotImplementedError
+
+
+class CountingStorage(MemoryStorage):
+    def __init__(self):
+        super().__init__()
+        self.stream_calls = 0
+
+    def stream(self, collection):
+        self.stream_calls += 1
+        return super().stream(collection)
+
+
+@pytest.fixture
+def memory_storage():
+    memory_storage = CountingStorage()
+    memory_storage.set("command_to_swan", "update-1", {"nb1_apn": "iot"})
+    return memory_storage
+
+
+def test_lookups_need_one_load(memory_storage):
+    index = CommandIndex(memory_storage, "command_to_swan")
+
+    assert index.get("update-1").to_dict() == {"nb1_apn": "iot"}
+    assert not index.get("update-2").exists
+    assert not index.get("update-3").exists
+    assert memory_storage.stream_calls == 1
+
+
+def test_watch_keeps_index_current(memory_storage):
+    index = CommandIndex(memory_storage, "command_to_swan")
+    assert not index.get("update-2").exists
+    assert index.listening
+
+    memory_storage.set("command_to_swan", "update-2", {"nb1_bands": "20"})
+    assert index.get("update-2").to_dict() == {"nb1_bands": "20"}
+
+    memory_storage.delete("command_to_swan", "update-1")
+    assert not index.get("update-1").exists
+
+
+def test_ttl_reload_without_listener(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("app.utils.command_cache.time.monotonic", lambda: now[0])
+    polling_storage = PollingStorage()
+    index = CommandIndex(polling_storage, "command_to_swan", ttl=30)
+    assert not index.get("update-1").exists
+    assert not index.listening
+
+    # Written by another process: invisible until the TTL expires
+    polling_storage.set("command_to_swan", "update-1", {"nb1_apn": "iot"})
+    now[0] += 10
+    assert not index.get("update-1").exists
+
+    now[0] += 30
+    assert index.get("update-1").exists
+
+
+def test_local_writes_are_visible_immediately():
+    index = CommandIndex(PollingStorage(), "command_to_swan")
+    assert not index.get("update-1").exists
+
+    index.put("update-1", {"nb1_apn": "iot"})
+    index.update("update-1", {"nb1_bands": "20"})
+    assert index.get("update-1").to_dict() == {"nb1_apn": "iot", "nb1_bands": "20"}
+
+    index.discard("update-1")
+    assert not index.get("update-1").exists
@@ -0,0 +1,111 @@
+import gzip
+import json
+from unittest.mock import patch
+
+import pytest
+from werkzeug.datastructures import Accept
+from werkzeug.http import parse_accept_header
+
+from app import create_app
+from app.config import Config
+from app.utils import db_utils
+from app.utils.compression import choose_encoding, compress, compress_stream
+
+IMEI = "123111111113"
+
+
+@pytest.fixture
+def client():
+    app = create_app()
+    app.config['TESTING'] = True
+    with app.test_client() as client:
+        with app.app_context():
+            yield client
+
+
+@pytest.fixture
+def devices(client):
+    for n in range(20):
+        client.get(f"/add/swan/1231111111{n:02d}")
+
+
+def accept(header):
+    return parse_accept_header(header, Accept)
+
+
+def test_choose_encoding():
+    encodings = ("br", "zstd", "gzip")
+    assert choose_encoding(accept("gzip, deflate, br"), encodings) == "br"
+    assert choose_encoding(accept("gzip;q=1.0, br;q=0.5"), encodings) == "gzip"
+    assert choose_encoding(accept("*"), encodings) == "br"
+    assert choose_encoding(accept("br;q=0, *;q=0.1"), encodings) == "zstd"
+    assert choose_encoding(accept("identity"), encodings) is None
+    assert choose_encoding(accept("br"), ("gzip",)) is None
+
+
+@pytest.mark.parametrize("encoding, module, decompress", [
+    ("br", "brotli", lambda module, data: module.decompress(data)),
+    ("zstd", "zstandard", lambda module, data: module.ZstdDecompressor().decompressobj().decompress(data)),
+    ("gzip", "gzip", lambda module, data: module.decompress(data)),
+])
+def test_every_encoding_round_trips(encoding, module, decompress):
+    module = pytest.importorskip(module)
+    data = b'{"imei": "123111111113"}\n' * 100
+
+    assert decompress(module, compress(data, encoding, 5)) == data
+    streamed = b"".join(compress_stream([data[:1000], data[1000:].decode("utf-8")], encoding, 5))
+    assert decompress(module, streamed) == data
+
+
+def test_listing_is_compressed(client, devices):
+    plain = client.get("/get_swan_devices")
+    response = client.get("/get_swan_devices", headers={"Accept-Encoding": "gzip"})
+
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.headers["Vary"] == "Accept-Encoding"
+    assert int(response.headers["Content-Length"]) < len(plain.get_data()) / 5
+    assert json.loads(gzip.decompress(response.get_data())) == plain.get_json()
+    assert "Content-Encoding" not in plain.headers
+
+
+def test_small_response_is_not_compressed(client):
+    response = client.get("/get_sessions", headers={"Accept-Encoding": "gzip"})
+
+    assert "Content-Encoding" not in response.headers
+    assert response.get_json() == []
+
+
+def test_streamed_listing_is_compressed(client, storage, monkeypatch):
+    monkeypatch.setattr(db_utils, "message_queue", None)
+    for n in range(5):
+        client.post("/swan", json={"n": n})
+
+    response = client.get("/swan?format=ndjson", headers={"Accept-Encoding": "gzip"})
+
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert "Content-Length" not in response.headers
+    lines = gzip.decompress(response.get_data()).decode("utf-8").splitlines()
+    assert sorted(json.loads(line)["n"] for line in lines) == list(range(5))
+
+
+def test_device_responses_are_not_compressed(client, storage, monkeypatch):
+    monkeypatch.setattr(Config, "COMPRESSION_MIN_SIZE", 0)
+    headers = {"Wep-Imei": IMEI, "Content-Type": "text/csv", "Accept-Encoding": "gzip"}
+
+    with patch("app.utils.compression.compress", wraps=compress) as compressed:
+        response = client.post("/swan", headers=headers, data="a,b\n1,2")
+    assert response.get_json()["cmd"]["type"] == "get_cfg"
+    compressed.assert_not_called()
+
+    monkeypatch.setattr(Config, "COMPRESS_DEVICE_RESPONSES", True)
+    with patch("app.utils.compression.compress", wraps=compress) as compressed:
+        client.post("/swan", headers=headers, data="a,b\n1,2")
+    compressed.assert_called_once()
+
+
+def test_compression_can_be_disabled(client, devices, monkeypatch):
+    monkeypatch.setattr(Config, "COMPRESSION_ENABLED", False)
+
+    response = client.get("/get_swan_devices", headers={"Accept-Encoding": "gzip"})
+
+    assert "Content-Encoding" not in response.headers
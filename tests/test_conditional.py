@@ -0,0 +1,123 @@
+import pytest
+from app import create_app
+from app.storage.memory import MemoryStorage
+from app.storage.versioned import CollectionVersions, VersionedStorage
+
+IMEI = "123111111113"
+
+
+@pytest.fixture
+def client():
+    app = create_app()
+    app.config['TESTING'] = True
+    with app.test_client() as client:
+        with app.app_context():
+            yield client
+
+
+def test_writes_update_version_markers():
+    versions = CollectionVersions(["swan_devices"], shards=4)
+    storage = VersionedStorage(MemoryStorage(), versions)
+
+    first = versions.read(storage, "swan_devices")
+    assert versions.read(storage, "swan_devices") == first
+
+    storage.set("sessions", "session_1", {"status": "created"})
+    assert versions.read(storage, "swan_devices") == first
+
+    storage.commit([("set", "swan_devices", IMEI, {"nb1_apn": "iot"}), ("delete", "swan_devices", "other", None)])
+    version, last_modified = versions.read(storage, "swan_devices")
+    assert version != first[0] and last_modified >= first[1]
+    # Another process sees the new version once this one has flushed its markers
+    other = CollectionVersions(["swan_devices"], shards=4)
+    assert other.read(storage, "swan_devices") == first
+    assert versions.flush(storage) == 1
+    assert other.read(storage, "swan_devices") == versions.read(storage, "swan_devices") == (version, last_modified)
+    assert all(doc.id.startswith("swan_devices-") for doc in storage.stream("collection_versions"))
+
+
+def test_unchanged_listing_is_not_modified(client, storage):
+    client.get(f"/add/swan/{IMEI}")
+    response = client.get("/get_swan_devices?limit=10")
+    etag, last_modified = response.headers["ETag"], response.headers["Last-Modified"]
+
+    reads = []
+    storage.add_observer(lambda operation, counts, seconds, error: reads.append(counts))
+    response = client.get("/get_swan_devices?limit=10", headers={"If-None-Match": etag})
+
+    assert response.status_code == 304
+    assert response.get_data() == b""
+    assert response.headers["ETag"] == etag
+    # Only the version markers of the devices and their profiles were read
+    assert [list(counts) for counts in reads] == [["collection_versions"], ["collection_versions"]]
+
+    response = client.get("/get_swan_devices?limit=10", headers={"If-Modified-Since": last_modified})
+    assert response.status_code == 304
+    # Another page is another representation
+    assert client.get("/get_swan_devices?limit=5", headers={"If-None-Match": etag}).status_code == 200
+
+
+def test_write_changes_listing_etag(client, storage):
+    client.get(f"/add/swan/{IMEI}")
+    etag = client.get("/get_command_to_swan").headers["ETag"]
+
+    client.post(f"/add/command_to_swan/{IMEI}", json={"nb1_apn": "iot"})
+    response = client.get("/get_command_to_swan", headers={"If-None-Match": etag})
+
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert list(response.get_json()[0]) == [f"update-{IMEI}"]
+
+
+def test_unversioned_listing_has_no_etag(client):
+    assert "ETag" not in client.get("/get_sessions").headers
+
+
+def test_device_etag(client, storage):
+    storage.set("swan_devices", IMEI, {"nb1_apn": "iot"})
+    response = client.get(f"/get_swan_device/{IMEI}")
+    etag = response.headers["ETag"]
+
+    assert client.get(f"/get_swan_device/{IMEI}", headers={"If-None-Match": etag}).status_code == 304
+    assert client.get(f"/get_swan_device/{IMEI}", headers={"If-None-Match": f'W/{etag}'}).status_code == 304
+    assert client.get(
+        f"/get_swan_device/{IMEI}", headers={"If-Modified-Since": response.headers["Last-Modified"]}
+    ).status_code == 304
+
+    storage.set("swan_devices", IMEI, {"nb1_apn": "other"})
+    response = client.get(f"/get_swan_device/{IMEI}", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.get_json()["device_details"]["nb1_apn"] == "other"
+
+
+def test_compressed_listing_has_weak_etag(client):
+    for n in range(20):
+        client.get(f"/add/swan/1231111111{n:02d}")
+
+    response = client.get("/get_swan_devices", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.headers["ETag"].startswith('W/"')
+
+    response = client.get(
+        "/get_swan_devices", headers={"Accept-Encoding": "gzip", "If-None-Match": response.headers["ETag"]}
+    )
+    assert response.status_code == 304
+
+
+def test_marker_writes_are_kept_out_of_commits():
+    from unittest.mock import MagicMock
+
+    backend = MagicMock()
+    versions = CollectionVersions(["command_to_swan"])
+    versioned = VersionedStorage(backend, versions)
+    writes = [("set", "command_to_swan", f"update-{n}", {}) for n in range(500)]
+
+    versioned.commit(writes)
+    versioned.commit(writes[:1])
+    assert versions.flush(backend) == 1
+    assert versions.flush(backend) == 0
+
+    batches = [call.args[0] for call in backend.commit.call_args_list]
+    assert [len(batch) for batch in batches] == [500, 1, 1]
+    assert all(write[1] == "command_to_swan" for batch in batches[:2] for write in batch)
+    assert batches[2][0][1] == "collection_versions"
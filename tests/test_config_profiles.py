@@ -0,0 +1,148 @@
+import base64
+import json
+
+import pytest
+from app import create_app
+from app.config import SWAN_DEFAULT_CONFIG
+from app.storage.memory import MemoryStorage
+from app.utils.config_profiles import ConfigProfiles
+from app.utils.config_schema import ConfigError
+from app.utils.db_utils import DEVICE_META_FIELDS, save_swan_device_config
+
+
+@pytest.fixture
+def client():
+    app = create_app()
+    app.config['TESTING'] = True
+    with app.test_client() as client:
+        with app.app_context():
+            yield client
+
+
+class CountingStorage(MemoryStorage):
+    def __init__(self):
+        super().__init__()
+        self.get_calls = 0
+
+    def get(self, collection, document_id):
+        self.get_calls += 1
+        return super().get(collection, document_id)
+
+
+def test_profiles_resolve_in_layers():
+    memory_storage = CountingStorage()
+    memory_storage.set("config_profiles", "default", {"ntp_port": 124})
+    memory_storage.set("config_profiles", "iot", {"nb1_apn": "iot"})
+    profiles = ConfigProfiles(memory_storage, "config_profiles", SWAN_DEFAULT_CONFIG)
+
+    config = profiles.resolve("iot", {"nb1_bands": "20"})
+    assert config == {**SWAN_DEFAULT_CONFIG, "ntp_port": 124, "nb1_apn": "iot", "nb1_bands": "20"}
+    assert profiles.resolve("missing") is None
+    assert profiles.resolve_command({"nb1_psm": 1}) == {"nb1_psm": 1}
+    with pytest.raises(ConfigError):
+        profiles.resolve_command({"profile": "missing"})
+
+    calls = memory_storage.get_calls
+    profiles.resolve("iot")
+    profiles.resolve("missing")
+    assert memory_storage.get_calls == calls
+
+
+def test_profile_change_invalidates_memoized_config():
+    memory_storage = MemoryStorage()
+    memory_storage.set("config_profiles", "iot", {"nb1_apn": "iot"})
+    profiles = ConfigProfiles(memory_storage, "config_profiles", SWAN_DEFAULT_CONFIG)
+    assert profiles.resolve("iot")["nb1_apn"] == "iot"
+
+    memory_storage.set("config_profiles", "iot", {"nb1_apn": "iot2"})
+    assert profiles.resolve("iot")["nb1_apn"] == "iot2"
+
+    memory_storage.set("config_profiles", "default", {"ntp_port": 124})
+    assert profiles.resolve("iot")["ntp_port"] == 124
+
+
+def test_add_swan_references_profile(client, storage):
+    client.put("/api/profiles/iot", json={"nb1_apn": "iot"})
+
+    assert client.get("/add/swan/123111111113?profile=iot").status_code == 201
+    assert storage.get("swan_devices", "123111111113").to_dict() == {"profile": "iot"}
+    details = client.get("/get_swan_device/123111111113").get_json()["device_details"]
+    assert details["nb1_apn"] == "iot"
+    assert details["ntp_server"] == SWAN_DEFAULT_CONFIG["ntp_server"]
+
+    assert client.get("/add/swan/123111111114?profile=missing").status_code == 404
+
+
+def test_device_listing_resolves_profiles(client, storage):
+    client.put("/api/profiles/iot", json={"nb1_apn": "iot"})
+    client.get("/add/swan/123111111113?profile=iot")
+
+    response = client.get("/get_swan_devices")
+    (entry,) = response.get_json()
+    assert entry["123111111113"]["nb1_apn"] == "iot"
+    assert entry["123111111113"]["timezone"] == SWAN_DEFAULT_CONFIG["timezone"]
+
+    response = client.get("/get_swan_devices?fields=nb1_apn")
+    assert response.get_json() == [{"123111111113": {"nb1_apn": "iot"}}]
+
+    # A profile edit changes the listing, so the previous ETag no longer matches
+    etag = client.get("/get_swan_devices").headers["ETag"]
+    client.put("/api/profiles/iot", json={"nb1_apn": "iot2"})
+    response = client.get("/get_swan_devices", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.get_json()[0]["123111111113"]["nb1_apn"] == "iot2"
+
+
+def test_reported_config_stores_only_profile_overrides(client, storage):
+    client.put("/api/profiles/iot", json={"nb1_apn": "iot"})
+    client.get("/add/swan/123111111113?profile=iot")
+    resolved = {**SWAN_DEFAULT_CONFIG, "nb1_apn": "iot"}
+
+    assert save_swan_device_config("123111111113", resolved) == "unchanged"
+    assert storage.get("swan_devices", "123111111113").to_dict() == {"profile": "iot"}
+
+    assert save_swan_device_config("123111111113", {**resolved, "ntp_port": 124}) == "updated"
+    stored = storage.get("swan_devices", "123111111113").to_dict()
+    assert {key: stored[key] for key in stored if key not in DEVICE_META_FIELDS} == {"profile": "iot", "ntp_port": 124}
+
+    assert save_swan_device_config("123111111113", resolved) == "updated"
+    stored = storage.get("swan_devices", "123111111113").to_dict()
+    assert {key: stored[key] for key in stored if key not in DEVICE_META_FIELDS} == {"profile": "iot"}
+
+
+def test_command_referencing_profile_sends_resolved_delta(client, storage):
+    client.put("/api/profiles/iot", json={"nb1_apn": "iot"})
+    response = client.post("/api/commands", json={"imeis": ["123111111113"], "profile": "iot"})
+    assert response.status_code == 200
+    assert storage.get("command_to_swan", "update-123111111113").to_dict() == {"profile": "iot"}
+
+    # Editing the profile changes what the pending command sends
+    client.put("/api/profiles/iot", json={"nb1_apn": "iot2", "ntp_port": 124})
+
+    storage.set("sessions", "session_123111111113_1", {"status": "sent get_cfg"})
+    content = base64.b64encode(json.dumps(SWAN_DEFAULT_CONFIG).encode("utf-8")).decode("ascii")
+    response = client.post(
+        "/swan",
+        headers={"Wep-Imei": "123111111113", "Content-Type": "application/json"},
+        json={"cmd_res": {"type": "get_cfg", "id": "session_123111111113_1", "res_code": 0, "content": content}},
+    )
+    assert response.get_json()["cmd"]["content"] == '{"nb1_apn":"iot2","ntp_port":124}'
+
+
+def test_profile_endpoints(client, storage):
+    assert client.put("/api/profiles/iot", json={"nb1_apn": "iot"}).status_code == 201
+    assert client.put("/api/profiles/iot", json={"nb1_apn": "iot2"}).status_code == 200
+    assert client.put("/api/profiles/iot", json={"nb1_apn": 1}).status_code == 400
+    assert client.put("/api/profiles/iot", json={"unknown": 1}).status_code == 400
+    assert client.get("/api/profiles").get_json() == [{"iot": {"nb1_apn": "iot2"}}]
+    assert client.get("/api/profiles/iot").get_json()["config"]["nb1_apn"] == "iot2"
+    assert client.get("/api/profiles/missing").status_code == 404
+
+    client.post("/add/command_to_swan/123111111113", json={"profile": "iot"})
+    assert client.delete("/api/profiles/iot").status_code == 409
+    client.delete("/delete/command_to_swan/123111111113")
+    client.get("/add/swan/123111111114?profile=iot")
+    assert client.delete("/api/profiles/iot").status_code == 409
+    client.delete("/delete/swan/123111111114")
+    assert client.delete("/api/profiles/iot").status_code == 200
+    assert client.post("/add/command_to_swan/123111111113", json={"profile": "iot"}).status_code == 400
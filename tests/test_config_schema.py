@@ -0,0 +1,92 @@
+import base64
+import json
+from unittest.mock import patch
+
+import pytest
+from app import create_app
+from app.config import SWAN_DEFAULT_CONFIG
+from app.utils.config_schema import SWAN_CONFIG_SCHEMA, ConfigError
+from app.views.main import format_configuration_string
+
+
+@pytest.fixture
+def client():
+    app = create_app()
+    app.config['TESTING'] = True
+    with app.test_client() as client:
+        with app.app_context():
+            yield client
+
+
+def test_encode_mixed_types_in_schema_order():
+    content = format_configuration_string({"upload_remote_port": 31031, "nb1_apn": "iot", "ntp_port": 123})
+    assert content == '{"nb1_apn":"iot","ntp_port":123,"upload_remote_port":31031}'
+    assert json.loads(content) == {"nb1_apn": "iot", "ntp_port": 123, "upload_remote_port": 31031}
+
+
+def test_encode_full_default_config_round_trips():
+    content = format_configuration_string(SWAN_DEFAULT_CONFIG)
+    assert json.loads(content) == SWAN_DEFAULT_CONFIG
+    assert list(json.loads(content)) == list(SWAN_DEFAULT_CONFIG)
+
+
+def test_encode_escapes_strings_and_passes_unknown_keys():
+    content = format_configuration_string({"device_tag": 'tank "A"', "custom": 1, "nb1_bands": None})
+    assert json.loads(content) == {"device_tag": 'tank "A"', "custom": 1}
+
+
+@pytest.mark.parametrize("config", [
+    {"ntp_port": "123"},
+    {"ntp_port": 70000},
+    {"upload_start_hour": 24},
+    {"nb1_apn": 5},
+    {"nb1_psm": True},
+])
+def test_encode_rejects_invalid_values(config):
+    with pytest.raises(ConfigError):
+        format_configuration_string(config)
+
+
+def test_delta():
+    desired = {"nb1_apn": "iot", "ntp_port": 123, "upload_jitter": 30}
+    assert SWAN_CONFIG_SCHEMA.delta(desired, SWAN_DEFAULT_CONFIG) == {"nb1_apn": "iot", "upload_jitter": 30}
+
+
+def get_cfg_payload(config):
+    return {
+        "cmd_res": {
+            "type": "get_cfg",
+            "id": "session_123111111113_1",
+            "res_code": 0,
+            "content": base64.b64encode(json.dumps(config).encode("utf-8")).decode("ascii")
+        }
+    }
+
+
+def test_get_cfg_sends_only_changed_keys(client, storage):
+    headers = {"Wep-Imei": "123111111113", "Content-Type": "application/json"}
+    storage.set("sessions", "session_123111111113_1", {"status": "sent get_cfg"})
+    storage.set("command_to_swan", "update-123111111113", {**SWAN_DEFAULT_CONFIG, "nb1_apn": "iot"})
+
+    response = client.post("/swan", headers=headers, json=get_cfg_payload(SWAN_DEFAULT_CONFIG))
+    assert response.status_code == 200
+    assert response.get_json()["cmd"]["content"] == '{"nb1_apn":"iot"}'
+
+
+@patch('app.views.main.UPLOAD_SERVER', "upload.example.com")
+def test_get_cfg_with_applied_command_returns_device(client, storage):
+    headers = {"Wep-Imei": "123111111113", "Content-Type": "application/json"}
+    storage.set("sessions", "session_123111111113_1", {"status": "sent get_cfg"})
+    storage.set("command_to_swan", "update-123111111113", {"nb1_bands": "3,8,20"})
+
+    response = client.post("/swan", headers=headers, json=get_cfg_payload(SWAN_DEFAULT_CONFIG))
+    assert response.status_code == 200
+    assert response.get_json()["cmd"]["content"] == '{"upload_server":"upload.example.com"}'
+    assert storage.get("sessions", "session_123111111113_1").to_dict()["status"] == "returned to Galooli"
+    assert not storage.get("command_to_swan", "update-123111111113").exists
+
+
+def test_update_swan_rejects_invalid_config(client, storage):
+    response = client.post("/add/command_to_swan/123111111113", json={"ntp_port": "abc"})
+    assert response.status_code == 400
+    assert not storage.get("command_to_swan", "update-123111111113").exists
@@ -0,0 +1,126 @@
+import asyncio
+import io
+import json
+
+import pytest
+from app import create_app
+from app.asgi import create_asgi_app
+from app.config import Config
+from app.utils import db_utils
+from app.utils.csv_upload import UploadTooLarge, read_csv_chunks
+
+IMEI = "123111111113"
+HEADERS = {"Wep-Imei": IMEI, "Content-Type": "text/csv"}
+
+
+@pytest.fixture
+def client():
+    app = create_app()
+    app.config['TESTING'] = True
+    with app.test_client() as client:
+        with app.app_context():
+            yield client
+
+
+@pytest.fixture(autouse=True)
+def synchronous_messages(monkeypatch):
+    monkeypatch.setattr(db_utils, "message_queue", None)
+
+
+@pytest.fixture
+def small_chunks(monkeypatch):
+    monkeypatch.setattr(Config, "CSV_CHUNK_BYTES", 64)
+    monkeypatch.setattr(Config, "CSV_BATCH_BYTES", 128)
+
+
+def make_csv(rows):
+    return "meter,value,note\n" + "".join(f"A{n},{n},ü\n" for n in range(rows))
+
+
+def messages(storage):
+    return [(doc.id, doc.to_dict()) for doc in storage.stream("messages")]
+
+
+def test_chunks_end_at_rows():
+    body = make_csv(50).encode("utf-8")
+
+    chunks = list(read_csv_chunks(io.BytesIO(body), chunk_size=64, read_size=7))
+
+    assert "".join(chunks) == body.decode("utf-8")
+    assert all(chunk.endswith("\n") and len(chunk.encode("utf-8")) <= 64 for chunk in chunks)
+    assert list(read_csv_chunks(io.BytesIO(b""))) == [""]
+    # A row longer than a chunk is split, never a character
+    assert "".join(read_csv_chunks(io.BytesIO("ü".encode("utf-8") * 100), chunk_size=9)) == "ü" * 100
+
+
+def test_chunks_stop_at_max_size():
+    with pytest.raises(UploadTooLarge):
+        for _ in read_csv_chunks(io.BytesIO(b"a,b\n" * 100), chunk_size=16, max_size=100):
+            pass
+
+
+def test_small_upload_is_one_message(client, storage):
+    response = client.post("/swan", headers=HEADERS, data="a,b\n1,2")
+
+    assert response.get_json()["cmd"]["type"] == "get_cfg"
+    [message] = [data for _, data in messages(storage) if "csv_data" in data]
+    assert (message["csv_data"], message["imei"]) == ("a,b\n1,2", IMEI)
+    assert list(storage.stream("message_chunks")) == []
+
+
+def test_large_upload_is_chunked(client, storage, small_chunks):
+    csv = make_csv(40)
+
+    response = client.post("/swan", headers=HEADERS, data=csv.encode("utf-8"))
+
+    assert response.get_json()["cmd"]["type"] == "get_cfg"
+    [(message_id, message)] = [(id_, data) for id_, data in messages(storage) if "csv_chunks" in data]
+    assert message["imei"] == IMEI
+    assert message["csv_bytes"] == len(csv.encode("utf-8"))
+    assert message["csv_rows"] == 41
+    assert message["csv_chunks"] == len(list(storage.stream("message_chunks"))) > 1
+    assert db_utils.get_csv_message_data(message_id, message) == csv
+
+
+def test_oversized_upload_is_rejected(client, storage, monkeypatch):
+    monkeypatch.setattr(Config, "CSV_MAX_BODY_BYTES", 100)
+
+    response = client.post("/swan", headers=HEADERS, data=make_csv(40))
+
+    assert response.status_code == 413
+    assert messages(storage) == []
+    assert list(storage.stream("sessions")) == []
+
+
+def test_failed_upload_leaves_no_chunks(storage, small_chunks):
+    def chunks():
+        for n in range(10):
+            yield f"A{n}," + "x" * 40 + "\n"
+        raise UploadTooLarge(500)
+
+    with pytest.raises(UploadTooLarge):
+        db_utils.add_csv_message(chunks(), IMEI)
+
+    assert list(storage.stream("message_chunks")) == []
+    assert messages(storage) == []
+
+
+def test_asgi_rejects_oversized_body(storage, monkeypatch):
+    monkeypatch.setattr(Config, "CSV_MAX_BODY_BYTES", 100)
+    sent = []
+    parts = [b"a,b\n" * 20, b"a,b\n" * 20]
+
+    async def receive():
+        return {"type": "http.request", "body": parts.pop(0), "more_body": bool(parts)}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "method": "POST", "path": "/swan", "headers": [
+        (b"wep-imei", IMEI.encode()), (b"content-type", b"text/csv"),
+    ]}
+    asyncio.run(create_asgi_app(fallback=object())(scope, receive, send))
+
+    assert sent[0]["status"] == 413
+    assert "error" in json.loads(sent[1]["body"])
+    assert list(storage.stream("sessions")) == []
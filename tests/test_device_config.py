@@ -0,0 +1,65 @@
+from unittest.mock import patch
+
+import pytest
+
+from app.config import SWAN_DEFAULT_CONFIG
+from app.utils import db_utils
+from app.utils.db_utils import save_swan_device_config, unit_of_work
+
+
+IMEI = "123111111113"
+
+
+def test_first_report_creates_device(storage):
+    assert save_swan_device_config(IMEI, SWAN_DEFAULT_CONFIG) == "created"
+
+    device = storage.get("swan_devices", IMEI).to_dict()
+    assert device["config_hash"] == db_utils.device_config_hash(SWAN_DEFAULT_CONFIG)
+    assert device["nb1_bands"] == "3,8,20"
+
+
+def test_unchanged_report_is_not_written(storage):
+    save_swan_device_config(IMEI, SWAN_DEFAULT_CONFIG)
+
+    with patch.object(storage, "commit", wraps=storage.commit) as commit:
+        assert save_swan_device_config(IMEI, dict(SWAN_DEFAULT_CONFIG)) == "unchanged"
+    commit.assert_not_called()
+
+
+def test_report_after_another_write_is_persisted(storage):
+    save_swan_device_config(IMEI, SWAN_DEFAULT_CONFIG)
+    # Another worker, or the API, rewrote the document since the last report
+    db_utils.update_item_swan_devices_collection(IMEI, {"nb1_apn": "iot.example"})
+
+    assert save_swan_device_config(IMEI, dict(SWAN_DEFAULT_CONFIG)) == "updated"
+    assert storage.get("swan_devices", IMEI).to_dict()["nb1_apn"] == SWAN_DEFAULT_CONFIG["nb1_apn"]
+
+
+def test_changed_report_updates_only_changed_keys(storage):
+    save_swan_device_config(IMEI, SWAN_DEFAULT_CONFIG)
+    reported = {**SWAN_DEFAULT_CONFIG, "nb1_apn": "iot.example", "upload_jitter": 30}
+
+    with patch.object(storage, "commit", wraps=storage.commit) as commit:
+        with unit_of_work():
+            assert save_swan_device_config(IMEI, reported) == "updated"
+
+    commit.assert_called_once()
+    (op, collection, document_id, data), = [write for write in commit.call_args.args[0] if write[1] == "swan_devices"]
+    assert op == "update"
+    assert set(data) == {"nb1_apn", "upload_jitter", *db_utils.DEVICE_META_FIELDS}
+
+    history = [doc.to_dict() for doc in storage.stream("swan_device_config_history")]
+    assert history[-1]["changes"] == {
+        "nb1_apn": {"old": "", "new": "iot.example"},
+        "upload_jitter": {"old": 0, "new": 30},
+    }
+
+
+def test_failed_request_writes_nothing(storage):
+    with pytest.raises(RuntimeError):
+        with unit_of_work():
+            save_swan_device_config(IMEI, SWAN_DEFAULT_CONFIG)
+            raise RuntimeError("request failed")
+
+    assert not storage.get("swan_devices", IMEI).exists
+    assert save_swan_device_config(IMEI, SWAN_DEFAULT_CONFIG) == "created"
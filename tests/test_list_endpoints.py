@@ -0,0 +1,89 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from app import create_app
+from app.config import SWAN_DEFAULT_CONFIG
+
+
+@pytest.fixture
+def client():
+    app = create_app()
+    app.config['TESTING'] = True
+    with app.test_client() as client:
+        with app.app_context():
+            yield client
+
+
+@pytest.fixture
+def devices(storage):
+    for n in range(4):
+        storage.set("swan_devices", f"12311111111{n}", {
+            **SWAN_DEFAULT_CONFIG,
+            "upload_remote_port": 31031 + n,
+            "nb1_bands": "20" if n % 2 else "3,8,20",
+        })
+
+
+def test_get_swan_devices_projection(client, devices):
+    response = client.get("/get_swan_devices?fields=nb1_bands,upload_remote_port")
+    assert response.status_code == 200
+    assert response.get_json()[0] == {"123111111110": {"nb1_bands": "3,8,20", "upload_remote_port": 31031}}
+
+
+def test_get_swan_devices_filters(client, devices):
+    response = client.get("/get_swan_devices?fields=nb1_bands&nb1_bands=20")
+    assert [list(entry) for entry in response.get_json()] == [["123111111111"], ["123111111113"]]
+
+    response = client.get("/get_swan_devices?fields=upload_remote_port&upload_remote_port__gte=31033")
+    assert [list(entry) for entry in response.get_json()] == [["123111111112"], ["123111111113"]]
+
+    response = client.get("/get_swan_devices?fields=nb1_apn&upload_remote_port__in=31031&upload_remote_port__in=31034")
+    assert [list(entry) for entry in response.get_json()] == [["123111111110"], ["123111111113"]]
+
+
+def test_get_swan_devices_pages(client, devices):
+    response = client.get("/get_swan_devices?fields=&order_by=upload_remote_port&order=desc&limit=3")
+    assert [list(entry) for entry in response.get_json()] == [["123111111113"], ["123111111112"], ["123111111111"]]
+
+    cursor = response.headers["X-Next-Cursor"]
+    response = client.get(f"/get_swan_devices?fields=&order_by=upload_remote_port&order=desc&limit=3&start_after={cursor}")
+    assert [list(entry) for entry in response.get_json()] == [["123111111110"]]
+    assert "X-Next-Cursor" not in response.headers
+
+
+def test_get_sessions_filter_by_status(client, storage):
+    storage.set("sessions", "session_1", {"session_id": "session_1", "status": "sent get_cfg"})
+    storage.set("sessions", "session_2", {"session_id": "session_2", "status": "error"})
+
+    response = client.get("/get_sessions?status=error")
+    assert response.get_json() == [{"session_2": {"session_id": "session_2", "status": "error"}}]
+
+
+def test_listings_are_unpaged_without_limit(client, devices, monkeypatch):
+    monkeypatch.setattr("app.views.main.Config.MESSAGES_PAGE_SIZE", 3)
+    response = client.get("/get_swan_devices?fields=")
+    assert len(response.get_json()) == 4
+    assert "X-Next-Cursor" not in response.headers
+
+    response = client.get("/get_swan_devices?fields=&limit=3")
+    assert len(response.get_json()) == 3
+
+    response = client.get(f"/get_swan_devices?fields=&limit=3&start_after={response.headers['X-Next-Cursor']}")
+    assert [list(entry) for entry in response.get_json()] == [["123111111113"]]
+    assert "X-Next-Cursor" not in response.headers
+
+
+def test_get_sessions_filter_by_timestamp(client, storage):
+    start = datetime(2024, 5, 1, tzinfo=timezone.utc)
+    for n in range(3):
+        storage.set("sessions", f"session_{n}", {"session_id": f"session_{n}", "created_at": start + timedelta(hours=n)})
+
+    response = client.get("/get_sessions?fields=&created_at__lt=2024-05-01T01:30:00Z")
+    assert [list(entry) for entry in response.get_json()] == [["session_0"], ["session_1"]]
+    assert client.get("/get_sessions?created_at__lt=yesterday").status_code == 400
+
+
+def test_list_rejects_invalid_parameters(client):
+    assert client.get("/get_swan_devices?upload_remote_port=abc").status_code == 400
+    assert client.get("/get_swan_devices?nb1_bands__like=20").status_code == 400
+    assert client.get("/get_command_to_swan?fields=a.b").status_code == 400
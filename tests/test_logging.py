@@ -0,0 +1,103 @@
+import json
+import logging
+import logging.handlers
+import queue
+
+import pytest
+from app import create_app
+from app.log import ContextFilter, JSONFormatter, NonBlockingQueueHandler, RequestSampler
+
+
+@pytest.fixture
+def client():
+    app = create_app()
+    app.config['TESTING'] = True
+    with app.test_client() as client:
+        with app.app_context():
+            yield client
+
+
+@pytest.fixture
+def records():
+    # The app's pipeline, with a queue the test reads instead of a listener thread
+    handler = NonBlockingQueueHandler(queue.Queue())
+    handler.addFilter(ContextFilter())
+    logger = logging.getLogger("app.requests")
+    logger.addHandler(handler)
+    yield handler.queue
+    logger.removeHandler(handler)
+
+
+def test_request_record_carries_imei_session_and_latency(client, records):
+    headers = {"Wep-Imei": "123111111113", "Content-Type": "text/csv"}
+    response = client.post("/swan", headers=headers)
+    session_id = response.get_json()["cmd"]["id"]
+
+    entry = json.loads(JSONFormatter().format(records.get_nowait()))
+    assert entry["message"] == "POST /swan 200"
+    assert entry["imei"] == "123111111113"
+    assert entry["session_id"] == session_id
+    assert entry["route"] == "/swan"
+    assert entry["latency_ms"] >= 0
+
+
+def test_json_formatter_keeps_exceptions():
+    handler = NonBlockingQueueHandler(queue.Queue())
+    logger = logging.getLogger("test.json")
+    logger.addHandler(handler)
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        logger.exception("Failed %s", "step")
+    finally:
+        logger.removeHandler(handler)
+
+    entry = json.loads(JSONFormatter().format(handler.queue.get_nowait()))
+    assert entry["message"] == "Failed step"
+    assert "ValueError: boom" in entry["exception"]
+
+
+def test_full_queue_drops_instead_of_blocking():
+    handler = NonBlockingQueueHandler(queue.Queue(1))
+    record = logging.makeLogRecord({"msg": "x"})
+    handler.emit(record)
+    handler.emit(record)
+    assert handler.dropped == 1
+
+
+def test_request_sampler_rates():
+    sampler = RequestSampler("/swan=0, /api/commands=1", default=0.0)
+    assert not sampler.sampled("/swan")
+    assert sampler.sampled("/api/commands")
+    assert not sampler.sampled("/get_sessions")
+    assert RequestSampler(default=1.0).sampled("/get_sessions")
+
+
+def test_deferred_listener_starts_in_the_worker(monkeypatch):
+    from app import log
+    from app.config import Config
+
+    class DeferredConfig(Config):
+        LOG_FILE = ""
+        LOG_DEFER_LISTENER = True
+
+    for name in ("_listener", "_queue_handler", "_listener_pid"):
+        monkeypatch.setattr(log, name, None)
+    monkeypatch.setattr(log, "_listener_wanted", False)
+    root = logging.getLogger()
+    handlers, level = list(root.handlers), root.level
+    try:
+        log.configure_logging(DeferredConfig)
+        # The master writes records itself and runs no thread
+        assert log._listener._thread is None
+        assert log._queue_handler not in root.handlers
+        assert log._listener.handlers[0] in root.handlers
+
+        log.start_listener()
+        assert log._listener._thread.is_alive()
+        assert log._queue_handler in root.handlers
+        assert log._listener.handlers[0] not in root.handlers
+    finally:
+        log.stop_logging()
+        root.handlers[:] = handlers
+        root.setLevel(level)
@@ -0,0 +1,121 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from app import create_app
+from app.utils import db_utils
+from app.utils.message_archive import LocalBlobStore, MessageArchive, decode_partition
+
+START = datetime(2024, 5, 1, tzinfo=timezone.utc)
+NOW = START + timedelta(days=5)
+
+
+@pytest.fixture
+def archive(storage, tmp_path, monkeypatch):
+    archive = MessageArchive(storage, LocalBlobStore(str(tmp_path)), max_age=2 * 86400)
+    monkeypatch.setattr(db_utils, "message_archive", archive)
+    return archive
+
+
+@pytest.fixture
+def client():
+    app = create_app()
+    app.config['TESTING'] = True
+    with app.test_client() as client:
+        with app.app_context():
+            yield client
+
+
+@pytest.fixture
+def messages(storage):
+    # Two messages a day over five days, from 2024-05-01
+    for n in range(10):
+        storage.set("messages", f"message_{n}", {
+            "n": n,
+            "imei": "123111111113" if n % 2 == 0 else "123111111114",
+            "created_at": START + timedelta(hours=12 * n),
+        })
+
+
+def test_archive_moves_old_days_to_partitions(archive, storage, messages, tmp_path):
+    # Days before 2024-05-04 are archived, whole days only
+    assert archive.archive(NOW + timedelta(hours=6)) == {"partitions": 3, "messages": 6}
+
+    assert sorted(doc.id for doc in storage.stream("messages")) == [f"message_{n}" for n in range(6, 10)]
+    index = storage.get("message_partitions", "2024-05-02").to_dict()
+    assert index["blob"] == "messages/2024/05/02.ndjson.gz"
+    assert index["count"] == 2
+    documents = decode_partition((tmp_path / "messages" / "2024" / "05" / "02.ndjson.gz").read_bytes())
+    assert [(doc.id, doc.to_dict()["created_at"]) for doc in documents] == [
+        ("message_2", START + timedelta(days=1)),
+        ("message_3", START + timedelta(days=1, hours=12)),
+    ]
+
+
+def test_archive_merges_into_existing_partition(archive, storage, messages):
+    archive.archive(NOW)
+    storage.set("messages", "late", {"n": 99, "created_at": START + timedelta(hours=1)})
+
+    assert archive.archive(NOW) == {"partitions": 1, "messages": 1}
+    assert storage.get("message_partitions", "2024-05-01").to_dict()["count"] == 3
+
+
+def test_listing_reads_both_tiers(client, archive, messages):
+    archive.archive(NOW)
+
+    seen = []
+    cursor = None
+    while True:
+        response = client.get("/swan?limit=3" + (f"&start_after={cursor}" if cursor else ""))
+        seen.extend(message["n"] for message in response.get_json())
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            break
+    assert seen == list(range(9, -1, -1))
+
+    response = client.get("/swan?imei=123111111113&order=asc")
+    assert [message["n"] for message in response.get_json()] == [0, 2, 4, 6, 8]
+
+    response = client.get("/swan?since=2024-05-01T12:00:00Z&until=2024-05-04T00:00:00Z")
+    assert [message["n"] for message in response.get_json()] == [5, 4, 3, 2, 1]
+
+    response = client.get("/swan?format=ndjson&order=asc")
+    assert len(response.get_data(as_text=True).splitlines()) == 10
+
+
+def test_interrupted_archive_is_not_listed_twice(client, archive, storage, messages):
+    archive.archive(NOW)
+    # As if the pass had stopped before deleting the hot copy
+    storage.set("messages", "message_0", {"n": 0, "imei": "123111111113", "created_at": START})
+
+    response = client.get("/swan?order=asc")
+    assert [message["n"] for message in response.get_json()] == list(range(10))
+
+
+def test_newest_page_reads_no_partition(archive, storage, messages, monkeypatch):
+    archive.archive(NOW)
+    storage.set("messages", "recent", {"n": 10, "created_at": datetime.now(timezone.utc)})
+    started = []
+    query_archived = archive._query_archived
+
+    def track(*args):
+        started.append(True)
+        yield from query_archived(*args)
+
+    monkeypatch.setattr(archive, "_query_archived", track)
+
+    assert [doc.id for doc in archive.query(descending=True, limit=1)] == ["recent"]
+    assert not started
+    assert len(list(archive.query(descending=True, limit=5))) == 5
+    assert started
+
+
+def test_chunks_are_archived_with_their_message(archive, storage):
+    storage.set("messages", "upload", {"csv_chunks": 2, "csv_bytes": 8, "csv_rows": 2, "created_at": START})
+    for index, text in enumerate(["a,b\n", "c,d\n"]):
+        storage.set("message_chunks", f"upload-{index:05d}", {"message_id": "upload", "index": index, "csv_data": text})
+
+    archive.archive(NOW)
+
+    assert list(storage.stream("message_chunks")) == []
+    [message] = archive.query()
+    assert db_utils.get_csv_message_data(message.id, message.to_dict()) == "a,b\nc,d\n"
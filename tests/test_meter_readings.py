@@ -0,0 +1,180 @@
+import threading
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from app import create_app
+from app.config import Config
+from app.utils import db_utils
+from app.utils.meter_readings import MeterReadings, ReadingParser
+
+IMEI = "123111111113"
+HEADERS = {"Wep-Imei": IMEI, "Content-Type": "text/csv"}
+CSV = (
+    "meter_id,manufacturer,device_type,timestamp,rssi,value\n"
+    "12345678,KAM,water,1714521600,-80,10.5\n"
+    "12345678,KAM,water,2024-05-01T12:00:00Z,-82,11.0\n"
+    "12345678,KAM,water,2024-05-01T00:30:00+02:00,-79,11.25\n"
+    "87654321,DME,heat,1714608000,,300\n"
+    "bad,row\n"
+)
+
+
+@pytest.fixture(autouse=True)
+def synchronous_messages(monkeypatch):
+    monkeypatch.setattr(db_utils, "message_queue", None)
+
+
+@pytest.fixture
+def client():
+    app = create_app()
+    app.config['TESTING'] = True
+    with app.test_client() as client:
+        with app.app_context():
+            yield client
+
+
+def test_parser_reads_typed_rows_in_chunks():
+    parser = ReadingParser()
+    # Rows split across chunks, and no final newline
+    for start in range(0, len(CSV), 17):
+        parser.feed(CSV[start:start + 17])
+    parser.feed("87654321,DME,heat,1714608060,-90,301")
+    parser.close()
+
+    assert parser.rejected == 1
+    assert [reading["value"] for reading in parser.readings] == [10.5, 11.0, 11.25, 300.0, 301.0]
+    assert parser.readings[0] == {
+        "meter_id": "12345678",
+        "manufacturer": "KAM",
+        "device_type": "water",
+        "timestamp": datetime(2024, 5, 1, tzinfo=timezone.utc),
+        "rssi": -80,
+        "value": 10.5,
+    }
+    # Offsets are converted to UTC
+    assert parser.readings[2]["timestamp"] == datetime(2024, 4, 30, 22, 30, tzinfo=timezone.utc)
+    assert parser.readings[3]["rssi"] is None
+
+
+def test_parser_ignores_uploads_without_readings():
+    parser = ReadingParser()
+    parser.feed("a,b\n1,2\n")
+
+    assert (parser.readings, parser.rejected) == ([], 0)
+
+
+def test_readings_are_stored_per_meter_and_hour(storage):
+    readings = MeterReadings(storage)
+    parser = ReadingParser()
+    parser.feed(CSV)
+    readings.add(parser.readings, IMEI)
+    # A later upload of the same hour is merged, the last reading of a timestamp winning
+    later = parser.readings[1]["timestamp"] + timedelta(minutes=30)
+    readings.add([{**parser.readings[1], "value": 11.5, "rssi": -70}], "123111111114")
+    readings.add([{**parser.readings[1], "timestamp": later, "value": 11.75}], "123111111114")
+
+    assert sorted(doc.id for doc in storage.stream("meter_readings")) == [
+        "12345678|2024-04-30T22", "12345678|2024-05-01T00", "12345678|2024-05-01T12", "87654321|2024-05-02T00",
+    ]
+    hour = storage.get("meter_readings", "12345678|2024-05-01T12").to_dict()
+    assert [(entry["value"], entry["imei"]) for entry in hour["readings"]] == [
+        (11.5, "123111111114"), (11.75, "123111111114"),
+    ]
+    assert hour["hour"] == datetime(2024, 5, 1, 12, tzinfo=timezone.utc)
+    assert [reading["value"] for reading in readings.query("12345678")] == [11.25, 10.5, 11.5, 11.75]
+    assert readings.latest("12345678")["value"] == 11.75
+    assert readings.latest("1234567") is None
+
+
+def test_concurrent_uploads_of_one_meter_keep_every_reading(storage):
+    readings = MeterReadings(storage)
+    start = datetime(2024, 5, 1, tzinfo=timezone.utc)
+    uploads = [
+        [{"meter_id": "12345678", "manufacturer": "KAM", "device_type": "water", "rssi": None,
+          "timestamp": start + timedelta(seconds=n), "value": float(n)}]
+        for n in range(8)
+    ]
+    # As when several gateways hear the same meter
+    threads = [threading.Thread(target=readings.add, args=(upload, IMEI)) for upload in uploads]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert [reading["value"] for reading in readings.query("12345678")] == [float(n) for n in range(8)]
+
+
+def test_legacy_daily_documents_are_read(storage):
+    readings = MeterReadings(storage)
+    timestamp = datetime(2024, 5, 1, 6, tzinfo=timezone.utc)
+    storage.set("meter_readings", "12345678|2024-05-01", {
+        "key": "12345678|2024-05-01", "meter_id": "12345678", "manufacturer": "KAM", "device_type": "water",
+        "readings": [{"timestamp": timestamp, "value": 9.0, "rssi": None, "imei": IMEI}],
+    })
+
+    since = datetime(2024, 5, 1, 3, tzinfo=timezone.utc)
+    assert [reading["value"] for reading in readings.query("12345678", since=since)] == [9.0]
+
+
+def test_query_range_in_other_timezones(storage):
+    readings = MeterReadings(storage)
+    parser = ReadingParser()
+    parser.feed(CSV)
+    readings.add(parser.readings, IMEI)
+
+    # 2024-05-02T02:00Z, a UTC day later than the local one
+    until = datetime.fromisoformat("2024-05-01T21:00:00-05:00")
+    assert [reading["value"] for reading in readings.query("87654321", until=until)] == [300.0]
+    # 2024-04-30T20:00Z, a UTC day earlier than the local one
+    since = datetime.fromisoformat("2024-05-01T05:00:00+09:00")
+    assert [reading["value"] for reading in readings.query("12345678", since=since)] == [11.25, 10.5, 11.0]
+
+
+def test_upload_is_parsed_into_readings(client, storage):
+    response = client.post("/swan", headers=HEADERS, data=CSV)
+    assert response.get_json()["cmd"]["type"] == "get_cfg"
+    db_utils.meter_reading_writer.flush()
+
+    response = client.get("/api/meters/12345678/readings?since=2024-05-01T00:00:00Z&order=desc")
+    assert [(reading["timestamp"], reading["value"]) for reading in response.get_json()] == [
+        ("2024-05-01T12:00:00+00:00", 11.0),
+        ("2024-05-01T00:00:00+00:00", 10.5),
+    ]
+
+    response = client.get("/api/meters/87654321/readings/latest")
+    assert response.get_json() == {
+        "meter_id": "87654321", "manufacturer": "DME", "device_type": "heat",
+        "timestamp": "2024-05-02T00:00:00+00:00", "rssi": None, "value": 300.0, "imei": IMEI,
+    }
+
+
+def test_chunked_upload_is_parsed(client, storage, monkeypatch):
+    monkeypatch.setattr(Config, "CSV_CHUNK_BYTES", 64)
+    rows = "".join(f"{n:08d},1714521600,{n}\n" for n in range(50))
+
+    client.post("/swan", headers=HEADERS, data="meter,timestamp,value\n" + rows)
+    db_utils.meter_reading_writer.flush()
+
+    assert len(list(storage.stream("meter_readings"))) == 50
+
+
+def test_reading_endpoints_errors(client):
+    assert client.get("/api/meters/12345678/readings/latest").status_code == 404
+    assert client.get("/api/meters/12345678/readings?since=yesterday").status_code == 400
+    assert client.get("/api/meters/12345678/readings?order=up").status_code == 400
+
+
+def test_readings_are_stored_off_the_event_loop(storage, monkeypatch):
+    import asyncio
+
+    from app.views.swan_async import handle_swan_post_async
+
+    # Without its thread, the writer keeps the readings queued
+    db_utils.meter_reading_writer.stop()
+    monkeypatch.setattr(db_utils.meter_reading_writer, "start", lambda: None)
+    status = asyncio.run(handle_swan_post_async({"wep-imei": IMEI, "content-type": "text/csv"}, CSV.encode("utf-8")))[1]
+
+    assert status == 200
+    assert not storage.get("meter_readings", "87654321|2024-05-02T00").exists
+    db_utils.meter_reading_writer.flush()
+    assert storage.get("meter_readings", "87654321|2024-05-02T00").exists
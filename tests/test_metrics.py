@@ -0,0 +1,126 @@
+import base64
+import json
+
+import pytest
+from app import create_app
+from app.config import SWAN_DEFAULT_CONFIG
+from app.storage.instrumented import InstrumentedStorage
+from app.storage.memory import MemoryStorage
+from app.utils.metrics import (
+    HANDSHAKE_STATUS, HANDSHAKE_STEP_SECONDS, STORAGE_CALLS, Registry, SharedMetrics,
+)
+
+
+@pytest.fixture
+def client():
+    app = create_app()
+    app.config['TESTING'] = True
+    with app.test_client() as client:
+        with app.app_context():
+            yield client
+
+
+def test_registry_renders_prometheus_text():
+    registry = Registry()
+    counter = registry.counter("jobs", "Jobs run.", ("kind",))
+    histogram = registry.histogram("job_seconds", "Job time.", buckets=(0.1, 1.0))
+    counter.inc(kind='a"b')
+    histogram.observe(0.5)
+    histogram.observe(2.0)
+
+    assert registry.render().splitlines() == [
+        "# HELP jobs_total Jobs run.",
+        "# TYPE jobs_total counter",
+        'jobs_total{kind="a\\"b"} 1',
+        "# HELP job_seconds Job time.",
+        "# TYPE job_seconds histogram",
+        'job_seconds_bucket{le="0.1"} 0',
+        'job_seconds_bucket{le="1"} 1',
+        'job_seconds_bucket{le="+Inf"} 2',
+        "job_seconds_count 2",
+        "job_seconds_sum 2.5",
+    ]
+
+
+def test_handshake_metrics(client, storage):
+    headers = {"Wep-Imei": "123111111113", "Content-Type": "application/json"}
+    storage.set("sessions", "session_123111111113_1", {"status": "sent get_cfg"})
+    content = base64.b64encode(json.dumps(SWAN_DEFAULT_CONFIG).encode("utf-8")).decode("ascii")
+    payload = {"cmd_res": {"type": "get_cfg", "id": "session_123111111113_1", "res_code": 0, "content": content}}
+
+    steps = HANDSHAKE_STEP_SECONDS.count(type="get_cfg", res_code=0)
+    returned = HANDSHAKE_STATUS.value(status="returned to Galooli")
+    commits = STORAGE_CALLS.value(collection="sessions", operation="commit")
+    client.post("/swan", headers=headers, json=payload)
+
+    assert HANDSHAKE_STEP_SECONDS.count(type="get_cfg", res_code=0) == steps + 1
+    assert HANDSHAKE_STATUS.value(status="returned to Galooli") == returned + 1
+    assert STORAGE_CALLS.value(collection="sessions", operation="commit") == commits + 1
+
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.content_type.startswith("text/plain; version=0.0.4")
+    text = response.get_data(as_text=True)
+    assert 'swan_http_request_duration_seconds_count{method="POST",route="/swan",status="200"}' in text
+    assert 'swan_storage_operation_duration_seconds_count{collection="swan_devices",operation="get"}' in text
+
+
+def test_instrumented_storage_reports_round_trips():
+    observed = []
+    storage = InstrumentedStorage(MemoryStorage(), [lambda *args: observed.append(args)])
+    storage.commit([
+        ("set", "sessions", "1", {"a": 1}),
+        ("set", "sessions", "2", {"a": 2}),
+        ("delete", "messages", "3", None),
+    ])
+    list(storage.query("sessions", filters=[("a", ">", 0)]))
+    with pytest.raises(Exception):
+        storage.update("sessions", "missing", {"a": 1})
+
+    assert [(operation, counts) for operation, counts, _, _ in observed] == [
+        ("commit", {"sessions": {"writes": 2, "deletes": 0}, "messages": {"writes": 0, "deletes": 1}}),
+        ("query", {"sessions": {"reads": 2}}),
+        ("commit", {"sessions": {"writes": 1, "deletes": 0}}),
+    ]
+    assert observed[-1][3] is not None
+
+
+def worker_registry():
+    registry = Registry()
+    counter = registry.counter("jobs", "Jobs run.")
+    gauge = registry.gauge("queue_depth", "Queued jobs.")
+    histogram = registry.histogram("job_seconds", "Job time.", buckets=(1.0,))
+    return registry, counter, gauge, histogram
+
+
+def test_shared_metrics_sum_every_process(tmp_path, monkeypatch):
+    # Two workers, simulated with two registries and two process IDs
+    first, first_jobs, first_depth, first_seconds = worker_registry()
+    second, second_jobs, second_depth, second_seconds = worker_registry()
+    first_jobs.inc(2)
+    first_depth.set(3)
+    first_seconds.observe(0.5)
+    second_jobs.inc(5)
+    second_depth.set(4)
+    second_seconds.observe(2.0)
+
+    monkeypatch.setattr("app.utils.metrics.os.getpid", lambda: 1001)
+    SharedMetrics(first, str(tmp_path)).sync()
+    monkeypatch.setattr("app.utils.metrics.os.getpid", lambda: 1002)
+    monkeypatch.setattr("app.utils.metrics._is_running", lambda pid: True)
+    shared = SharedMetrics(second, str(tmp_path))
+
+    lines = shared.render().splitlines()
+    assert "jobs_total 7" in lines
+    assert "queue_depth 7" in lines
+    assert 'job_seconds_bucket{le="1"} 1' in lines
+    assert "job_seconds_count 2" in lines
+
+    # A worker that exits keeps its counts in the totals, but not its gauges
+    monkeypatch.setattr("app.utils.metrics.os.getpid", lambda: 1001)
+    SharedMetrics(first, str(tmp_path)).retire()
+    monkeypatch.setattr("app.utils.metrics.os.getpid", lambda: 1002)
+    lines = shared.render().splitlines()
+    assert "jobs_total 7" in lines
+    assert "queue_depth 4" in lines
+    assert sorted(path.name for path in tmp_path.glob("*.json")) == ["retired.json"]
@@ -0,0 +1,92 @@
+import asyncio
+import base64
+import json
+from unittest.mock import patch
+
+import pytest
+from app import create_app
+from app.config import SWAN_DEFAULT_CONFIG
+from app.utils.replay_cache import ReplayCache, replay_key
+from app.utils.round_trips import count_round_trips
+from app.views.swan_async import handle_swan_post_async
+
+IMEI = "123111111113"
+SESSION_ID = f"session_{IMEI}_1"
+
+
+@pytest.fixture
+def client():
+    app = create_app()
+    app.config['TESTING'] = True
+    with app.test_client() as client:
+        with app.app_context():
+            yield client
+
+
+def get_cfg(config=SWAN_DEFAULT_CONFIG):
+    content = base64.b64encode(json.dumps(config).encode("utf-8")).decode("ascii")
+    return {"cmd_res": {"type": "get_cfg", "id": SESSION_ID, "res_code": 0, "content": content}}
+
+
+def test_retransmission_is_replayed(client, storage):
+    storage.set("sessions", SESSION_ID, {"status": "sent get_cfg"})
+    storage.set("command_to_swan", f"update-{IMEI}", {"nb1_apn": "iot"})
+    headers = {"Wep-Imei": IMEI}
+
+    first = client.post("/swan", headers=headers, json=get_cfg())
+    with count_round_trips() as tally:
+        retry = client.post("/swan", headers=headers, json=get_cfg())
+
+    assert first.get_json()["cmd"]["content"] == '{"nb1_apn":"iot"}'
+    assert (retry.status_code, retry.get_json()) == (first.status_code, first.get_json())
+    assert tally.round_trips == 0
+
+
+def test_different_body_is_handled(client, storage):
+    storage.set("sessions", SESSION_ID, {"status": "sent get_cfg"})
+    headers = {"Wep-Imei": IMEI}
+    client.post("/swan", headers=headers, json=get_cfg())
+
+    with patch.object(storage, "commit", wraps=storage.commit) as commit:
+        client.post("/swan", headers=headers, json=get_cfg({**SWAN_DEFAULT_CONFIG, "nb1_apn": "other"}))
+
+    commit.assert_called_once()
+
+
+def test_async_retransmission_is_replayed(storage):
+    storage.set("sessions", SESSION_ID, {"status": "sent get_cfg"})
+    headers = {"wep-imei": IMEI, "content-type": "application/json"}
+    body = json.dumps(get_cfg()).encode("utf-8")
+
+    first = asyncio.run(handle_swan_post_async(headers, body))
+    with patch.object(storage, "commit", wraps=storage.commit) as commit:
+        retry = asyncio.run(handle_swan_post_async(headers, body))
+
+    assert retry == first
+    commit.assert_not_called()
+
+
+def test_shared_store(tmp_path):
+    path = str(tmp_path / "replays.db")
+    key = replay_key(IMEI, get_cfg(), b"body")
+    ReplayCache(path=path).put(key, {"cmd": {"type": "set_cfg"}}, 200)
+
+    # Another worker, with an empty cache of its own
+    assert ReplayCache(path=path).get(key) == ({"cmd": {"type": "set_cfg"}}, 200)
+    assert ReplayCache(path=path).get(replay_key(IMEI, get_cfg(), b"other")) is None
+
+
+def test_only_last_result_is_replayed():
+    cache = ReplayCache()
+    first = replay_key(IMEI, get_cfg(), b"get_cfg")
+    cache.put(first, {"cmd": {"type": "set_cfg"}}, 200)
+    cache.put(replay_key(IMEI, get_cfg(), b"set_cfg"), {"cmd": {"type": "get_cfg"}}, 200)
+
+    # The same get_cfg, posted again later in the handshake
+    assert cache.get(first) is None
+
+
+def test_replay_key():
+    assert replay_key(None, get_cfg(), b"body") is None
+    assert replay_key(IMEI, {"meter": 1}, b"body") is None
+    assert replay_key(IMEI, get_cfg(), b"a") != replay_key(IMEI, get_cfg(), b"b")
@@ -0,0 +1,167 @@
+import asyncio
+import base64
+import json
+
+import pytest
+from app import create_app
+from app.asgi import handle_swan
+from app.config import Config, SWAN_DEFAULT_CONFIG
+from app.utils import db_utils
+from app.utils.round_trips import HEADER, RoundTrips, count_round_trips
+from app.views.swan_async import handle_swan_post_async
+
+IMEI = "123111111113"
+SESSION_ID = f"session_{IMEI}_1"
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(Config, "ROUND_TRIP_HEADER", True)
+    app = create_app()
+    app.config['TESTING'] = True
+    # Budgets are for warm processes: load the command index and the default profile
+    if db_utils.command_index is not None:
+        db_utils.command_index.get(f"update-{IMEI}")
+    db_utils.resolve_config_profile("default")
+    with app.test_client() as client:
+        with app.app_context():
+            yield client
+
+
+def cmd_res(type, res_code=0, config=SWAN_DEFAULT_CONFIG):
+    result = {"type": type, "id": SESSION_ID, "res_code": res_code}
+    if type == "get_cfg":
+        result["content"] = base64.b64encode(json.dumps(config).encode("utf-8")).decode("ascii")
+    return {"cmd_res": result}
+
+
+def round_trips(response):
+    return dict(item.split("=") for item in response.headers[HEADER].split(";"))
+
+
+def within_budget(response, round_trips_budget, **document_budgets):
+    tally = {key: int(value) for key, value in round_trips(response).items()}
+    assert tally["round_trips"] <= round_trips_budget, tally
+    for kind, budget in document_budgets.items():
+        assert tally[kind] <= budget, tally
+
+
+# Handshake branches: (setup, request kwargs, round trips, document budgets)
+HANDSHAKE_BUDGETS = {
+    "upload": (
+        {},
+        {"headers": {"Wep-Imei": IMEI, "Content-Type": "text/csv"}, "data": "a,b\n1,2"},
+        1, {"reads": 0, "writes": 1},
+    ),
+    "get_cfg without command": (
+        {"sessions": {SESSION_ID: {"status": "sent get_cfg"}}},
+        {"headers": {"Wep-Imei": IMEI}, "json": cmd_res("get_cfg")},
+        3, {"reads": 2, "writes": 3},
+    ),
+    "get_cfg with command": (
+        {"sessions": {SESSION_ID: {"status": "sent get_cfg"}}, "command_to_swan": {f"update-{IMEI}": {"nb1_apn": "iot"}}},
+        {"headers": {"Wep-Imei": IMEI}, "json": cmd_res("get_cfg")},
+        3, {"reads": 2, "writes": 3},
+    ),
+    "set_cfg": (
+        {"sessions": {SESSION_ID: {"status": "sent set_cfg"}}},
+        {"headers": {"Wep-Imei": IMEI}, "json": cmd_res("set_cfg")},
+        1, {"reads": 1, "writes": 0},
+    ),
+    "error": (
+        {"sessions": {SESSION_ID: {"status": "sent set_cfg"}}},
+        {"headers": {"Wep-Imei": IMEI}, "json": cmd_res("set_cfg", res_code=1)},
+        2, {"reads": 1, "writes": 1},
+    ),
+}
+
+
+@pytest.mark.parametrize("branch", HANDSHAKE_BUDGETS)
+def test_handshake_round_trip_budget(client, storage, branch):
+    documents, request, budget, document_budgets = HANDSHAKE_BUDGETS[branch]
+    for collection, items in documents.items():
+        for document_id, data in items.items():
+            storage.set(collection, document_id, data)
+
+    response = client.post("/swan", **request)
+
+    assert response.status_code in (200, 400)
+    within_budget(response, budget, **document_budgets)
+
+
+@pytest.mark.parametrize("method, url, kwargs, budget", [
+    ("get", f"/add/swan/{IMEI}", {}, 2),
+    ("get", f"/get_swan_device/{IMEI}", {}, 1),
+    # The version markers of the devices and profiles for the listing's ETag, then the listing
+    ("get", "/get_swan_devices", {}, 3),
+    ("post", f"/add/command_to_swan/{IMEI}", {"json": {"nb1_apn": "iot"}}, 1),
+    ("delete", f"/delete/command_to_swan/{IMEI}", {}, 1),
+    ("delete", f"/delete/swan/{IMEI}", {}, 2),
+])
+def test_endpoint_round_trip_budget(client, storage, method, url, kwargs, budget):
+    storage.set("swan_devices", IMEI, {"profile": "default"})
+    storage.set("command_to_swan", f"update-{IMEI}", {"nb1_apn": "iot"})
+    # A warm process finds the profiles' version marker in place
+    db_utils.get_collection_version("config_profiles")
+
+    response = getattr(client, method)(url, **kwargs)
+
+    assert response.status_code < 400
+    within_budget(response, budget)
+
+
+def test_bulk_writes_are_counted(client, monkeypatch):
+    monkeypatch.setattr(Config, "BULK_BATCH_SIZE", 2)
+    imeis = [f"1231111111{n:02d}" for n in range(5)]
+
+    response = client.post("/api/commands", json={"imeis": imeis, "config": {"nb1_apn": "iot"}})
+
+    assert response.status_code == 200
+    # Version markers are written behind the request
+    assert round_trips(response) == {"round_trips": "3", "reads": "0", "writes": "5", "deletes": "0"}
+
+
+def test_header_disabled_by_default(storage):
+    app = create_app()
+    response = app.test_client().get(f"/get_swan_device/{IMEI}")
+
+    assert HEADER not in response.headers
+
+
+def test_count_round_trips_outside_requests(client, storage):
+    storage.set("sessions", SESSION_ID, {"status": "sent get_cfg"})
+
+    with count_round_trips() as tally:
+        payload, status = asyncio.run(handle_swan_post_async(
+            {"wep-imei": IMEI, "content-type": "application/json"},
+            json.dumps(cmd_res("get_cfg")).encode("utf-8"),
+        ))
+
+    assert status == 200
+    assert tally.round_trips <= 3, tally
+    assert [operation for operation, _ in tally.operations].count("commit") == 1
+
+
+def test_asgi_header(storage, monkeypatch):
+    monkeypatch.setattr(Config, "ROUND_TRIP_HEADER", True)
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"a,b\n1,2"}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"headers": [(b"wep-imei", IMEI.encode()), (b"content-type", b"text/csv")]}
+    asyncio.run(handle_swan(handle_swan_post_async, scope, receive, send))
+
+    assert (HEADER.lower().encode(), b"round_trips=1;reads=0;writes=1;deletes=0") in sent[0]["headers"]
+
+
+def test_tally():
+    tally = RoundTrips()
+    tally.add("get", {"sessions": {"reads": 1}})
+    tally.add("commit", {"sessions": {"writes": 2, "deletes": 0}, "messages": {"writes": 0, "deletes": 1}})
+
+    assert tally.header() == "round_trips=2;reads=1;writes=2;deletes=1"
+    assert tally.operations == [("get", ("sessions",)), ("commit", ("sessions", "messages"))]
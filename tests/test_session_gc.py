@@ -0,0 +1,107 @@
+import os
+from datetime import datetime, timedelta, timezone
+
+from app.utils.db_utils import set_item_session_collection, update_item_session_collection
+from app.utils.lease import Lease
+from app.utils.session_gc import SessionCompactor
+
+NOW = datetime(2024, 6, 1, 12, 0, tzinfo=timezone.utc)
+
+
+def add_session(storage, session_id, status, age):
+    storage.set("sessions", session_id, {"status": status, "updated_at": NOW - timedelta(seconds=age)})
+
+
+def test_sessions_are_stamped(storage):
+    set_item_session_collection("session_1", {"status": "created"})
+    created = storage.get("sessions", "session_1").to_dict()
+    update_item_session_collection("session_1", {"status": "sent get_cfg"})
+    updated = storage.get("sessions", "session_1").to_dict()
+
+    assert created["expires_at"] > created["created_at"] == created["updated_at"]
+    assert updated["created_at"] == created["created_at"]
+    assert updated["updated_at"] >= created["updated_at"]
+
+
+def test_compactor_deletes_finished_sessions(storage):
+    add_session(storage, "old_done", "returned to Galooli", age=7200)
+    add_session(storage, "old_error", "error", age=7200)
+    add_session(storage, "recent_done", "returned to Galooli", age=60)
+    add_session(storage, "in_progress", "sent get_cfg", age=60)
+    compactor = SessionCompactor(storage, retention=3600, stuck_after=600, batch_size=1)
+
+    assert compactor.run_once(NOW) == {"timed_out": 0, "deleted": 2}
+    assert sorted(doc.id for doc in storage.stream("sessions")) == ["in_progress", "recent_done"]
+
+
+def test_compactor_archives_finished_sessions(storage):
+    add_session(storage, "old_done", "returned to Galooli", age=7200)
+    compactor = SessionCompactor(storage, retention=3600, archive_collection="sessions_archive")
+
+    assert compactor.run_once(NOW) == {"timed_out": 0, "archived": 1}
+    assert not storage.get("sessions", "old_done").exists
+    assert storage.get("sessions_archive", "old_done").to_dict()["status"] == "returned to Galooli"
+
+
+def test_compactor_times_out_stuck_sessions(storage):
+    add_session(storage, "stuck", "sent set_cfg", age=7200)
+    add_session(storage, "in_progress", "sent get_cfg", age=60)
+    compactor = SessionCompactor(storage, retention=86400, stuck_after=3600)
+
+    assert compactor.run_once(NOW) == {"timed_out": 1, "deleted": 0}
+    stuck = storage.get("sessions", "stuck").to_dict()
+    assert stuck["status"] == "error"
+    assert stuck["error_reason"] == "Timed out in status 'sent set_cfg'"
+    assert stuck["updated_at"] == NOW
+    # Resolved sessions are kept for the retention period like any other errored session
+    assert compactor.run_once(NOW + timedelta(days=2))["deleted"] == 1
+
+
+def test_compactor_backfills_legacy_sessions(storage):
+    storage.set("sessions", "legacy_done", {"status": "returned to Galooli"})
+    storage.set("sessions", "legacy_stuck", {"status": "sent get_cfg"})
+    compactor = SessionCompactor(storage, retention=3600, stuck_after=600, ttl=86400)
+
+    # Legacy sessions get their document's update time, long before the pass
+    later = datetime.now(timezone.utc) + timedelta(days=1)
+    assert compactor.run_once(later) == {"timed_out": 1, "deleted": 1}
+    stuck = storage.get("sessions", "legacy_stuck").to_dict()
+    assert stuck["status"] == "error"
+    assert stuck["expires_at"] == stuck["created_at"] + timedelta(seconds=86400)
+    assert storage.get("migrations", "sessions-timestamps").exists
+
+
+def test_compactor_skips_sessions_updated_since_the_query(storage):
+    add_session(storage, "finishing", "sent set_cfg", age=7200)
+
+    class FinishedDuringPass:
+        # The device finishes its session between the compactor's query and its write
+        def __getattr__(self, name):
+            return getattr(storage, name)
+
+        def query(self, *args, **kwargs):
+            documents = list(storage.query(*args, **kwargs))
+            storage.update("sessions", "finishing", {"status": "returned to Galooli", "updated_at": NOW})
+            return documents
+
+    compactor = SessionCompactor(FinishedDuringPass(), retention=86400, stuck_after=3600)
+
+    assert compactor.run_once(NOW) == {"timed_out": 0, "deleted": 0}
+    assert storage.get("sessions", "finishing").to_dict()["status"] == "returned to Galooli"
+
+
+def test_lease_is_held_by_one_process(storage):
+    first = Lease(storage, "session-compactor", ttl=60)
+    second = Lease(storage, "session-compactor", ttl=60)
+    # Stands in for a lease taken in another worker process
+    second._pid, second._holder = os.getpid(), "another-worker"
+
+    assert first.acquire(NOW)
+    assert not second.acquire(NOW + timedelta(seconds=30))
+    assert first.acquire(NOW + timedelta(seconds=30))
+    # An expired lease goes to whoever asks next
+    assert second.acquire(NOW + timedelta(seconds=120))
+    first.release()
+    assert storage.get("leases", "session-compactor").to_dict()["holder"] == "another-worker"
+    second.release()
+    assert not storage.get("leases", "session-compactor").exists
@@ -0,0 +1,59 @@
+import random
+
+import pytest
+from app import create_app
+from app.utils.simulator import (
+    AppTransport, arrival_offsets, create_fleet, percentile, queue_commands, run_fleet,
+)
+
+
+@pytest.fixture
+def transport():
+    app = create_app()
+    app.config['TESTING'] = True
+    return AppTransport(app)
+
+
+def test_fleet_check_ins(transport, storage):
+    devices = create_fleet(20, bursts=2, jitter=0)
+    queue_commands(transport, devices[:5], 1.0, {"nb1_apn": "simulated"})
+
+    summary = run_fleet(transport, devices, arrival_offsets(devices, burst_interval=0.0), concurrency=8)
+
+    assert summary["handshakes"] == 20
+    assert summary["error_rate"] == 0
+    assert summary["steps"]["upload"]["count"] == 20
+    assert summary["p50"] <= summary["p99"]
+    # Devices with a command applied it during the handshake
+    assert [device.config["nb1_apn"] for device in devices[:6]] == ["simulated"] * 5 + [""]
+    assert storage.get("swan_devices", devices[0].imei).to_dict()["nb1_apn"] == "simulated"
+
+
+def test_failed_check_ins_are_counted(storage):
+    class FailingTransport:
+        def post(self, path, headers, body):
+            return 500, {"error": "Internal server error"}
+
+    devices = create_fleet(3)
+    summary = run_fleet(FailingTransport(), devices, [0.0] * 3)
+
+    assert summary["handshakes"] == 0
+    assert summary["error_rate"] == 1.0
+    assert summary["error_messages"] == [("upload: HTTP 500", 3)]
+
+
+def test_arrival_offsets():
+    devices = create_fleet(100, bursts=3, jitter=10)
+    offsets = arrival_offsets(devices, "burst", burst_interval=60.0, rng=random.Random(1))
+
+    for device, offset in zip(devices, offsets):
+        start = device.config["upload_start_hour"] * 60.0
+        assert start <= offset <= start + 10
+
+    assert all(0 <= offset <= 5 for offset in arrival_offsets(devices, "uniform", duration=5))
+
+
+def test_percentile():
+    assert percentile(list(range(1, 101)), 0.5) == 50
+    assert percentile(list(range(1, 101)), 0.99) == 99
+    assert percentile([], 0.5) is None
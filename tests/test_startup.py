@@ -0,0 +1,34 @@
+import subprocess
+import sys
+from pathlib import Path
+
+from app.config import Config
+from app.utils.startup import measure_startup, parse_importtime
+
+
+def test_parse_importtime():
+    output = "\n".join([
+        "import time: self [us] | cumulative | imported package",
+        "import time:       120 |        120 |   json.decoder",
+        "import time:       300 |        420 | json",
+    ])
+    assert parse_importtime(output) == [("  json.decoder", 120, 120), ("json", 300, 420)]
+
+
+def test_startup_within_budget():
+    result = measure_startup("/index", env={"STORAGE_BACKEND": "memory"})
+
+    assert result["status"] == 200
+    assert result["startup_seconds"] < Config.STARTUP_BUDGET_SECONDS, result["imports"]
+
+
+def test_create_app_does_not_load_firestore():
+    # Nothing connects to Firestore, or imports its client library, before first use
+    code = "import sys; from app import create_app; create_app(); print('google.cloud.firestore' in sys.modules)"
+    process = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=Path(__file__).resolve().parent.parent,
+        env={"STORAGE_BACKEND": "firestore", "PATH": ""}, capture_output=True, text=True,
+    )
+    assert process.returncode == 0, process.stderr
+    assert process.stdout.strip().splitlines()[-1] == "False"
@@ -0,0 +1,118 @@
+import threading
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from app.storage import DocumentNotFound
+from app.storage.memory import MemoryStorage
+from app.storage.sqlite import SQLiteStorage
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def backend(request, tmp_path):
+    if request.param == "memory":
+        yield MemoryStorage()
+    else:
+        sqlite_storage = SQLiteStorage(str(tmp_path / "swan.db"))
+        yield sqlite_storage
+        sqlite_storage.close()
+
+
+def test_set_get_update_delete(backend):
+    assert not backend.get("swan_devices", "1").exists
+
+    backend.set("swan_devices", "1", {"nb1_apn": "iot", "nb1_bands": "3,8,20"})
+    backend.update("swan_devices", "1", {"nb1_bands": "20"})
+    document = backend.get("swan_devices", "1")
+    assert document.exists
+    assert document.id == "1"
+    assert document.to_dict() == {"nb1_apn": "iot", "nb1_bands": "20"}
+
+    backend.delete("swan_devices", "1")
+    assert not backend.get("swan_devices", "1").exists
+
+
+def test_update_missing_document_raises(backend):
+    with pytest.raises(DocumentNotFound):
+        backend.update("sessions", "missing", {"status": "error"})
+
+
+def test_commit_is_atomic(backend):
+    backend.set("sessions", "a", {"status": "created"})
+    with pytest.raises(DocumentNotFound):
+        backend.commit([
+            ("update", "sessions", "a", {"status": "sent get_cfg"}),
+            ("update", "sessions", "missing", {"status": "sent get_cfg"}),
+        ])
+    assert backend.get("sessions", "a").to_dict() == {"status": "created"}
+
+
+def test_concurrent_transactions_do_not_lose_updates(backend):
+    backend.set("counters", "a", {"n": 0})
+
+    def increment(transaction):
+        count = transaction.get("counters", "a").to_dict()["n"]
+        transaction.update("counters", "a", {"n": count + 1})
+
+    def run():
+        for _ in range(20):
+            backend.transaction(increment)
+
+    threads = [threading.Thread(target=run) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert backend.get("counters", "a").to_dict() == {"n": 80}
+
+
+def test_failed_transaction_writes_nothing(backend):
+    def fail(transaction):
+        transaction.set("sessions", "a", {"status": "created"})
+        raise RuntimeError("aborted")
+
+    with pytest.raises(RuntimeError):
+        backend.transaction(fail)
+    assert not backend.get("sessions", "a").exists
+    assert backend.transaction(lambda transaction: transaction.get_all("sessions", ["a"]))[0].exists is False
+
+
+def test_add_and_stream(backend):
+    first = backend.add("messages", {"n": 1})
+    second = backend.add("messages", {"n": 2})
+    backend.set("sessions", "a", {"status": "created"})
+
+    documents = {document.id: document.to_dict() for document in backend.stream("messages")}
+    assert documents == {first: {"n": 1}, second: {"n": 2}}
+
+
+def test_query_filters_orders_and_pages(backend):
+    start = datetime(2024, 5, 1, tzinfo=timezone.utc)
+    for n in range(5):
+        backend.set("messages", f"m{n}", {"n": n, "imei": str(n % 2), "created_at": start + timedelta(minutes=n)})
+    backend.set("messages", "legacy", {"n": 99, "imei": "0"})
+
+    def ids(documents):
+        return [document.id for document in documents]
+
+    assert ids(backend.query("messages", order_by="created_at", descending=True)) == ["m4", "m3", "m2", "m1", "m0"]
+    assert ids(backend.query("messages", filters=[("imei", "==", "0")], order_by="created_at")) == ["m0", "m2", "m4"]
+    assert ids(backend.query("messages", filters=[("created_at", ">=", start + timedelta(minutes=3))], order_by="created_at")) == ["m3", "m4"]
+    assert ids(backend.query("messages", filters=[("n", "in", [1, 99])])) == ["legacy", "m1"]
+
+    page = list(backend.query("messages", order_by="created_at", limit=2))
+    assert ids(page) == ["m0", "m1"]
+    cursor = (page[-1].to_dict()["created_at"], page[-1].id)
+    assert ids(backend.query("messages", order_by="created_at", limit=2, start_after=cursor)) == ["m2", "m3"]
+    assert backend.get("messages", "m0").to_dict()["created_at"] == start
+
+
+def test_query_select(backend):
+    created_at = datetime(2024, 5, 1, tzinfo=timezone.utc)
+    backend.set("swan_devices", "1", {"nb1_apn": "iot", "nb1_bands": "20", "created_at": created_at})
+    backend.set("swan_devices", "2", {"nb1_bands": "3,8,20"})
+
+    documents = list(backend.query("swan_devices", select=["nb1_apn", "created_at"]))
+    assert [document.to_dict() for document in documents] == [{"nb1_apn": "iot", "created_at": created_at}, {}]
+    documents = list(backend.query("swan_devices", select=["nb1_bands"]))
+    assert [document.to_dict() for document in documents] == [{"nb1_bands": "20"}, {"nb1_bands": "3,8,20"}]
@@ -0,0 +1,127 @@
+import asyncio
+import base64
+import json
+from unittest.mock import MagicMock, patch
+
+from app.asgi import create_asgi_app
+from app.config import SWAN_DEFAULT_CONFIG
+from app.views.swan_async import handle_swan_post_async
+
+
+def get_cfg_body(config, session_id="session_123111111113_1"):
+    return json.dumps({
+        "cmd_res": {
+            "type": "get_cfg",
+            "id": session_id,
+            "res_code": 0,
+            "content": base64.b64encode(json.dumps(config).encode("utf-8")).decode("ascii")
+        }
+    }).encode("utf-8")
+
+
+def test_async_csv_post_creates_session(storage):
+    headers = {"wep-imei": "123111111113", "content-type": "text/csv"}
+    payload, status = asyncio.run(handle_swan_post_async(headers, b"a,b\n1,2"))
+
+    assert status == 200
+    assert payload["cmd"]["type"] == "get_cfg"
+    assert storage.get("sessions", payload["cmd"]["id"]).to_dict()["status"] == "sent get_cfg"
+
+
+def test_async_get_cfg_commits_one_batch(storage):
+    storage.set("sessions", "session_123111111113_1", {"status": "sent get_cfg"})
+    storage.set("command_to_swan", "update-123111111113", {"nb1_apn": "iot"})
+    headers = {"wep-imei": "123111111113", "content-type": "application/json"}
+
+    with patch.object(storage, "commit", wraps=storage.commit) as commit:
+        payload, status = asyncio.run(handle_swan_post_async(headers, get_cfg_body(SWAN_DEFAULT_CONFIG)))
+
+    assert status == 200
+    assert payload["cmd"]["content"] == '{"nb1_apn":"iot"}'
+    commit.assert_called_once()
+    assert storage.get("sessions", "session_123111111113_1").to_dict()["status"] == "sent set_cfg"
+    assert storage.get("swan_devices", "123111111113").exists
+    assert not storage.get("command_to_swan", "update-123111111113").exists
+
+
+def test_concurrent_check_ins(storage):
+    imeis = [f"1231111111{n:02d}" for n in range(20)]
+    for imei in imeis:
+        storage.set("sessions", f"session_{imei}_1", {"status": "sent get_cfg"})
+
+    async def check_in_all():
+        return await asyncio.gather(*(
+            handle_swan_post_async(
+                {"wep-imei": imei, "content-type": "application/json"},
+                get_cfg_body(SWAN_DEFAULT_CONFIG, f"session_{imei}_1"),
+            )
+            for imei in imeis
+        ))
+
+    results = asyncio.run(check_in_all())
+    assert all(status == 200 for _, status in results)
+    assert all(
+        storage.get("sessions", f"session_{imei}_1").to_dict()["status"] == "returned to Galooli"
+        for imei in imeis
+    )
+
+
+def test_asgi_app_routes_swan_posts(storage):
+    fallback_scopes = []
+
+    async def fallback(scope, receive, send):
+        fallback_scopes.append(scope)
+
+    application = create_asgi_app(fallback)
+    sent = []
+
+    async def request(method, path, body=b""):
+        async def receive():
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {
+            "type": "http",
+            "method": method,
+            "path": path,
+            "headers": [(b"Wep-Imei", b"123111111113"), (b"Content-Type", b"text/csv")],
+        }
+        await application(scope, receive, send)
+
+    asyncio.run(request("POST", "/swan", b"a,b"))
+    asyncio.run(request("GET", "/swan"))
+
+    assert sent[0]["status"] == 200
+    assert json.loads(sent[1]["body"])["cmd"]["type"] == "get_cfg"
+    assert [scope["method"] for scope in fallback_scopes] == ["GET"]
+
+
+def test_async_post_keeps_blocking_calls_off_the_loop(storage):
+    import threading
+
+    storage.set("sessions", "session_123111111113_1", {"status": "sent get_cfg"})
+    headers = {"wep-imei": "123111111113", "content-type": "application/json"}
+    threads = []
+
+    def spy(method):
+        def call(*args, **kwargs):
+            threads.append(threading.current_thread())
+            return method(*args, **kwargs)
+        return call
+
+    async def post():
+        await handle_swan_post_async(headers, get_cfg_body(SWAN_DEFAULT_CONFIG))
+        return threading.current_thread()
+
+    # Queuing a message can block, and a device config hash that expired needs a read
+    message_queue = MagicMock()
+    message_queue.enqueue.side_effect = spy(lambda *args, **kwargs: True)
+    with patch("app.utils.db_utils.message_queue", message_queue), \
+            patch.object(storage, "get", spy(storage.get)):
+        loop_thread = asyncio.run(post())
+
+    assert message_queue.enqueue.called
+    assert threads
+    assert loop_thread not in threads
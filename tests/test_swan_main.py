@@ -1,7 +1,11 @@
+import base64
+import json
+
 import pytest
 from flask import Flask, jsonify, request
 from app import create_app  # Adjust the import based on your app structure
-from unittest.mock import patch, MagicMock
+from app.config import SWAN_DEFAULT_CONFIG
+from app.utils.db_utils import DEVICE_META_FIELDS
 
 # This mimcs the action of a SWAN device
 
@@ -19,7 +23,7 @@ def test_get_swan(client):
     assert response.status_code == 200
     assert isinstance(response.get_json(), list)
 
-def test_post_swan_csv(client):
+def test_post_swan_csv(client, storage):
     headers = {
         "Wep-Imei": "123111111113",
         "Content-Type": "text/csv"
@@ -28,8 +32,10 @@ def test_post_swan_csv(client):
     assert response.status_code == 200
     assert "cmd" in response.get_json()
 
-@patch('app.views.main.db')
-def test_post_swan_json_get_cfg_success(mock_db, client):
+    session_id = response.get_json()["cmd"]["id"]
+    assert storage.get("sessions", session_id).to_dict()["status"] == "sent get_cfg"
+
+def test_post_swan_json_get_cfg_success(client, storage):
     headers = {
         "Wep-Imei": "123111111113",
         "Content-Type": "application/json"
@@ -38,15 +44,13 @@ def test_post_swan_json_get_cfg_success(mock_db, client):
         "cmd_res": {
             "type": "get_cfg",
             "id": "session_123111111113_1",
-            "res_code": 0
+            "res_code": 0,
+            "content": base64.b64encode(json.dumps(SWAN_DEFAULT_CONFIG).encode("utf-8")).decode("ascii")
         }
     }
 
-    # Mock the Firestore document get and update methods
-    mock_document = MagicMock()
-    mock_document.get.return_value.exists = True
-    mock_document.get.return_value.to_dict.return_value = {"key": "value"}  # Return a serializable dictionary
-    mock_db.collection.return_value.document.return_value = mock_document
+    storage.set("sessions", "session_123111111113_1", {"session_id": "session_123111111113_1", "status": "sent get_cfg"})
+    storage.set("command_to_swan", "update-123111111113", {"key": "value"})
 
     response = client.post("/swan", headers=headers, json=payload)
 
@@ -54,11 +58,13 @@ def test_post_swan_json_get_cfg_success(mock_db, client):
     assert "cmd" in response.get_json()
     assert response.get_json()["cmd"]["type"] == "set_cfg"
 
-    # Verify that the document update method was called with the correct arguments
-    mock_document.update.assert_called_with({"status": "sent set_cfg"})
+    # Verify that the session, device and command documents were updated
+    assert storage.get("sessions", "session_123111111113_1").to_dict()["status"] == "sent set_cfg"
+    device = storage.get("swan_devices", "123111111113").to_dict()
+    assert {key: value for key, value in device.items() if key not in DEVICE_META_FIELDS} == SWAN_DEFAULT_CONFIG
+    assert not storage.get("command_to_swan", "update-123111111113").exists
     
-@patch('app.views.main.db')
-def test_post_swan_json_get_cfg_failure(mock_db, client):
+def test_post_swan_json_get_cfg_failure(client, storage):
     headers = {
         "Wep-Imei": "123111111113",
         "Content-Type": "application/json"
@@ -71,17 +77,13 @@ def test_post_swan_json_get_cfg_failure(mock_db, client):
         }
     }
 
-    # Mock the Firestore document get and update methods
-    mock_document = MagicMock()
-    mock_document.get.return_value.exists = True
-    mock_document.get.return_value.to_dict.return_value = {"key": "value"}  # Return a serializable dictionary
-    mock_db.collection.return_value.document.return_value = mock_document
+    storage.set("sessions", "session_123111111113_1", {"session_id": "session_123111111113_1", "status": "sent get_cfg"})
+    storage.set("command_to_swan", "update-123111111113", {"key": "value"})
 
     response = client.post("/swan", headers=headers, json=payload)
     assert response.status_code == 400
 
-@patch('app.views.main.db')
-def test_post_swan_json_set_cfg_success(mock_db, client):
+def test_post_swan_json_set_cfg_success(client, storage):
     headers = {
         "Wep-Imei": "123111111113",
         "Content-Type": "application/json"
@@ -94,18 +96,14 @@ def test_post_swan_json_set_cfg_success(mock_db, client):
         }
     }
 
-    # Mock the Firestore document get and update methods
-    mock_document = MagicMock()
-    mock_document.get.return_value.exists = True
-    mock_document.get.return_value.to_dict.return_value = {"key": "value"}  # Return a serializable dictionary
-    mock_db.collection.return_value.document.return_value = mock_document
+    storage.set("sessions", "session_123111111113_1", {"session_id": "session_123111111113_1", "status": "sent get_cfg"})
+    storage.set("command_to_swan", "update-123111111113", {"key": "value"})
 
     response = client.post("/swan", headers=headers, json=payload)
     assert response.status_code == 200
     assert "cmd" in response.get_json()
 
-@patch('app.views.main.db')
-def test_post_swan_json_set_cfg_failure(mock_db, client):
+def test_post_swan_json_set_cfg_failure(client, storage):
     headers = {
         "Wep-Imei": "123111111113",
         "Content-Type": "application/json"
@@ -118,11 +116,8 @@ def test_post_swan_json_set_cfg_failure(mock_db, client):
         }
     }
 
-    # Mock the Firestore document get and update methods
-    mock_document = MagicMock()
-    mock_document.get.return_value.exists = True
-    mock_document.get.return_value.to_dict.return_value = {"key": "value"}  # Return a serializable dictionary
-    mock_db.collection.return_value.document.return_value = mock_document
+    storage.set("sessions", "session_123111111113_1", {"session_id": "session_123111111113_1", "status": "sent get_cfg"})
+    storage.set("command_to_swan", "update-123111111113", {"key": "value"})
 
     response = client.post("/swan", headers=headers, json=payload)
     assert response.status_code == 400
\ No newline at end of file
@@ -0,0 +1,90 @@
+import json
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from app import create_app
+
+
+@pytest.fixture
+def client():
+    app = create_app()
+    app.config['TESTING'] = True
+    with app.test_client() as client:
+        with app.app_context():
+            yield client
+
+
+@pytest.fixture
+def messages(storage):
+    start = datetime(2024, 5, 1, tzinfo=timezone.utc)
+    for n in range(5):
+        storage.set("messages", f"message_{n}", {
+            "n": n,
+            "imei": "123111111113" if n % 2 == 0 else "123111111114",
+            "session_id": f"session_{n}",
+            "created_at": start + timedelta(hours=n),
+        })
+
+
+def test_get_swan_pages_newest_first(client, messages):
+    response = client.get("/swan?limit=2")
+    assert response.status_code == 200
+    assert [message["n"] for message in response.get_json()] == [4, 3]
+
+    cursor = response.headers["X-Next-Cursor"]
+    response = client.get(f"/swan?limit=2&start_after={cursor}")
+    assert [message["n"] for message in response.get_json()] == [2, 1]
+
+    cursor = response.headers["X-Next-Cursor"]
+    response = client.get(f"/swan?limit=2&start_after={cursor}")
+    assert [message["n"] for message in response.get_json()] == [0]
+    assert "X-Next-Cursor" not in response.headers
+
+
+def test_get_swan_is_unpaged_without_limit(client, messages, monkeypatch):
+    monkeypatch.setattr("app.views.main.Config.MESSAGES_PAGE_SIZE", 2)
+    response = client.get("/swan")
+    assert [message["n"] for message in response.get_json()] == [4, 3, 2, 1, 0]
+    assert "X-Next-Cursor" not in response.headers
+
+
+def test_get_swan_filters(client, messages):
+    response = client.get("/swan?imei=123111111113&order=asc")
+    assert [message["n"] for message in response.get_json()] == [0, 2, 4]
+
+    response = client.get("/swan?session_id=session_3")
+    assert [message["n"] for message in response.get_json()] == [3]
+
+    response = client.get("/swan?since=2024-05-01T01:00:00Z&until=2024-05-01T03:00:00Z")
+    assert [message["n"] for message in response.get_json()] == [2, 1]
+
+
+def test_get_swan_ndjson(client, messages):
+    response = client.get("/swan?format=ndjson&order=asc")
+    assert response.status_code == 200
+    assert response.mimetype == "application/x-ndjson"
+
+    lines = response.get_data(as_text=True).splitlines()
+    assert [json.loads(line)["n"] for line in lines] == [0, 1, 2, 3, 4]
+
+
+def test_get_swan_rejects_invalid_parameters(client):
+    assert client.get("/swan?limit=0").status_code == 400
+    assert client.get("/swan?start_after=not-a-cursor").status_code == 400
+    assert client.get("/swan?since=yesterday").status_code == 400
+
+
+def test_legacy_messages_are_listed_after_backfill(client, messages, storage):
+    from app.utils.message_backfill import backfill_created_at, backfill_once
+
+    storage.set("messages", "legacy", {"n": -1, "imei": "123111111113"})
+    assert -1 not in [message.get("n") for message in client.get("/swan").get_json()]
+
+    assert backfill_once(storage) == 1
+    assert backfill_once(storage) == 0
+    assert backfill_created_at(storage, batch_size=2) == 0
+
+    # The update time of a legacy message is later than the fixture's messages
+    listed = [message["n"] for message in client.get("/swan").get_json() if "n" in message]
+    assert listed == [-1, 4, 3, 2, 1, 0]
+    assert isinstance(storage.get("messages", "legacy").to_dict()["created_at"], datetime)
@@ -0,0 +1,82 @@
+from unittest.mock import patch, MagicMock
+
+import pytest
+
+from app import create_app
+from app.utils import db_utils
+from app.utils.db_utils import UnitOfWork
+
+
+def test_set_then_update_is_merged_into_one_set():
+    mock_storage = MagicMock()
+    uow = UnitOfWork(mock_storage)
+    uow.set("sessions", "session_1", {"session_id": "session_1", "status": "created"})
+    uow.update("sessions", "session_1", {"status": "sent get_cfg"})
+
+    assert len(uow) == 1
+    assert uow.commit() == 1
+
+    mock_storage.commit.assert_called_once_with([
+        ("set", "sessions", "session_1", {"session_id": "session_1", "status": "sent get_cfg"}),
+    ])
+
+
+def test_updates_are_merged_and_delete_wins():
+    mock_storage = MagicMock()
+    uow = UnitOfWork(mock_storage)
+    uow.update("sessions", "session_1", {"status": "sent set_cfg"})
+    uow.update("sessions", "session_1", {"note": "x"})
+    uow.set("command_to_swan", "update-1", {"nb1_apn": "iot"})
+    uow.delete("command_to_swan", "update-1")
+
+    assert uow.commit() == 2
+
+    mock_storage.commit.assert_called_once_with([
+        ("update", "sessions", "session_1", {"status": "sent set_cfg", "note": "x"}),
+        ("delete", "command_to_swan", "update-1", None),
+    ])
+
+
+def test_empty_unit_of_work_does_not_commit():
+    mock_storage = MagicMock()
+    assert UnitOfWork(mock_storage).commit() == 0
+    mock_storage.commit.assert_not_called()
+
+
+@patch('app.utils.db_utils.message_queue', None)
+def test_csv_handshake_commits_one_batch(storage):
+    app = create_app()
+    app.config['TESTING'] = True
+    headers = {
+        "Wep-Imei": "123111111113",
+        "Content-Type": "text/csv"
+    }
+    with patch.object(storage, "commit", wraps=storage.commit) as commit:
+        with app.test_client() as client:
+            response = client.post("/swan", headers=headers, data="a,b,c")
+
+    assert response.status_code == 200
+    assert response.get_json()["cmd"]["type"] == "get_cfg"
+
+    # The session is created and advanced in one merged write, next to the CSV message
+    commit.assert_called_once()
+    writes = commit.call_args.args[0]
+    assert [(op, collection) for op, collection, _, _ in writes] == [("set", "messages"), ("set", "sessions")]
+    assert writes[1][3]["status"] == "sent get_cfg"
+
+
+def test_command_index_follows_committed_writes_only(storage):
+    command_index = MagicMock()
+    with patch.object(db_utils, "command_index", command_index):
+        with patch.object(storage, "commit", side_effect=RuntimeError("unavailable")):
+            with pytest.raises(RuntimeError):
+                with db_utils.unit_of_work():
+                    db_utils.set_item_command_to_swan_collection("1", {"nb1_apn": "iot"})
+                    db_utils.delete_item_command_to_swan_collection("2")
+        command_index.put.assert_not_called()
+        command_index.discard.assert_not_called()
+
+        with db_utils.unit_of_work():
+            db_utils.set_item_command_to_swan_collection("1", {"nb1_apn": "iot"})
+            command_index.put.assert_not_called()
+        command_index.put.assert_called_once_with("update-1", {"nb1_apn": "iot"})
@@ -1,7 +1,6 @@
 import pytest
 from flask import Flask
 from dotenv import load_dotenv
-from unittest.mock import patch, MagicMock
 import os
 
 load_dotenv()
@@ -17,8 +16,7 @@ def client():
             # Initialize your database or other setup here if needed
             yield client
 
-@patch('app.views.main.db')
-def test_update_swan(mock_db, client):
+def test_update_swan(client, storage):
     imei = "123111111113"
     url = f"/add/command_to_swan/{imei}"
     payload = {
@@ -116,14 +114,13 @@ def test_update_swan(mock_db, client):
         "upload_weeks": 0
     }
 
-    # Mock the Firestore document set method
-    mock_document = MagicMock()
-    mock_db.collection.return_value.document.return_value = mock_document
+    # An earlier command is waiting for the device
+    storage.set("command_to_swan", f"update-{imei}", {"nb1_apn": "old"})
 
     response = client.post(url, json=payload)
     print(response.data)  # Debugging statement to check response data
     assert response.status_code == 200
     assert response.get_json() == {'message': 'Swan device updated successfully!'}
 
-    # Verify that the document set method was called with the correct arguments
-    mock_document.set.assert_called_with(payload)
\ No newline at end of file
+    # Verify that the command document was replaced with the payload
+    assert storage.get("command_to_swan", f"update-{imei}").to_dict() == payload
\ No newline at end of file
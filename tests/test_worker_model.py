@@ -0,0 +1,57 @@
+import importlib.util
+import os
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from app.storage.firestore import FirestoreStorage
+
+
+GUNICORN_CONFIG = Path(__file__).resolve().parent.parent / "gunicorn_config.py"
+
+
+def load_gunicorn_config(monkeypatch, **env):
+    for name in ("GUNICORN_PROFILE", "WEB_CONCURRENCY", "GUNICORN_THREADS", "GUNICORN_MAX_REQUESTS"):
+        monkeypatch.delenv(name, raising=False)
+    for name, value in env.items():
+        monkeypatch.setenv(name, value)
+    spec = importlib.util.spec_from_file_location("gunicorn_config", GUNICORN_CONFIG)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_firestore_client_is_created_on_first_use_and_after_fork(monkeypatch):
+    with patch("app.storage.firestore.create_firestore_client", side_effect=lambda: MagicMock()) as create:
+        storage = FirestoreStorage()
+        create.assert_not_called()
+
+        storage.connect()
+        client = storage.client
+        assert create.call_count == 1
+
+        pid = os.getpid()
+        monkeypatch.setattr(os, "getpid", lambda: pid + 1)
+        assert storage.client is not client
+        assert create.call_count == 2
+
+
+def test_gunicorn_workers_are_sized_from_cpus(monkeypatch):
+    config = load_gunicorn_config(monkeypatch)
+    assert config.worker_class == "gthread"
+    assert config.workers == config.cpus + 1
+    assert config.threads == 4
+    assert config.preload_app
+    assert config.max_requests_jitter == config.max_requests // 10
+    assert config.wsgi_app == "app:create_app()"
+
+    config = load_gunicorn_config(monkeypatch, GUNICORN_PROFILE="sync", WEB_CONCURRENCY="3")
+    assert (config.worker_class, config.workers, config.threads) == ("sync", 3, 1)
+
+    config = load_gunicorn_config(monkeypatch, GUNICORN_PROFILE="uvicorn")
+    assert config.worker_class == "uvicorn.workers.UvicornWorker"
+    assert config.wsgi_app == "app.asgi:create_asgi_app()"
+
+    with pytest.raises(ValueError):
+        load_gunicorn_config(monkeypatch, GUNICORN_PROFILE="eventlet")
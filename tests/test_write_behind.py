@@ -0,0 +1,151 @@
+import threading
+import time
+
+import pytest
+from unittest.mock import MagicMock
+
+from app.utils.write_behind import MessageWriteQueue
+
+
+@pytest.fixture
+def mock_storage():
+    storage = MagicMock()
+    storage.new_id.return_value = "generated"
+    return storage
+
+
+def test_flush_splits_into_batches(mock_storage):
+    message_queue = MessageWriteQueue(mock_storage, batch_size=2, flush_interval=60)
+    # Keep the worker from draining the queue
+    message_queue.start = MagicMock()
+    message_queue.enqueue({"n": 1}, document_id="a")
+    message_queue.enqueue({"n": 2}, document_id="b")
+    message_queue.enqueue({"n": 3}, document_id="c")
+    message_queue.flush()
+
+    mock_storage.commit.assert_any_call([
+        ("set", "messages", "a", {"n": 1}),
+        ("set", "messages", "b", {"n": 2}),
+    ])
+    mock_storage.commit.assert_any_call([("set", "messages", "c", {"n": 3})])
+    assert mock_storage.commit.call_count == 2
+    assert message_queue.stats()["written"] == 3
+    assert message_queue.stats()["flushes"] == 2
+
+
+def test_flush_on_interval(mock_storage):
+    message_queue = MessageWriteQueue(mock_storage, batch_size=500, flush_interval=0.05)
+    message_queue.enqueue({"n": 1})
+
+    for _ in range(100):
+        if message_queue.stats()["written"] == 1:
+            break
+        time.sleep(0.01)
+
+    assert message_queue.stats()["written"] == 1
+    assert message_queue.stats()["queue_depth"] == 0
+    message_queue.stop()
+
+
+def test_flush_waits_for_the_batch_in_flight(mock_storage):
+    writing, release = threading.Event(), threading.Event()
+
+    def commit(writes):
+        writing.set()
+        release.wait(5)
+
+    mock_storage.commit.side_effect = commit
+    message_queue = MessageWriteQueue(mock_storage, flush_interval=0.01)
+    message_queue.enqueue({"n": 1})
+    assert writing.wait(5)
+
+    flushed = threading.Thread(target=message_queue.flush)
+    flushed.start()
+    flushed.join(0.1)
+    assert flushed.is_alive()
+
+    release.set()
+    flushed.join(5)
+    assert not flushed.is_alive()
+    assert message_queue.stats()["written"] == 1
+    message_queue.stop()
+
+
+def test_full_queue_writes_synchronously(mock_storage):
+    message_queue = MessageWriteQueue(mock_storage, max_size=1, put_timeout=0)
+    # Keep the worker from draining the queue
+    message_queue.start = MagicMock()
+    assert message_queue.enqueue({"n": 1}) is True
+    assert message_queue.enqueue({"n": 2}) is False
+
+    stats = message_queue.stats()
+    assert stats["sync_writes"] == 1
+    assert stats["queue_depth"] == 1
+    mock_storage.commit.assert_called_once_with([("set", "messages", "generated", {"n": 2})])
+
+
+def test_failed_flush_is_requeued(mock_storage, monkeypatch):
+    sleeps = []
+    monkeypatch.setattr("app.utils.write_behind.time.sleep", sleeps.append)
+    mock_storage.commit.side_effect = RuntimeError("unavailable")
+    message_queue = MessageWriteQueue(mock_storage, max_retries=2)
+    message_queue.start = MagicMock()
+    message_queue.enqueue({"n": 1})
+    message_queue.flush()
+
+    stats = message_queue.stats()
+    assert stats["flush_errors"] == 2
+    assert stats["requeued"] == 1
+    assert stats["dropped"] == 0
+    assert stats["queue_depth"] == 1
+    # No sleep after the last attempt
+    assert len(sleeps) == 1
+
+    mock_storage.commit.side_effect = None
+    message_queue.flush()
+    assert message_queue.stats()["written"] == 1
+    assert message_queue.stats()["queue_depth"] == 0
+
+
+def test_failed_flush_of_full_queue_is_dropped(mock_storage, monkeypatch):
+    monkeypatch.setattr("app.utils.write_behind.time.sleep", lambda seconds: None)
+    message_queue = MessageWriteQueue(mock_storage, max_size=1, max_retries=1)
+    message_queue.start = MagicMock()
+    message_queue.enqueue({"n": 1})
+    message_queue._queue.get_nowait()
+    message_queue._queue.put_nowait((None, {"n": 2}))
+    mock_storage.commit.side_effect = RuntimeError("unavailable")
+    message_queue._flush_batch([(None, {"n": 1}), (None, {"n": 3})])
+
+    stats = message_queue.stats()
+    assert stats["requeued"] == 0
+    assert stats["dropped"] == 2
+
+
+def test_failed_synchronous_write_raises(mock_storage, monkeypatch):
+    monkeypatch.setattr("app.utils.write_behind.time.sleep", lambda seconds: None)
+    message_queue = MessageWriteQueue(mock_storage, max_size=1, put_timeout=0, max_retries=2)
+    message_queue.start = MagicMock()
+    message_queue.enqueue({"n": 1})
+    mock_storage.commit.side_effect = RuntimeError("unavailable")
+
+    with pytest.raises(RuntimeError):
+        message_queue.enqueue({"n": 2})
+    assert message_queue.stats()["sync_writes"] == 0
+
+
+def test_queue_counters_are_exported(mock_storage, monkeypatch):
+    from app.utils.metrics import REGISTRY
+    from app.utils.write_behind import MESSAGE_QUEUE_DEPTH, MESSAGE_QUEUE_MESSAGES
+
+    message_queue = MessageWriteQueue(mock_storage, max_size=1, put_timeout=0)
+    message_queue.start = MagicMock()
+    monkeypatch.setattr(MESSAGE_QUEUE_DEPTH, "_function", lambda: message_queue.stats()["queue_depth"])
+    enqueued = MESSAGE_QUEUE_MESSAGES.value(outcome="enqueued")
+    sync_writes = MESSAGE_QUEUE_MESSAGES.value(outcome="sync_writes")
+    message_queue.enqueue({"n": 1})
+    message_queue.enqueue({"n": 2})
+
+    assert MESSAGE_QUEUE_MESSAGES.value(outcome="enqueued") == enqueued + 1
+    assert MESSAGE_QUEUE_MESSAGES.value(outcome="sync_writes") == sync_writes + 1
+    assert "swan_message_queue_depth 1" in REGISTRY.render().splitlines()